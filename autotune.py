@@ -0,0 +1,218 @@
+import json
+import multiprocessing
+import os
+import platform
+import time
+from typing import Dict, List, Optional, Sequence
+
+DEFAULT_BATCH_SIZES = (4, 8, 16, 32, 64)
+
+
+def cpu_model() -> str:
+    """CPU model name of this host (from /proc/cpuinfo on Linux)."""
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as cpuinfo:
+            for line in cpuinfo:
+                key, _, value = line.partition(":")
+                if key.strip() == "model name":
+                    return value.strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def cache_key(model_name: str, backend: str, workers: int) -> str:
+    """Key of tuned settings: everything besides the settings themselves that decides the best choice."""
+    import torch
+    return f"{cpu_model()}|{os.cpu_count()} cores|{workers} workers|{model_name}|{backend}|torch {torch.__version__}"
+
+
+def candidate_threads(cores: int, workers: int) -> List[int]:
+    """Intra-op thread counts to try: powers of two up to each worker's share of the cores, and the share itself."""
+    share = max(1, cores // max(1, workers))
+    candidates = []
+    threads = 1
+    while threads < share:
+        candidates.append(threads)
+        threads *= 2
+    candidates.append(share)
+    return candidates
+
+
+def load_cached(path: str, key: str) -> Optional[Dict]:
+    """Settings tuned earlier for this key, or None."""
+    try:
+        with open(path, encoding="utf-8") as source:
+            return json.load(source).get(key)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached(path: str, key: str, settings: Dict):
+    """Store tuned settings under key, keeping the entries of other hosts and models."""
+    try:
+        with open(path, encoding="utf-8") as source:
+            entries = json.load(source)
+    except (OSError, ValueError):
+        entries = {}
+    entries[key] = settings
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as output:
+        json.dump(entries, output, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _time_forward(checker, encoded, seconds: float) -> List[float]:
+    """Run forward passes over the same padded batch for about `seconds`, returning each pass's latency."""
+    checker.backend(encoded)  # warm up this shape
+    latencies = []
+    stop = time.perf_counter() + seconds
+    while len(latencies) < 3 or time.perf_counter() < stop:
+        start = time.perf_counter()
+        checker.backend(encoded)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def tune(
+    checker,
+    workers: int = 1,
+    batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+    max_batch_ms: float = 100.0,
+    seconds_per_candidate: float = 0.5,
+    sequence_tokens: int = 128,
+) -> Dict:
+    """
+    Search intra-op thread counts and batch sizes for a BertModerationChecker on this host.
+
+    Every candidate runs forward passes over synthetic windows of
+    sequence_tokens tokens. The choice is the highest throughput among the
+    candidates whose median forward pass stays within max_batch_ms, or the
+    fastest candidate if none does. Thread counts are limited to each
+    worker's share of the cores so that workers do not oversubscribe them.
+
+    Returns:
+        The chosen settings with the measurements of every candidate
+    """
+    import torch
+
+    words = " ".join(["moderation"] * max(1, sequence_tokens - 2))
+    window = checker._split_windows(checker._encode([words]))[0]
+    padded = {size: checker.tokenizer.pad([window] * size, padding=True, return_tensors="pt") for size in batch_sizes}
+
+    original_threads = torch.get_num_threads()
+    candidates = []
+    try:
+        for threads in candidate_threads(os.cpu_count() or 1, workers):
+            torch.set_num_threads(threads)
+            for size in batch_sizes:
+                latencies = sorted(_time_forward(checker, padded[size], seconds_per_candidate))
+                candidates.append({
+                    "intra_op_threads": threads,
+                    "batch_size": size,
+                    "batch_ms": latencies[len(latencies) // 2] * 1000,
+                    "windows_per_s": size * len(latencies) / sum(latencies),
+                })
+    finally:
+        torch.set_num_threads(original_threads)
+
+    within_budget = [candidate for candidate in candidates if candidate["batch_ms"] <= max_batch_ms]
+    if within_budget:
+        best = max(within_budget, key=lambda candidate: candidate["windows_per_s"])
+    else:
+        best = min(candidates, key=lambda candidate: candidate["batch_ms"])
+    return {
+        **best,
+        "inter_op_threads": 1,
+        "workers": workers,
+        "max_batch_ms": max_batch_ms,
+        "sequence_tokens": sequence_tokens,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "candidates": candidates,
+    }
+
+
+def apply(checker, settings: Dict):
+    """Use tuned settings in this process: torch thread counts and the checker's forward batch size."""
+    import torch
+
+    torch.set_num_threads(settings["intra_op_threads"])
+    try:
+        torch.set_num_interop_threads(settings["inter_op_threads"])
+    except RuntimeError:
+        # Only possible before any inter-op parallel work has started
+        pass
+    checker.batch_size = settings["batch_size"]
+
+
+def _search(checker, cache_path: str, key: str, workers: int, max_batch_ms: float, options: Dict) -> Dict:
+    """Search the settings in this process and cache them under key."""
+    start = time.monotonic()
+    settings = tune(checker, workers=workers, max_batch_ms=max_batch_ms, **options)
+    settings["search_seconds"] = time.monotonic() - start
+    save_cached(cache_path, key, settings)
+    return settings
+
+
+def _search_in_subprocess(checker, cache_path: str, key: str, workers: int, max_batch_ms: float, options: Dict) -> Dict:
+    """
+    Search the settings in a forked child process and read them back from the cache.
+
+    The child runs the forward passes, so this process starts no torch thread
+    pools and keeps its thread settings, and can still fork workers safely.
+    """
+    process = multiprocessing.get_context("fork").Process(
+        target=_search, args=(checker, cache_path, key, workers, max_batch_ms, options), name="autotune"
+    )
+    process.start()
+    process.join()
+    settings = load_cached(cache_path, key)
+    if process.exitcode != 0 or settings is None:
+        raise RuntimeError(f"Autotuning process failed with exit code {process.exitcode}")
+    return settings
+
+
+def autotune(
+    checker,
+    cache_path: str,
+    workers: int = 1,
+    max_batch_ms: float = 100.0,
+    in_subprocess: bool = False,
+    **options,
+) -> Dict:
+    """
+    Apply tuned settings for this host, model and worker count, searching them only if none are cached.
+
+    Args:
+        checker: Loaded BertModerationChecker
+        cache_path: JSON file the chosen settings are kept in
+        workers: Number of processes sharing the cores
+        max_batch_ms: Latency budget of one forward pass
+        in_subprocess: Search in a forked child and only apply the batch size here, leaving the
+            thread counts to the processes that run inference (e.g. the workers of serve.py)
+        **options: Further arguments of tune()
+
+    Returns:
+        The chosen settings, with "source" set to "cache" or "search"
+    """
+    key = cache_key(checker.model_name, checker.backend.name, workers)
+    settings = load_cached(cache_path, key)
+    if settings is not None and settings.get("max_batch_ms") == max_batch_ms:
+        source = "cache"
+    elif in_subprocess:
+        settings = _search_in_subprocess(checker, cache_path, key, workers, max_batch_ms, options)
+        source = "search"
+    else:
+        settings = _search(checker, cache_path, key, workers, max_batch_ms, options)
+        source = "search"
+
+    if in_subprocess:
+        checker.batch_size = settings["batch_size"]
+    else:
+        apply(checker, settings)
+    print(
+        f"Autotuned BERT ({source}): {settings['intra_op_threads']} intra-op threads, "
+        f"batch size {settings['batch_size']}, {settings['windows_per_s']:.0f} windows/s, "
+        f"{settings['batch_ms']:.1f} ms per forward pass"
+    )
+    return {**settings, "key": key, "source": source}
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Parity, latency and throughput of the BERT inference backends.
+
+Usage:
+    python -m benchmarks.backends [--backends torch torch-int8 onnx onnx-int8] [--repeat 50]
+"""
+
+import argparse
+import statistics
+import time
+
+import config
+from checkers.bert_checker import BertModerationChecker
+
+SAMPLE_TEXTS = [
+    "You are an idiot and I will find you",
+    "The weather is nice today, let's go for a walk in the park.",
+    "I hate all of you, get out of here or I will hurt you.",
+    "Thanks for the quick reply, the package arrived on time.",
+] * 8
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["torch", "torch-int8", "onnx", "onnx-int8"])
+    parser.add_argument("--repeat", type=int, default=50, help="Measurements per backend")
+    args = parser.parse_args()
+
+    print(f"{'backend':<12} {'load s':>7} {'p50 1 text ms':>14} {'texts/s @32':>12} {'max delta':>10}")
+    for backend in args.backends:
+        start = time.perf_counter()
+        try:
+            checker = BertModerationChecker(
+                model_name=config.BERT_MODEL_NAME,
+                batch_size=len(SAMPLE_TEXTS),
+                backend=backend,
+                cache_dir=config.MODEL_CACHE_DIR,
+            )
+        except ImportError as e:
+            print(f"{backend:<12} unavailable: {e}")
+            continue
+        load_seconds = time.perf_counter() - start
+
+        # Warm up kernels and allocators before measuring
+        checker.check_batch(SAMPLE_TEXTS)
+
+        latencies = []
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            checker.check(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        for _ in range(max(1, args.repeat // 5)):
+            checker.check_batch(SAMPLE_TEXTS)
+        throughput = max(1, args.repeat // 5) * len(SAMPLE_TEXTS) / (time.perf_counter() - start)
+
+        parity = checker.parity_report(SAMPLE_TEXTS)
+        print(
+            f"{backend:<12} {load_seconds:>7.2f} {statistics.median(latencies):>14.2f} "
+            f"{throughput:>12.1f} {parity['max_score_delta']:>10.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
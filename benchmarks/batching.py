@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Throughput of ModerationService.moderate_text with and without BERT micro-batching.
+
+Usage:
+    python -m benchmarks.batching [--duration 10] [--clients 1 8 64]
+"""
+
+import argparse
+import threading
+import time
+
+import config
+from service import ModerationService
+
+SAMPLE_TEXTS = [
+    "My email is test@website.de",
+    "Call me at 0172-9876543 tomorrow",
+    "You are an idiot and I will find you",
+    "The weather is nice today, let's go for a walk in the park.",
+]
+
+
+def run_clients(service: ModerationService, clients: int, duration: float) -> float:
+    """Run `clients` threads calling moderate_text for `duration` seconds and return texts/s."""
+    counts = [0] * clients
+    stop = time.monotonic() + duration
+
+    def client(index: int):
+        i = index
+        while time.monotonic() < stop:
+            service.moderate_text(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)])
+            counts[index] += 1
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per measurement")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 64], help="Concurrent client counts")
+    parser.add_argument("--batch-size", type=int, default=config.BATCH_MAX_SIZE, help="Batch size for the batched run")
+    parser.add_argument("--max-wait-ms", type=float, default=config.BATCH_MAX_WAIT_MS, help="Max wait for the batched run")
+    args = parser.parse_args()
+
+    configurations = [
+        ("unbatched", 1),
+        (f"batched (size={args.batch_size}, wait={args.max_wait_ms}ms)", args.batch_size),
+    ]
+
+    for label, batch_size in configurations:
+        service = ModerationService(
+            use_bert=True,
+            flagging_threshold=config.FLAGGING_THRESHOLD,
+            model_name=config.BERT_MODEL_NAME,
+            batch_max_size=batch_size,
+            batch_max_wait_ms=args.max_wait_ms,
+        )
+        if not service.use_bert:
+            raise SystemExit("BERT checker is not available; nothing to benchmark")
+
+        # Warm up the model before measuring
+        service.moderate_text(SAMPLE_TEXTS[0])
+
+        print(f"\n=== {label} ===")
+        for clients in args.clients:
+            throughput = run_clients(service, clients, args.duration)
+            print(f"{clients:>4} clients: {throughput:10.1f} texts/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark corpus: moderation request inputs read from a JSONL file."""
+
+import json
+import os
+import random
+from typing import List, Sequence, Tuple, Union
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.jsonl")
+
+# Fields tried in order for the text of a JSONL line; "input" is the /v1/moderations request body
+TEXT_FIELDS = ("input", "text", "body")
+
+ModerationInput = Union[str, List[str]]
+
+
+def load_corpus(path: str = DEFAULT_CORPUS) -> List[ModerationInput]:
+    """Read one moderation input (a text or a list of texts) per JSONL line."""
+    inputs = []
+    with open(path, encoding="utf-8") as source:
+        for number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            value = next((record[field] for field in TEXT_FIELDS if field in record), None)
+            if not isinstance(value, (str, list)):
+                raise ValueError(f"{path}:{number} has none of the fields {TEXT_FIELDS}")
+            inputs.append(value)
+    if not inputs:
+        raise ValueError(f"{path} contains no inputs")
+    return inputs
+
+
+def corpus_texts(inputs: Sequence[ModerationInput]) -> List[str]:
+    """Flatten list inputs into single texts."""
+    texts = []
+    for value in inputs:
+        if isinstance(value, str):
+            texts.append(value)
+        else:
+            texts.extend(value)
+    return texts
+
+
+def resize(texts: Sequence[str], size: int, rng: random.Random) -> str:
+    """Join random corpus texts into one text of exactly `size` characters."""
+    parts = []
+    length = 0
+    while length < size:
+        text = rng.choice(texts)
+        parts.append(text)
+        length += len(text) + 1
+    return " ".join(parts)[:size]
+
+
+def parse_size_mix(spec: Sequence[str]) -> List[Tuple[int, float]]:
+    """Parse "SIZE:WEIGHT" pairs such as ["100:0.7", "10000:0.3"] into (characters, weight)."""
+    mix = []
+    for item in spec:
+        size, _, weight = item.partition(":")
+        mix.append((int(size), float(weight or 1)))
+    return mix
+
+
+def build_requests(
+    inputs: Sequence[ModerationInput],
+    count: int,
+    size_mix: Sequence[Tuple[int, float]] = (),
+    seed: int = 0,
+) -> List[ModerationInput]:
+    """
+    Build `count` moderation inputs.
+
+    Without a size mix the corpus is replayed in order. With a size mix every
+    input is a single text whose length is drawn from the weighted sizes and
+    whose content is taken from the corpus.
+    """
+    if not size_mix:
+        return [inputs[i % len(inputs)] for i in range(count)]
+    rng = random.Random(seed)
+    texts = corpus_texts(inputs)
+    sizes = [size for size, _ in size_mix]
+    weights = [weight for _, weight in size_mix]
+    return [resize(texts, rng.choices(sizes, weights)[0], rng) for _ in range(count)]
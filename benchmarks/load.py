@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+HTTP load generator that replays the benchmark corpus against /v1/moderations.
+
+Runs closed-loop clients (each sends its next request as soon as the previous
+one is answered) against a running server for every concurrency level and
+reports p50/p95/p99 latency, requests/s, texts/s, errors and the peak RSS of
+the worker that answered /debug/runtime. Without --size-mix the corpus is
+replayed as is; with it every request is one text whose length in characters
+is drawn from the weighted sizes, e.g. --size-mix 100:0.7 2000:0.25 20000:0.05.
+
+With --bulk-clients, that many extra clients send lists of --bulk-size corpus
+texts in the bulk priority lane at the same time, and the latencies of both
+kinds of traffic are reported separately, so the interactive p99 can be
+compared with and without concurrent bulk load (or with --bulk-priority
+interactive, without the lanes).
+
+Usage:
+    python main.py &   # or python serve.py --workers 4
+    python -m benchmarks.load [--url http://127.0.0.1:8000] [--concurrency 1 8 32] [--duration 10]
+                              [--size-mix 100:0.7 20000:0.3] [--bulk-clients 2 --bulk-size 500]
+                              [--output load.json] [--baseline baseline.json]
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from benchmarks.corpus import DEFAULT_CORPUS, build_requests, corpus_texts, load_corpus, parse_size_mix
+from benchmarks.report import add_output_arguments, check_baseline, latency_stats, save_results
+
+
+def wait_until_ready(host: str, port: int, timeout: float):
+    """Poll /readyz (or /health on servers older than /readyz) until the server can serve moderation requests."""
+    deadline = time.monotonic() + timeout
+    path = "/readyz"
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=1)
+            connection.request("GET", path)
+            status = connection.getresponse().status
+            connection.close()
+            if status == 200:
+                return
+            if status == 404 and path == "/readyz":
+                path = "/health"
+                continue
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Server at {host}:{port} was not ready within {timeout}s")
+
+
+def server_peak_rss(host: str, port: int) -> int:
+    """Peak RSS in bytes reported by /debug/runtime (0 if unavailable)."""
+    try:
+        connection = http.client.HTTPConnection(host, port, timeout=5)
+        connection.request("GET", "/debug/runtime")
+        memory = json.loads(connection.getresponse().read()).get("memory", {})
+        connection.close()
+    except (OSError, ValueError):
+        return 0
+    return memory.get("peak_rss", memory.get("rss", 0))
+
+
+def run_clients(host: str, port: int, bodies: List[bytes], text_counts: List[int],
+                clients: int, duration: float, headers: Optional[Dict[str, str]] = None) -> Dict[str, float]:
+    """Run `clients` closed-loop clients for `duration` seconds and summarize the answered requests."""
+    headers = {"Content-Type": "application/json", **(headers or {})}
+    latencies = [[] for _ in range(clients)]
+    texts = [0] * clients
+    errors = [0] * clients
+    stop = time.monotonic() + duration
+
+    def client(index: int):
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+        i = index
+        while time.monotonic() < stop:
+            body = bodies[i % len(bodies)]
+            start = time.perf_counter()
+            try:
+                connection.request("POST", "/v1/moderations", body, headers)
+                response = connection.getresponse()
+                response.read()
+            except OSError:
+                errors[index] += 1
+                connection.close()
+                connection = http.client.HTTPConnection(host, port, timeout=60)
+                continue
+            if response.status == 200:
+                latencies[index].append((time.perf_counter() - start) * 1000)
+                texts[index] += text_counts[i % len(bodies)]
+            else:
+                errors[index] += 1
+            i += clients
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    answered = [latency for client_latencies in latencies for latency in client_latencies]
+    return {
+        **latency_stats(answered),
+        "requests": len(answered),
+        "errors": sum(errors),
+        "requests_per_s": len(answered) / elapsed,
+        "texts_per_s": sum(texts) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the server")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSONL file with one moderation input per line")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent client counts")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per concurrency level")
+    parser.add_argument("--size-mix", nargs="*", default=[], metavar="SIZE:WEIGHT",
+                        help="Replace the corpus inputs by single texts of these weighted sizes in characters")
+    parser.add_argument("--distinct", type=int, default=1000,
+                        help="Distinct request bodies generated from the corpus with --size-mix")
+    parser.add_argument("--bulk-clients", type=int, default=0,
+                        help="Extra clients sending bulk list requests during every concurrency level")
+    parser.add_argument("--bulk-size", type=int, default=500, help="Texts per bulk list request")
+    parser.add_argument("--bulk-priority", choices=["bulk", "interactive"], default="bulk",
+                        help="X-Priority of the bulk requests (interactive to measure without lanes)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ready-timeout", type=float, default=300.0, help="Seconds to wait for /readyz")
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname or "127.0.0.1", url.port or 80
+
+    inputs = load_corpus(args.corpus)
+    size_mix = parse_size_mix(args.size_mix)
+    requests = build_requests(inputs, args.distinct if size_mix else len(inputs), size_mix, args.seed)
+    bodies = [json.dumps({"model": "moderation-latest", "input": value}).encode("utf-8") for value in requests]
+    text_counts = [1 if isinstance(value, str) else len(value) for value in requests]
+    texts = corpus_texts(inputs)
+    bulk_body = json.dumps({
+        "model": "moderation-latest", "input": [texts[i % len(texts)] for i in range(args.bulk_size)]
+    }).encode("utf-8")
+
+    wait_until_ready(host, port, args.ready_timeout)
+
+    results = {}
+    print(f"{'clients':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'texts/s':>9} "
+          f"{'errors':>7} {'server peak RSS MiB':>20}")
+    for clients in args.concurrency:
+        bulk = {}
+        bulk_thread = None
+        if args.bulk_clients > 0:
+            def run_bulk():
+                bulk.update(run_clients(
+                    host, port, [bulk_body], [args.bulk_size], args.bulk_clients, args.duration,
+                    {"X-Priority": args.bulk_priority}
+                ))
+            bulk_thread = threading.Thread(target=run_bulk)
+            bulk_thread.start()
+        metrics = run_clients(host, port, bodies, text_counts, clients, args.duration)
+        if bulk_thread is not None:
+            bulk_thread.join()
+        metrics["server_peak_rss_bytes"] = server_peak_rss(host, port)
+        results[f"clients={clients}"] = metrics
+        print(
+            f"{clients:>7} {metrics['p50_ms']:>9.2f} {metrics['p95_ms']:>9.2f} {metrics['p99_ms']:>9.2f} "
+            f"{metrics['requests_per_s']:>9.1f} {metrics['texts_per_s']:>9.1f} {metrics['errors']:>7} "
+            f"{metrics['server_peak_rss_bytes'] / 2**20:>20.0f}"
+        )
+        if bulk:
+            results[f"clients={clients},bulk"] = bulk
+            print(
+                f"{'+bulk':>7} {bulk['p50_ms']:>9.2f} {bulk['p95_ms']:>9.2f} {bulk['p99_ms']:>9.2f} "
+                f"{bulk['requests_per_s']:>9.1f} {bulk['texts_per_s']:>9.1f} {bulk['errors']:>7}"
+            )
+
+    if args.output:
+        save_results(args.output, "load", results, settings={
+            "url": args.url,
+            "corpus": args.corpus,
+            "duration": args.duration,
+            "size_mix": args.size_mix,
+            "bulk_clients": args.bulk_clients,
+            "bulk_size": args.bulk_size,
+            "bulk_priority": args.bulk_priority,
+        })
+    if args.baseline:
+        check_baseline(results, args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
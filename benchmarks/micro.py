@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks of the moderation hot path on the benchmark corpus.
+
+Times RegexModerationChecker.check, BertModerationChecker.check,
+ModerationService.moderate_text, building and encoding the response and
+a single metrics observation (the instrumentation overhead, recorded several
+times per request, untraced and in a traced request) call by call, and reports p50/p95/p99 latency, calls/s,
+texts/s and peak RSS. The result cache is disabled so every call does the full work.
+
+Usage:
+    python -m benchmarks.micro [--iterations 2000] [--bert] [--output micro.json] [--baseline baseline.json]
+"""
+
+import argparse
+import time
+import uuid
+from typing import Callable, Dict, List
+
+import config
+import metrics
+import tracing
+from benchmarks.corpus import DEFAULT_CORPUS, corpus_texts, load_corpus
+from benchmarks.report import add_output_arguments, check_baseline, latency_stats, peak_rss, save_results
+from checkers import BERT_AVAILABLE, RegexModerationChecker
+from models import encode_json
+from service import ModerationService
+
+
+def measure(call: Callable[[str], object], texts: List[str], iterations: int) -> Dict[str, float]:
+    """Call `call` on the texts in turn `iterations` times and summarize per-call latencies."""
+    # Warm up caches, lazy initialization and allocators before measuring
+    for text in texts[:min(len(texts), 10)]:
+        call(text)
+
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        text = texts[i % len(texts)]
+        call_start = time.perf_counter()
+        call(text)
+        latencies.append((time.perf_counter() - call_start) * 1000)
+    elapsed = time.perf_counter() - start
+
+    return {
+        **latency_stats(latencies),
+        "requests_per_s": iterations / elapsed,
+        "texts_per_s": iterations / elapsed,
+        "peak_rss_bytes": peak_rss(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSONL file with one moderation input per line")
+    parser.add_argument("--iterations", type=int, default=2000, help="Calls per regex/service/response case")
+    parser.add_argument("--bert", action="store_true", help="Also benchmark BERT (loads the model)")
+    parser.add_argument("--bert-iterations", type=int, default=100, help="Calls per BERT case")
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    texts = corpus_texts(load_corpus(args.corpus))
+    results = {}
+
+    regex_checker = RegexModerationChecker()
+    results["regex.check"] = measure(regex_checker.check, texts, args.iterations)
+
+    regex_service = ModerationService(use_bert=False, flagging_threshold=config.FLAGGING_THRESHOLD)
+    results["service.moderate_text[regex]"] = measure(regex_service.moderate_text, texts, args.iterations)
+
+    # Response construction and encoding alone, from scores computed up front
+    checkers = regex_service.checkers
+    scored = {text: regex_service._get_scores(checkers, [text])[0] for text in texts}
+
+    def build_response(text: str) -> bytes:
+        return encode_json({
+            "id": f"modr-{uuid.uuid4().hex}",
+            "model": "moderation-latest",
+            "results": regex_service._build_results(checkers, [scored[text]])
+        })
+
+    results["response.build"] = measure(build_response, texts, args.iterations)
+
+    # Unregistered, so the benchmark does not show up in /metrics
+    overhead_histogram = metrics.Histogram("benchmark_observe_seconds", "Instrumentation overhead benchmark.")
+    results["metrics.observe"] = measure(lambda text: overhead_histogram.observe(len(text)), texts, args.iterations)
+    # Stage latencies also go to the trace of the current request (see tracing)
+    overhead_stage = metrics._TracedStageChild(overhead_histogram.labels(), "benchmark")
+    results["metrics.observe_stage"] = measure(lambda text: overhead_stage.observe(len(text)), texts, args.iterations)
+    with tracing.activate(tracing.Trace()):
+        results["metrics.observe_traced"] = measure(
+            lambda text: overhead_stage.observe(len(text)), texts, args.iterations
+        )
+
+    if args.bert:
+        if not BERT_AVAILABLE:
+            raise SystemExit("BERT checker is not available; run without --bert")
+        bert_service = ModerationService(
+            use_bert=True,
+            flagging_threshold=config.FLAGGING_THRESHOLD,
+            model_name=config.BERT_MODEL_NAME,
+            bert_backend=config.BERT_BACKEND,
+            model_cache_dir=config.MODEL_CACHE_DIR,
+            batch_max_size=1,
+        )
+        if bert_service.bert_status != "ready":
+            raise SystemExit("BERT checker failed to load")
+        results["bert.check"] = measure(bert_service.bert_checker.check, texts, args.bert_iterations)
+        results["service.moderate_text[bert]"] = measure(bert_service.moderate_text, texts, args.bert_iterations)
+
+    print(f"{'case':<30} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'texts/s':>11} {'peak RSS MiB':>13}")
+    for name, case in results.items():
+        print(
+            f"{name:<30} {case['p50_ms']:>9.3f} {case['p95_ms']:>9.3f} {case['p99_ms']:>9.3f} "
+            f"{case['texts_per_s']:>11.1f} {case['peak_rss_bytes'] / 2**20:>13.0f}"
+        )
+
+    if args.output:
+        save_results(args.output, "micro", results, settings={
+            "corpus": args.corpus,
+            "iterations": args.iterations,
+            "bert": args.bert,
+            "bert_backend": config.BERT_BACKEND if args.bert else None,
+        })
+    if args.baseline:
+        check_baseline(results, args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Single-pass RegexModerationChecker.check against the previous one-search-per-pattern loop,
+and the cost of locating and redacting matches (check_spans) on top of detection.
+
+Usage:
+    python -m benchmarks.regex [--repeat 2000] [--fuzz 20000]
+"""
+
+import argparse
+import random
+import string
+import timeit
+from typing import Dict
+
+from checkers import RegexModerationChecker
+
+PII_SNIPPETS = [
+    "max.mustermann@example.de",
+    "+49 30 12345678",
+    "0172-9876543",
+    "4532-1234-5678-9012",
+    "4111111111111111",
+    "192.168.1.1",
+    "2001:0db8:85a3:0000:0000:8a2e:0370:7334",
+    "DE89 3704 0044 0532 0130 00",
+    "IBAN:DE89370400440532013000",
+    "BIC: COBADEFFXXX",
+]
+
+FILLER = (
+    "The quarterly report was discussed in the meeting, and everyone agreed that "
+    "the next steps should be planned carefully before the deadline. "
+)
+
+
+def legacy_check(checker: RegexModerationChecker, text: str) -> Dict[str, float]:
+    """Previous implementation: one search per compiled pattern."""
+    scores = {}
+    for category, patterns in checker.compiled_patterns.items():
+        matches = sum(1 for pattern in patterns if pattern.search(text))
+        scores[category] = min(0.8 + (matches - 1) * 0.1, 1.0) if matches else 0.0
+    return scores
+
+
+def check_spans_valid(checker: RegexModerationChecker, text: str, spans):
+    """Spans must be ordered, non-overlapping matches of a pattern of their category."""
+    position = 0
+    for start, end, category in spans:
+        if start < position or not any(
+            (match := pattern.match(text, start)) is not None and match.end() == end
+            for pattern in checker.compiled_patterns[category]
+        ):
+            raise SystemExit(f"Invalid span {(start, end, category)} in {text!r}")
+        position = end
+
+
+def random_text(rng: random.Random) -> str:
+    """Short text mixing PII fragments, digits, separators and letters."""
+    alphabet = string.ascii_letters + string.digits + " .:-+@()\n" + "İıſK٣"
+    parts = []
+    for _ in range(rng.randint(1, 6)):
+        if rng.random() < 0.4:
+            snippet = rng.choice(PII_SNIPPETS)
+            cut = rng.randint(0, len(snippet))
+            parts.append(snippet[:cut] + rng.choice(["", " ", "-", "."]) + snippet[cut:])
+        else:
+            parts.append("".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30))))
+    return rng.choice(["", " ", "x"]).join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="Calls per timing measurement")
+    parser.add_argument("--fuzz", type=int, default=20000, help="Random texts checked for identical scores")
+    args = parser.parse_args()
+
+    checker = RegexModerationChecker()
+
+    rng = random.Random(0)
+    for _ in range(args.fuzz):
+        text = random_text(rng)
+        expected = legacy_check(checker, text)
+        actual = checker.check(text)
+        if actual != expected:
+            raise SystemExit(f"Score mismatch for {text!r}: {actual} != {expected}")
+    print(f"Scores identical on {args.fuzz} fuzzed texts")
+
+    rng = random.Random(1)
+    for _ in range(args.fuzz):
+        text = random_text(rng)
+        scores, spans = checker.check_spans(text)
+        if scores != checker.check(text):
+            raise SystemExit(f"check_spans scores differ for {text!r}: {scores} != {checker.check(text)}")
+        check_spans_valid(checker, text, spans)
+    print(f"check_spans scores identical and spans valid on {args.fuzz} fuzzed texts")
+
+    long_filler = FILLER * (10240 // len(FILLER))
+    cases = {
+        "short, no PII": "Hello, how are you doing today?",
+        "short, email": "My email is test@website.de, write me.",
+        "short, phone": "Call me at 0172-9876543 tomorrow",
+        "10 KB, no PII": long_filler,
+        "10 KB, PII at end": long_filler + " " + " ".join(PII_SNIPPETS),
+        "10 KB, PII at start": " ".join(PII_SNIPPETS) + " " + long_filler,
+    }
+
+    print(f"\n{'case':<22} {'legacy us':>10} {'single-pass us':>15} {'speedup':>8}")
+    for name, text in cases.items():
+        repeat = args.repeat if len(text) < 1000 else max(1, args.repeat // 20)
+        legacy = timeit.timeit(lambda: legacy_check(checker, text), number=repeat) / repeat * 1e6
+        current = timeit.timeit(lambda: checker.check(text), number=repeat) / repeat * 1e6
+        print(f"{name:<22} {legacy:>10.1f} {current:>15.1f} {legacy / current:>7.1f}x")
+
+    # Detection with spans and redaction against detection only
+    print(f"\n{'case':<22} {'check us':>10} {'+spans us':>10} {'+redact us':>11} {'overhead':>9}")
+    for name, text in cases.items():
+        repeat = args.repeat if len(text) < 1000 else max(1, args.repeat // 20)
+        current = timeit.timeit(lambda: checker.check(text), number=repeat) / repeat * 1e6
+        spans = timeit.timeit(lambda: checker.check_spans(text), number=repeat) / repeat * 1e6
+        redact = timeit.timeit(
+            lambda: checker.redact(text, checker.check_spans(text)[1]), number=repeat
+        ) / repeat * 1e6
+        print(f"{name:<22} {current:>10.1f} {spans:>10.1f} {redact:>11.1f} {redact / current - 1:>+8.0%}")
+
+
+if __name__ == "__main__":
+    main()
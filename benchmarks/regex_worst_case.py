@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Worst-case latency of the regex stage on adversarial and fuzzed inputs.
+
+Every case repeats a short unit that makes the patterns backtrack as much as
+possible per character (e.g. "a." after an "@" for the email pattern) up to
+each of the --sizes, and times RegexModerationChecker.check and check_spans.
+The growth exponent of the latency over the sizes (least squares in log-log
+space) is reported per case: 1 means linear, 2 quadratic. The fuzz stage adds
+the slowest of --fuzz random units as cases, checks that scans split into
+small segments find the same scores and spans as whole-text scans, and that
+linear mode flags the same texts as the unbounded built-in patterns.
+
+The checker runs with the server's default scan budget (--budget-ms): cases
+with runs longer than the quantifier cap are scanned with the unbounded
+built-in patterns, which can grow quadratically, and the budget bounds them.
+The "cut" column marks cases whose largest size ran out of the budget. The run
+fails if any case grows faster than --max-exponent in linear mode. With
+--legacy the checker runs without linear mode for comparison (keep the sizes
+small, its worst case is quadratic and the budget does not apply).
+
+Usage:
+    python -m benchmarks.regex_worst_case [--sizes 16384 65536 262144 1048576] [--fuzz 200]
+                                          [--budget-ms 250] [--legacy] [--processes 4]
+                                          [--output worst.json] [--baseline baseline.json]
+"""
+
+import argparse
+import math
+import random
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from benchmarks.regex import random_text
+from benchmarks.report import add_output_arguments, check_baseline, save_results
+import config
+from checkers import RegexModerationChecker
+
+# (prefix, repeated unit) per case
+ADVERSARIAL_CASES = {
+    "email local part": ("a@", "a."),
+    "email domains": ("", "x." * 30 + "@"),
+    "dotted words": ("", "a."),
+    "digit groups": ("", "1234 "),
+    "digit run": ("", "1"),
+    "ipv6 groups": ("", "a:"),
+    "iban groups": ("", "DE00 " + "AAAA " * 6),
+    "iban prefix": ("", "IBAN DE00" + "A" * 40 + " "),
+    "bic prefix": ("", "BIC "),
+    "symbols": ("", "%+-_"),
+}
+
+# Texts with matches near and beyond the quantifier cap, which linear mode must still flag
+LONG_MATCHES = (
+    "a" * 70 + "@example.com",
+    "a" * 300 + "@example.com",
+    "contact: " + "x" * 200 + "@" + "d" * 200 + ".com",
+    "contact: " + "x." * 400 + "@" + "d-" * 400 + "example.com, or 0172-9876543",
+    "IBAN DE89" + "A" * 60,
+    "IBAN DE89" + "A" * 600 + " and a@b.de",
+)
+
+FUZZ_ALPHABET = "aZ09.@:-_%+ \n"
+FUZZ_PREFIXES = ("", "a@", "IBAN ", "BIC ", "DE00 ")
+
+
+def adversarial_text(prefix: str, unit: str, size: int) -> str:
+    """The prefix followed by the unit repeated up to size characters."""
+    return prefix + unit * max(1, (size - len(prefix)) // len(unit))
+
+
+def time_call(call, text: str, min_seconds: float = 0.05) -> float:
+    """Fastest of repeated calls in milliseconds, repeating for at least min_seconds."""
+    best = math.inf
+    stop = time.perf_counter() + min_seconds
+    runs = 0
+    while runs < 2 or time.perf_counter() < stop:
+        start = time.perf_counter()
+        call(text)
+        best = min(best, time.perf_counter() - start)
+        runs += 1
+    return best * 1000
+
+
+def growth_exponent(sizes: Sequence[int], latencies_ms: Sequence[float]) -> float:
+    """Slope of log(latency) over log(size): 1 for linear growth, 2 for quadratic."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(latency, 1e-6)) for latency in latencies_ms]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+
+
+def fuzz_cases(checker: RegexModerationChecker, count: int, size: int, keep: int, seed: int) -> Dict[str, Tuple[str, str]]:
+    """The `keep` random (prefix, unit) cases that take longest to check at `size` characters."""
+    rng = random.Random(seed)
+    timed = []
+    for _ in range(count):
+        prefix = rng.choice(FUZZ_PREFIXES)
+        unit = "".join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(1, 6)))
+        timed.append((time_call(checker.check, adversarial_text(prefix, unit, size), 0), prefix, unit))
+    timed.sort(reverse=True)
+    return {f"fuzz {prefix + unit!r}": (prefix, unit) for _, prefix, unit in timed[:keep]}
+
+
+def check_segments(checker: RegexModerationChecker, count: int, seed: int, processes: int):
+    """Scans in minimal segments (and pieces in parallel processes) must match whole-text scans."""
+    options = {"patterns": checker.patterns if checker.custom_patterns else None}
+    whole = RegexModerationChecker(**options, segment_chars=1 << 30)
+    segmented = RegexModerationChecker(**options, segment_chars=whole.max_match_chars)
+    parallel = None
+    if processes:
+        parallel = RegexModerationChecker(
+            **options, segment_chars=whole.max_match_chars, parallel_processes=processes, parallel_min_chars=1
+        )
+
+    rng = random.Random(seed)
+    try:
+        for index in range(count):
+            text = "".join(random_text(rng) for _ in range(rng.randint(20, 200)))
+            expected = whole.check_spans(text)
+            actual = segmented.check_spans(text)
+            if actual != expected:
+                raise SystemExit(f"Segmented scan differs for {text!r}: {actual} != {expected}")
+            if segmented.check(text) != expected[0]:
+                raise SystemExit(f"Segmented scores differ for {text!r}")
+            if parallel is not None and index % 10 == 0 and parallel.check(text) != expected[0]:
+                raise SystemExit(f"Parallel scan differs for {text!r}")
+    finally:
+        if parallel is not None:
+            parallel.close()
+    print(f"Segmented scans identical to whole-text scans on {count} fuzzed texts "
+          f"(segments of {segmented.segment_chars} characters{', and in parallel' if parallel else ''})")
+
+
+def check_defaults(count: int, seed: int):
+    """Linear mode must find the same scores and spans as the unbounded built-in patterns."""
+    linear = RegexModerationChecker()
+    unbounded = RegexModerationChecker(linear=False)
+    rng = random.Random(seed)
+    texts = list(LONG_MATCHES) + ["".join(random_text(rng) for _ in range(rng.randint(20, 200))) for _ in range(count)]
+    for text in texts:
+        if linear.check_spans(text) != unbounded.check_spans(text):
+            raise SystemExit(f"Linear mode differs from the unbounded patterns for {text!r}")
+    print(f"Linear mode identical to the unbounded built-in patterns on {len(texts)} texts")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1 << 14, 1 << 16, 1 << 18, 1 << 20],
+                        help="Input sizes in characters")
+    parser.add_argument("--fuzz", type=int, default=200, help="Random units tried for the slowest inputs")
+    parser.add_argument("--fuzz-keep", type=int, default=3, help="Slowest random units added as cases")
+    parser.add_argument("--segment-fuzz", type=int, default=200, help="Random texts checked for segment boundary misses")
+    parser.add_argument("--max-exponent", type=float, default=1.3, help="Fail if a case grows faster than size^this")
+    parser.add_argument("--budget-ms", type=float, default=config.REGEX_SCAN_BUDGET_MS,
+                        help="Scan budget of the checker (0: none, only with small sizes)")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Also check and time scanning the pieces of the largest size in this many processes")
+    parser.add_argument("--legacy", action="store_true",
+                        help="Scan without linear mode")
+    parser.add_argument("--seed", type=int, default=0)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    if args.legacy:
+        checker = RegexModerationChecker(linear=False)
+    else:
+        checker = RegexModerationChecker(scan_budget_ms=args.budget_ms)
+        check_segments(checker, args.segment_fuzz, args.seed, args.processes)
+        check_defaults(args.segment_fuzz, args.seed)
+
+    cases = dict(ADVERSARIAL_CASES)
+    cases.update(fuzz_cases(checker, args.fuzz, args.sizes[0], args.fuzz_keep, args.seed))
+
+    parallel = (
+        RegexModerationChecker(scan_budget_ms=args.budget_ms, parallel_processes=args.processes, parallel_min_chars=1)
+        if args.processes and not args.legacy else None
+    )
+
+    results = {}
+    size_columns = " ".join(f"{size:>10}" for size in args.sizes)
+    print(f"\n{'case':<28} {'call':<6} {size_columns} {'exponent':>9} {'cut':>4}"
+          f"{' parallel ms' if parallel else ''}   (latency in ms per size)")
+    failures: List[str] = []
+    try:
+        for name, (prefix, unit) in cases.items():
+            texts = [adversarial_text(prefix, unit, size) for size in args.sizes]
+            for call_name, call in (("check", checker.check), ("spans", checker.check_spans)):
+                latencies = [time_call(call, text) for text in texts]
+                exponent = growth_exponent(args.sizes, latencies)
+                metrics = {f"{call_name}_{size}_ms": latency for size, latency in zip(args.sizes, latencies)}
+                metrics[f"{call_name}_exponent"] = exponent
+                complete = (checker.scan if call_name == "check" else checker.locate)(texts[-1])[-1]
+                metrics[f"{call_name}_complete"] = complete
+                line = (
+                    f"{name[:28]:<28} {call_name:<6} {' '.join(f'{latency:>10.1f}' for latency in latencies)} "
+                    f"{exponent:>9.2f} {'' if complete else 'yes':>4}"
+                )
+                if parallel is not None and call_name == "check":
+                    metrics["check_parallel_ms"] = time_call(parallel.check, texts[-1], 0)
+                    line += f" {metrics['check_parallel_ms']:>11.1f}"
+                print(line)
+                results.setdefault(name, {}).update(metrics)
+                if not args.legacy and exponent > args.max_exponent:
+                    failures.append(f"{name} ({call_name}): latency grows as size^{exponent:.2f}")
+    finally:
+        if parallel is not None:
+            parallel.close()
+
+    if args.output:
+        save_results(args.output, "regex_worst_case", results, settings={
+            "sizes": args.sizes,
+            "fuzz": args.fuzz,
+            "budget_ms": args.budget_ms,
+            "processes": args.processes,
+            "legacy": args.legacy,
+        })
+    if failures:
+        print(f"\nSuperlinear worst cases (exponent above {args.max_exponent}):")
+        for failure in failures:
+            print(f"  {failure}")
+        raise SystemExit(1)
+    if not args.legacy:
+        print(f"\nAll cases grow at most as size^{args.max_exponent}")
+    if args.baseline:
+        check_baseline(results, args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
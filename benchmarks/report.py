@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Latency statistics, JSON result files and baseline comparison shared by the benchmark suite.
+
+Results are saved as {"benchmark", "created", "environment", "results": {case: metrics}}.
+Metrics ending in "_ms" or "_bytes" are better when lower, metrics ending in
+"_per_s" are better when higher, and any increase of "errors" beyond the
+tolerance fails; everything else is informational.
+
+Usage:
+    python -m benchmarks.report CURRENT.json BASELINE.json [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import diagnostics
+
+DEFAULT_TOLERANCE = 0.2
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Percentile of already sorted values, interpolating between the two closest ranks."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def latency_stats(latencies_ms: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 of a list of latencies in milliseconds."""
+    ordered = sorted(latencies_ms)
+    return {
+        "p50_ms": percentile(ordered, 0.50),
+        "p95_ms": percentile(ordered, 0.95),
+        "p99_ms": percentile(ordered, 0.99),
+    }
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes."""
+    usage = diagnostics.memory_usage()
+    if "peak_rss" in usage:
+        return usage["peak_rss"]
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def environment() -> Dict:
+    """Machine and interpreter details stored with every result file."""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def save_results(path: str, benchmark: str, results: Dict[str, Dict], settings: Optional[Dict] = None):
+    """Write results as JSON together with the environment they were measured in."""
+    document = {
+        "benchmark": benchmark,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "settings": settings or {},
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as output:
+        json.dump(document, output, indent=2, sort_keys=True)
+        output.write("\n")
+    print(f"\nResults saved to {path}")
+
+
+def load_results(path: str) -> Dict[str, Dict]:
+    """Read the per-case metrics of a result file."""
+    with open(path, encoding="utf-8") as source:
+        return json.load(source)["results"]
+
+
+def compare(current: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Compare results against a baseline.
+
+    Returns:
+        One message per metric that is worse than the baseline by more than `tolerance`
+        (a fraction, 0.2 = 20%), empty if there is no regression
+    """
+    regressions = []
+    for case, baseline_metrics in baseline.items():
+        current_metrics = current.get(case)
+        if current_metrics is None:
+            continue
+        for metric, old in baseline_metrics.items():
+            new = current_metrics.get(metric)
+            if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+                continue
+            if metric == "errors":
+                if new > old * (1 + tolerance):
+                    regressions.append(f"{case}: errors {old} -> {new}")
+                continue
+            if old <= 0:
+                continue
+            if metric.endswith(("_ms", "_bytes")):
+                change = (new - old) / old
+            elif metric.endswith("_per_s"):
+                change = (old - new) / old
+            else:
+                continue
+            if change > tolerance:
+                regressions.append(f"{case}: {metric} {old:.4g} -> {new:.4g} ({change:+.0%} worse)")
+    return regressions
+
+
+def check_baseline(results: Dict[str, Dict], baseline_path: str, tolerance: float = DEFAULT_TOLERANCE):
+    """Compare results against a baseline file and exit non-zero on any regression."""
+    regressions = compare(results, load_results(baseline_path), tolerance)
+    if regressions:
+        print(f"\nREGRESSIONS against {baseline_path} (tolerance {tolerance:.0%}):")
+        for message in regressions:
+            print(f"  {message}")
+        raise SystemExit(1)
+    print(f"\nNo regressions against {baseline_path} (tolerance {tolerance:.0%})")
+
+
+def add_output_arguments(parser: argparse.ArgumentParser):
+    """Options shared by the benchmark runners for saving and comparing results."""
+    parser.add_argument("--output", help="Save results as JSON to this file")
+    parser.add_argument("--baseline", help="Fail if results regress against this result file")
+    parser.add_argument(
+        "--tolerance", type=float, default=DEFAULT_TOLERANCE,
+        help="Allowed relative regression before failing, e.g. 0.2 for 20%%"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("current", help="Result file to check")
+    parser.add_argument("baseline", help="Result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+    check_baseline(load_results(args.current), args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
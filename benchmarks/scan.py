@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Scaling of the offline scanner (scan.py) with the number of worker processes.
+
+Writes a synthetic JSONL corpus built from the benchmark corpus, scans it
+regex-only with each process count and reports texts/s, the speedup over
+one process and the parallel efficiency (speedup / processes).
+
+Usage:
+    python -m benchmarks.scan [--lines 200000] [--processes 1 2 4 8]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.corpus import DEFAULT_CORPUS, corpus_texts, load_corpus
+
+
+def write_corpus(path: str, lines: int, seed: int = 0):
+    """Write `lines` JSONL requests mixing corpus texts of varying length."""
+    rng = random.Random(seed)
+    texts = corpus_texts(load_corpus(DEFAULT_CORPUS))
+    with open(path, "w", encoding="utf-8") as output:
+        for index in range(lines):
+            text = " ".join(rng.choice(texts) for _ in range(rng.randint(1, 4)))
+            output.write(json.dumps({"id": index, "input": text}) + "\n")
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=200000, help="Lines in the synthetic corpus")
+    parser.add_argument(
+        "--processes", type=int, nargs="+",
+        default=sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1))), help="Process counts to compare"
+    )
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = os.path.join(directory, "corpus.jsonl")
+        write_corpus(corpus, args.lines)
+        print(f"{args.lines} lines, {os.path.getsize(corpus) / 2**20:.1f} MiB, {cpus} CPUs\n")
+
+        print(f"{'processes':>9} {'texts/s':>10} {'speedup':>8} {'efficiency':>11}")
+        single = None
+        for processes in args.processes:
+            result = subprocess.run(
+                [sys.executable, "scan.py", corpus, "--output", os.path.join(directory, "out.jsonl"),
+                 "--no-bert", "--restart", "--processes", str(processes), "--json"],
+                cwd=root, check=True, capture_output=True, text=True
+            )
+            rate = json.loads(result.stdout.splitlines()[-1])["texts_per_s"]
+            single = single or rate
+            print(f"{processes:>9} {rate:>10.0f} {rate / single:>7.2f}x {rate / single / processes:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
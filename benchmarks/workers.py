@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Throughput and memory of the pre-fork server (serve.py) for different worker counts.
+
+Starts serve.py for each worker count, drives it with concurrent HTTP clients
+and reports requests/s together with per-worker RSS and PSS taken from
+/debug/runtime. PSS splits the copy-on-write model weights between workers,
+so its sum is the real memory cost of the pool.
+
+Usage:
+    python -m benchmarks.workers [--workers 1 2 4] [--clients 16] [--duration 10]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict
+
+SAMPLE_BODIES = [
+    json.dumps({"input": text}).encode("utf-8")
+    for text in (
+        "My email is test@website.de",
+        "Call me at 0172-9876543 tomorrow",
+        "You are an idiot and I will find you",
+        "The weather is nice today, let's go for a walk in the park.",
+    )
+]
+
+
+def wait_until_ready(port: int, timeout: float):
+    """Poll /health until the server answers."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+
+def run_clients(port: int, clients: int, duration: float) -> float:
+    """Run `clients` threads posting moderation requests for `duration` seconds and return requests/s."""
+    counts = [0] * clients
+    stop = time.monotonic() + duration
+
+    def client(index: int):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        i = index
+        while time.monotonic() < stop:
+            connection.request(
+                "POST", "/v1/moderations", SAMPLE_BODIES[i % len(SAMPLE_BODIES)],
+                {"Content-Type": "application/json"}
+            )
+            connection.getresponse().read()
+            counts[index] += 1
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / (time.monotonic() - start)
+
+
+def worker_memory(port: int, workers: int, attempts: int = 50) -> Dict[int, Dict]:
+    """Collect /debug/runtime from every worker; the kernel picks the worker per connection."""
+    seen = {}
+    for _ in range(attempts):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        connection.request("GET", "/debug/runtime")
+        info = json.loads(connection.getresponse().read())
+        connection.close()
+        seen[info["pid"]] = info["memory"]
+        if len(seen) == workers:
+            break
+    return seen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to compare")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent HTTP clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per measurement")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=300.0, help="Seconds to wait for the model to load")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, WORKER_REPORT_INTERVAL="0")
+
+    for workers in args.workers:
+        server = subprocess.Popen(
+            [sys.executable, "serve.py", "--workers", str(workers), "--port", str(args.port)],
+            cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_until_ready(args.port, args.startup_timeout)
+            rate = run_clients(args.port, args.clients, args.duration)
+            memory = worker_memory(args.port, workers)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+
+        rss = sum(usage.get("rss", 0) for usage in memory.values())
+        pss = sum(usage.get("pss", 0) for usage in memory.values())
+        print(
+            f"{workers} worker(s): {rate:8.1f} req/s | "
+            f"rss total {rss / 2**20:7.0f} MiB | pss total {pss / 2**20:7.0f} MiB "
+            f"({len(memory)}/{workers} workers sampled)"
+        )
+
+
+if __name__ == "__main__":
+    main()
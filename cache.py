@@ -0,0 +1,86 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class ResultCache:
+    """Content-addressed LRU/TTL cache of per-text moderation results."""
+
+    def __init__(self, max_entries: int = 100000, ttl_seconds: float = 3600.0):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of cached texts; the least recently used are evicted first
+            ttl_seconds: Time after which an entry expires (0 disables expiry)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.fingerprint = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, text: str) -> str:
+        """Hash text together with the checker configuration fingerprint."""
+        digest = hashlib.sha256(self.fingerprint.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def set_fingerprint(self, fingerprint: str):
+        """Bind the cache to a checker configuration, dropping entries from any other one."""
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self._entries.clear()
+                self.fingerprint = fingerprint
+
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Look up several keys, returning None for misses and expired entries."""
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and (entry[0] is None or entry[0] > now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    values.append(entry[1])
+                    continue
+
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                values.append(None)
+        return values
+
+    def put(self, key: str, value: Any):
+        """Store a result, evicting the least recently used entries when full."""
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+        }
@@ -0,0 +1,70 @@
+import threading
+from typing import Dict, Iterable, Optional
+
+# Categories that count towards a result's "flagged" value
+FLAGGING_CATEGORIES = (
+    "pii/phone", "pii/email", "pii/ip_address", "pii/iban",
+    "violence", "hate/threatening", "harassment/threatening",
+)
+
+
+class CascadePolicy:
+    """Decides when the BERT stage can be skipped because it cannot change the outcome."""
+
+    def __init__(self, skip_if_regex_flagged: bool = False, min_bert_length: int = 0, skip_without_letters: bool = False):
+        """
+        Initialize the cascade policy.
+
+        Args:
+            skip_if_regex_flagged: Skip BERT when the regex stage already flags the text
+            min_bert_length: Skip BERT for texts shorter than this many characters (0 disables)
+            skip_without_letters: Skip BERT for texts without any letters (numbers, punctuation)
+        """
+        self.skip_if_regex_flagged = skip_if_regex_flagged
+        self.min_bert_length = min_bert_length
+        self.skip_without_letters = skip_without_letters
+
+        self._counts = {"regex": {"ran": 0, "skipped": 0}, "bert": {"ran": 0, "skipped": 0}}
+        self._skip_reasons: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any skip rule is active."""
+        return self.skip_if_regex_flagged or self.min_bert_length > 0 or self.skip_without_letters
+
+    def bert_skip_reason(self, text: str, regex_scores: Dict[str, float], flagging_threshold: float) -> Optional[str]:
+        """Return why BERT can be skipped for this text, or None if it has to run."""
+        if self.skip_if_regex_flagged and any(
+            regex_scores.get(category, 0.0) > flagging_threshold for category in FLAGGING_CATEGORIES
+        ):
+            return "regex_flagged"
+        if len(text) < self.min_bert_length:
+            return "short"
+        if self.skip_without_letters and not any(char.isalpha() for char in text):
+            return "no_letters"
+        return None
+
+    def record(self, stage: str, ran: int, skip_reasons: Iterable[str] = ()):
+        """Count how many texts ran a stage and why the others skipped it."""
+        with self._lock:
+            counts = self._counts.setdefault(stage, {"ran": 0, "skipped": 0})
+            counts["ran"] += ran
+            for reason in skip_reasons:
+                counts["skipped"] += 1
+                if stage == "bert":
+                    self._skip_reasons[reason] = self._skip_reasons.get(reason, 0) + 1
+
+    def fingerprint(self) -> str:
+        """Identify the policy, since skipped stages change scores."""
+        return f"cascade:{self.skip_if_regex_flagged}:{self.min_bert_length}:{self.skip_without_letters}"
+
+    def stats(self) -> Dict:
+        """Per-stage run/skip counters, skip rates and skip reasons."""
+        with self._lock:
+            stats = {}
+            for stage, counts in self._counts.items():
+                total = counts["ran"] + counts["skipped"]
+                stats[stage] = dict(counts, skip_rate=counts["skipped"] / total if total else 0.0)
+            stats["bert_skip_reasons"] = dict(self._skip_reasons)
+            return stats
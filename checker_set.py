@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from typing import List, Optional, Tuple
+
+from cascade import CascadePolicy
+from checkers import BaseModerationChecker, BatchingChecker, RegexModerationChecker
+
+
+class CheckerSet:
+    """
+    Checkers and flagging threshold that score requests together.
+
+    A request holds on to the set that was active when it started, so
+    swapping in a new set never mixes two configurations within a request;
+    the old set is released once the requests still using it are done.
+    """
+
+    def __init__(
+        self,
+        flagging_threshold: float,
+        regex_checker: RegexModerationChecker,
+        cascade_policy: CascadePolicy,
+        bert_checker=None,
+        bert_batcher: Optional[BatchingChecker] = None,
+        bert_status: str = "disabled",
+    ):
+        """
+        Initialize the set.
+
+        Args:
+            flagging_threshold: Threshold above which content is flagged
+            regex_checker: Regex PII checker
+            cascade_policy: Cascade policy of the service, part of the fingerprint
+            bert_checker: Loaded BertModerationChecker, if any
+            bert_batcher: Micro-batching front end of bert_checker, if batching is enabled
+            bert_status: "ready", "loading", "failed" or "disabled"
+        """
+        self.flagging_threshold = flagging_threshold
+        self.regex_checker = regex_checker
+        self.bert_checker = bert_checker
+        self.bert_batcher = bert_batcher
+        self.bert_status = bert_status
+        # Checkers scored next to the regex stage and combined with it by maximum, with their micro-batchers
+        self.concurrent_checkers: List[Tuple[BaseModerationChecker, Optional[BatchingChecker]]] = (
+            [(bert_checker, bert_batcher)] if bert_status == "ready" else []
+        )
+
+        # Everything that influences scores, used to key cached results
+        parts = [str(flagging_threshold), regex_checker.fingerprint(), cascade_policy.fingerprint()]
+        if bert_status == "ready":
+            parts.append(bert_checker.fingerprint())
+        self.fingerprint = hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+        self.version = self.fingerprint[:12]
+
+        self._active = 0
+        self._idle = threading.Condition()
+
+    def acquire(self):
+        """Count a request that scores with this set."""
+        with self._idle:
+            self._active += 1
+
+    def release(self):
+        """Count a request as done with this set."""
+        with self._idle:
+            self._active -= 1
+            if not self._active:
+                self._idle.notify_all()
+
+    @property
+    def active(self) -> int:
+        """Number of requests currently scoring with this set."""
+        return self._active
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until no request uses this set; returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._active, timeout)
+
+    def close(self, successor: Optional["CheckerSet"] = None):
+        """
+        Stop the regex scan pool and the BERT batcher's worker thread once its queue is empty, so the set can be freed.
+
+        Args:
+            successor: Set that replaced this one; checkers it reuses stay open
+        """
+        if successor is None or self.regex_checker is not successor.regex_checker:
+            self.regex_checker.close()
+        if self.bert_batcher and (successor is None or self.bert_batcher is not successor.bert_batcher):
+            self.bert_batcher.close()
+
+    def after_fork(self):
+        """Re-create per-process checker state in a forked worker."""
+        self._active = 0
+        self._idle = threading.Condition()
+        self.regex_checker.after_fork()
+        if self.bert_batcher:
+            self.bert_batcher.after_fork()
+        elif self.bert_checker:
+            self.bert_checker.after_fork()
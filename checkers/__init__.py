@@ -1,15 +1,24 @@
 """Moderation checkers package."""
 
+import importlib.util
+
 from .regex_checker import BaseModerationChecker, RegexModerationChecker
+from .batching import BatchingChecker
 
-try:
-    from .bert_checker import BertModerationChecker
-    BERT_AVAILABLE = True
-except ImportError:
-    BERT_AVAILABLE = False
-    BertModerationChecker = None
+# torch and transformers take seconds to import, so only check that they are
+# installed here and import BertModerationChecker on first use
+BERT_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("torch", "transformers"))
 
-__all__ = ["BaseModerationChecker", "RegexModerationChecker"]
+__all__ = ["BaseModerationChecker", "RegexModerationChecker", "BatchingChecker"]
 
 if BERT_AVAILABLE:
     __all__.append("BertModerationChecker")
+
+
+def __getattr__(name):
+    if name == "BertModerationChecker":
+        if not BERT_AVAILABLE:
+            return None
+        from .bert_checker import BertModerationChecker
+        return BertModerationChecker
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
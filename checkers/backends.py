@@ -0,0 +1,197 @@
+"""Inference backends for BertModerationChecker."""
+
+import hashlib
+import os
+import re
+from typing import Dict, List
+
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification
+
+
+def _model_revision(model_name: str) -> str:
+    """Revision of a model: the commit hash a hub name resolves to, or a stamp of a local directory's files."""
+    if os.path.isdir(model_name):
+        files = sorted((entry for entry in os.scandir(model_name) if entry.is_file()), key=lambda entry: entry.name)
+        return hashlib.sha256(
+            "\n".join(f"{entry.name}:{entry.stat().st_size}:{entry.stat().st_mtime_ns}" for entry in files).encode("utf-8")
+        ).hexdigest()
+    return getattr(AutoConfig.from_pretrained(model_name), "_commit_hash", None) or "unknown"
+
+
+def _artifact_path(cache_dir: str, model_name: str, suffix: str) -> str:
+    """Path of a cached model artifact, keyed by model name and revision and torch version."""
+    readable = re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name).strip("-.")
+    key = f"{model_name}:{_model_revision(model_name)}:{torch.__version__}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(os.path.expanduser(cache_dir), f"{readable}-{digest}{suffix}")
+
+
+def _atomic_target(path: str) -> str:
+    """Temporary path to build an artifact at before renaming it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return f"{path}.tmp-{os.getpid()}"
+
+
+class TorchBackend:
+    """Full-precision PyTorch eager inference."""
+
+    name = "torch"
+
+    def __init__(self, model_name: str, device: str = "cpu", cache_dir: str = None, input_names: List[str] = None):
+        """
+        Load the model.
+
+        Args:
+            model_name: HuggingFace model name or local path
+            device: Torch device to run on
+            cache_dir: Directory for exported or quantized artifacts
+            input_names: Model input names, in the tokenizer's order
+        """
+        self.device = device
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        self.model.to(device)
+        self.model.eval()
+
+    def __call__(self, encoded: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """Return the logits for a padded batch of model inputs."""
+        with torch.inference_mode():
+            return self.model(**encoded.to(self.device)).logits
+
+    def after_fork(self):
+        """Weights are shared copy-on-write with the parent, nothing to do."""
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """PyTorch eager inference with dynamic int8 quantization of the linear layers (CPU only)."""
+
+    name = "torch-int8"
+
+    def __init__(self, model_name: str, device: str = "cpu", cache_dir: str = None, input_names: List[str] = None):
+        self.device = "cpu"
+        path = _artifact_path(cache_dir, model_name, "-int8.pt")
+        cached = os.path.exists(path)
+
+        # Only the quantized weights are cached, since unpickling a whole module could run
+        # arbitrary code; the module is rebuilt from the model config to load them into
+        if cached:
+            model = AutoModelForSequenceClassification.from_config(AutoConfig.from_pretrained(model_name))
+        else:
+            model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        model.eval()
+        self.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        if cached:
+            self.model.load_state_dict(torch.load(path, weights_only=True))
+        else:
+            target = _atomic_target(path)
+            torch.save(self.model.state_dict(), target)
+            os.replace(target, path)
+            print(f"Saved int8 weights to {path}")
+
+        self.model.eval()
+
+
+class OnnxBackend:
+    """ONNX Runtime inference of an exported graph (CPU only)."""
+
+    name = "onnx"
+    quantize = False
+
+    def __init__(self, model_name: str, device: str = "cpu", cache_dir: str = None, input_names: List[str] = None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("onnxruntime is required for the onnx backends") from e
+
+        self.input_names = list(input_names or ["input_ids", "attention_mask"])
+        path = _artifact_path(cache_dir, model_name, ".onnx")
+        if not os.path.exists(path):
+            self._export(model_name, path)
+
+        if self.quantize:
+            quantized_path = _artifact_path(cache_dir, model_name, "-int8.onnx")
+            if not os.path.exists(quantized_path):
+                self._quantize(path, quantized_path)
+            path = quantized_path
+
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+    def _export(self, model_name: str, path: str):
+        """Export the model's logits to an ONNX graph with dynamic batch and sequence axes."""
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        model.eval()
+
+        input_names = self.input_names
+
+        class LogitsOnly(torch.nn.Module):
+            """Positional-argument wrapper that returns only the logits."""
+
+            def __init__(self):
+                super().__init__()
+                self.model = model
+
+            def forward(self, *inputs):
+                return self.model(**dict(zip(input_names, inputs))).logits
+
+        sample = tuple(torch.ones((2, 8), dtype=torch.long) for _ in input_names)
+        batch = torch.export.Dim("batch")
+        sequence = torch.export.Dim("sequence")
+
+        target = _atomic_target(path)
+        torch.onnx.export(
+            LogitsOnly(),
+            sample,
+            target,
+            input_names=input_names,
+            output_names=["logits"],
+            dynamo=True,
+            dynamic_shapes=(tuple({0: batch, 1: sequence} for _ in input_names),),
+            external_data=False,
+        )
+        os.replace(target, path)
+        print(f"Exported ONNX model to {path}")
+
+    def _quantize(self, path: str, quantized_path: str):
+        """Quantize the weights of an exported graph to int8."""
+        import onnx
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        # The exporter's recorded intermediate shapes trip the quantizer's shape
+        # inference, so let it infer them from scratch
+        model = onnx.load(path)
+        del model.graph.value_info[:]
+        stripped = _atomic_target(quantized_path) + ".fp32"
+        onnx.save(model, stripped)
+
+        target = _atomic_target(quantized_path)
+        try:
+            quantize_dynamic(stripped, target, weight_type=QuantType.QInt8)
+        finally:
+            os.remove(stripped)
+        os.replace(target, quantized_path)
+        print(f"Saved int8 ONNX model to {quantized_path}")
+
+    def __call__(self, encoded: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """Return the logits for a padded batch of model inputs."""
+        feed = {name: encoded[name].cpu().numpy() for name in self.input_names}
+        return torch.from_numpy(self.session.run(["logits"], feed)[0])
+
+    def after_fork(self):
+        """ONNX Runtime sessions and their thread pools are not fork-safe, so reload the graph."""
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(self.path, providers=["CPUExecutionProvider"])
+
+
+class QuantizedOnnxBackend(OnnxBackend):
+    """ONNX Runtime inference of a dynamically int8-quantized exported graph (CPU only)."""
+
+    name = "onnx-int8"
+    quantize = True
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (TorchBackend, QuantizedTorchBackend, OnnxBackend, QuantizedOnnxBackend)
+}
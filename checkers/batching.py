@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Deque, Dict, List, Optional, Tuple
+
+import metrics
+import tracing
+from checkers.regex_checker import BaseModerationChecker
+
+
+class _Gathered(Future):
+    """Future for the results of several futures, see _gather."""
+
+    def __init__(self, futures: List[Future]):
+        super().__init__()
+        self.futures = futures
+
+    def cancel(self) -> bool:
+        """
+        Cancel this future and those of its futures not yet started.
+
+        Returns:
+            False if this future was done already or some of its futures were
+            running, whose work then goes on without a caller
+        """
+        if not super().cancel():
+            return False
+        settled = [future.cancel() or future.done() for future in self.futures]
+        return all(settled)
+
+
+def _gather(futures: List[Future]) -> Future:
+    """Future for the results of several futures; cancelling it cancels those not yet started."""
+    combined = _Gathered(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        if not combined.set_running_or_notify_cancel():
+            return
+        try:
+            combined.set_result([future.result() for future in futures])
+        except Exception as e:
+            combined.set_exception(e)
+
+    if not futures:
+        combined.set_running_or_notify_cancel()
+        combined.set_result([])
+        return combined
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+class BatchingChecker(BaseModerationChecker):
+    """Micro-batching front end that merges concurrent checks into one batched call."""
+
+    def __init__(self, checker: BaseModerationChecker, max_batch_size: int = 32, max_wait_ms: float = 0.0):
+        """
+        Initialize the batching scheduler.
+
+        Args:
+            checker: Checker whose check_batch runs the actual inference
+            max_batch_size: Maximum number of texts per batched call
+            max_wait_ms: How long the first text of a batch may wait for more texts once
+                the worker is free (0 runs a batch as soon as the worker is free,
+                with the texts that arrived while the previous batch ran)
+        """
+        self.checker = checker
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        # (text, future, trace of the submitting request, time.monotonic() when queued)
+        self._pending: Deque[Tuple[str, Future, Optional[tracing.Trace], float]] = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._worker_pid = None
+        self._closed = False
+
+    def check(self, text: str) -> Dict[str, float]:
+        """Queue text for the next batch and wait for its scores."""
+        return self.submit(text).result()
+
+    def check_batch(self, texts: List[str]) -> List[Dict[str, float]]:
+        """Queue several texts at once and wait for all of their scores."""
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def submit_batch(self, texts: List[str], executor: Optional[Executor] = None) -> Future:
+        """Queue several texts and return a future for all of their scores; no executor is needed."""
+        return _gather([self.submit(text) for text in texts])
+
+    def submit(self, text: str) -> Future:
+        """
+        Queue text for the next batch and return a future for its scores.
+
+        Cancelling the future before its batch starts removes the text from the batch.
+        """
+        future = Future()
+        item = (text, future, tracing.current(), time.monotonic())
+        with self._cond:
+            self._ensure_worker()
+            self._pending.append(item)
+            self._cond.notify()
+        return future
+
+    @property
+    def name(self) -> str:
+        return self.checker.name
+
+    def fingerprint(self) -> str:
+        """Batching does not change scores, so report the wrapped checker."""
+        return self.checker.fingerprint()
+
+    def after_fork(self):
+        """Drop the parent's worker thread and queue; a new worker starts on first use."""
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self.checker.after_fork()
+
+    def close(self):
+        """Let the worker thread exit once the queued texts are done; later texts start a new one."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        """Number of texts waiting for a batch slot."""
+        return len(self._pending)
+
+    def _ensure_worker(self):
+        """Start the worker thread on first use (and again in a forked child)."""
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        self._worker_pid = os.getpid()
+        self._worker = threading.Thread(target=self._run, name="bert-batcher", daemon=True)
+        self._worker.start()
+
+    def _next_batch(self) -> Optional[List[Tuple[str, Future, Optional[tracing.Trace], float]]]:
+        """Block until a text is queued, then until the batch is full or its oldest text waited max_wait; None once closed and idle."""
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    # Under the lock, so a text submitted from now on starts a new worker
+                    self._worker = None
+                    return None
+                self._cond.wait()
+
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            count = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _run(self):
+        """Worker loop: run one batched call per batch and hand results back."""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # Texts whose caller gave up (e.g. past its deadline) are dropped
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            metrics.BATCHER_BATCH.observe(len(batch))
+            texts = [text for text, _, _, _ in batch]
+
+            # The batch runs outside the requests' contexts, so its stage
+            # timings are collected here and added to each traced request
+            started = time.monotonic()
+            traces = {id(trace): trace for _, _, trace, _ in batch if trace is not None}
+            for _, _, trace, queued in batch:
+                if trace is not None:
+                    trace.add("batch_wait", started - queued)
+            batch_trace = tracing.Trace() if traces else None
+            try:
+                with tracing.activate(batch_trace):
+                    results = self.checker.check_batch(texts)
+            except Exception as e:
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                if batch_trace is not None:
+                    stages = batch_trace.stages
+                    for trace in traces.values():
+                        trace.merge(stages)
+
+            for (_, future, _, _), scores in zip(batch, results):
+                future.set_result(scores)
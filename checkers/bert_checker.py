@@ -1,36 +1,73 @@
-from typing import Dict
+import time
+from contextlib import nullcontext
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 try:
     import torch
-    from transformers import pipeline
+    from transformers import AutoConfig, AutoTokenizer
+    from checkers.backends import BACKENDS, TorchBackend
     TRANSFORMERS_AVAILABLE = True
 except ImportError:
     TRANSFORMERS_AVAILABLE = False
-    
+
+import metrics
 from checkers.regex_checker import BaseModerationChecker
+from checkers.scheduling import PriorityGate, current_lane
 
 
 class BertModerationChecker(BaseModerationChecker):
     """BERT-based moderation checker using transformers."""
     
-    def __init__(self, model_name: str = "unitary/toxic-bert"):
+    name = "bert"
+    
+    # Long texts are tokenized block by block so memory stays bounded
+    block_chars = 100_000
+    block_overlap_chars = 2_000
+    
+    def __init__(
+        self,
+        model_name: str = "unitary/toxic-bert",
+        batch_size: int = 32,
+        window_stride: int = 128,
+        early_exit_threshold: Optional[float] = None,
+        early_exit_categories: Optional[Iterable[str]] = None,
+        backend: str = "torch",
+        cache_dir: str = "~/.cache/llm-guardrails-server",
+        gate: Optional[PriorityGate] = None,
+    ):
         """
         Initialize BERT moderation checker.
         
         Args:
             model_name: HuggingFace model name for toxicity detection
+            batch_size: Maximum number of token windows per forward pass in check_batch
+            window_stride: Number of tokens shared by consecutive windows of a long text
+            early_exit_threshold: Stop scoring a long text once a category exceeds this score
+            early_exit_categories: Categories that trigger the early exit (default: all)
+            backend: Inference backend: "torch", "torch-int8", "onnx" or "onnx-int8"
+            cache_dir: Directory where exported and quantized models are cached
+            gate: Orders forward passes by the priority lane of the calling request
         """
         if not TRANSFORMERS_AVAILABLE:
             raise ImportError("transformers and torch are required for BertModerationChecker")
-            
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown BERT backend {backend!r}, expected one of {sorted(BACKENDS)}")
+        
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.batch_size = max(1, batch_size)
+        self.early_exit_threshold = early_exit_threshold
+        self.gate = gate
         
         try:
             # Use a toxicity detection model
-            self.classifier = pipeline(
-                "text-classification",
-                model=model_name,
-                device=0 if self.device == "cuda" else -1,
-                return_all_scores=True
+            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+            self.config = AutoConfig.from_pretrained(model_name)
+            self.backend = BACKENDS[backend](
+                model_name,
+                device=self.device,
+                cache_dir=cache_dir,
+                input_names=self.tokenizer.model_input_names
             )
         except (OSError, ValueError) as e:
             # Fallback to a general sentiment model if toxic-bert is not available
@@ -40,6 +77,11 @@ class BertModerationChecker(BaseModerationChecker):
                 "Please install the transformers library and ensure the model is available."
             ) from e
         
+        # Model labels in logit order, and the max sequence length it accepts
+        self.labels = [self.config.id2label[i] for i in range(self.config.num_labels)]
+        self.max_length = min(self.tokenizer.model_max_length, 512)
+        self.window_stride = min(window_stride, self.max_length // 2)
+        
         # Category mapping based on BERT toxic model outputs
         # Maps BERT labels to moderation categories
         self.category_mapping = {
@@ -49,35 +91,231 @@ class BertModerationChecker(BaseModerationChecker):
             "hate/threatening": ["threat"],
             "violence": ["toxic", "threat", "severe_toxic"],
         }
+        
+        # Label positions per category, used to test windows for an early exit
+        self.early_exit_categories = list(early_exit_categories or self.category_mapping)
+        self._early_exit_label_indices = sorted({
+            self.labels.index(label)
+            for category in self.early_exit_categories
+            for label in self.category_mapping.get(category, [])
+            if label in self.labels
+        })
     
     def check(self, text: str) -> Dict[str, float]:
         """Check text using BERT model and return category scores."""
+        return self.check_batch([text])[0]
+    
+    def check_batch(self, texts: List[str]) -> List[Dict[str, float]]:
+        """
+        Check several texts in sized, length-bucketed batches of token windows.
+        
+        Texts are sorted by length before batching so that short texts are
+        not padded to the length of the longest text in the request. Texts
+        longer than the model's maximum length are split into overlapping
+        windows, and each label keeps its maximum score over all windows.
+        """
+        label_scores: List[Optional[List[float]]] = [None] * len(texts)
+        failed = set()
+        finished = set()
+        
+        batch = []
         try:
-            # Get predictions from the model
-            results = self.classifier(text)[0]
-            
-            # Convert results list to a dictionary for easier lookup
-            bert_scores = {result['label']: result['score'] for result in results}
-            
-            # Initialize scores dictionary
-            scores = {}
-            
-            # Map BERT scores to moderation categories
-            for category, bert_labels in self.category_mapping.items():
-                # Get the maximum score from relevant BERT labels for this category
-                # TODO: don't do mapping, just use the native BERT labels?
-                category_score = max(
-                    bert_scores.get(label, 0.0) for label in bert_labels
-                )
-                
-                scores[category] = category_score
-            
-            return scores
-            
+            for index, window in self._iter_windows(texts, finished):
+                batch.append((index, window))
+                if len(batch) == self.batch_size:
+                    self._score_windows(batch, label_scores, failed, finished)
+                    batch = []
+            if batch:
+                self._score_windows(batch, label_scores, failed, finished)
+        except (RuntimeError, ValueError, OSError) as e:
+            # Return zero scores if tokenization fails
+            print(f"BERT checker error: {e}")
+            metrics.TOKENIZATION_ERRORS.inc()
+            failed.update(range(len(texts)))
+        
+        results = []
+        for index, scores in enumerate(label_scores):
+            if scores is None or index in failed:
+                results.append(self._zero_scores())
+            else:
+                results.append(self._map_scores(dict(zip(self.labels, scores))))
+        return results
+    
+    def _iter_windows(self, texts: List[str], finished: set) -> Iterator[Tuple[int, Dict[str, List[int]]]]:
+        """
+        Yield (text index, token window) pairs, shortest texts first.
+        
+        Texts in the finished set (early exit) yield no further windows.
+        """
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        
+        # Tokenize up to batch_size regular texts per tokenizer call
+        regular = [index for index in order if len(texts[index]) <= self.block_chars]
+        for start in range(0, len(regular), self.batch_size):
+            indices = regular[start:start + self.batch_size]
+            encoded = self._encode([texts[index] for index in indices])
+            for window, sample in zip(self._split_windows(encoded), encoded["overflow_to_sample_mapping"]):
+                if indices[sample] not in finished:
+                    yield indices[sample], window
+        
+        # Huge documents are tokenized one block at a time
+        for index in order[len(regular):]:
+            for block in self._iter_blocks(texts[index]):
+                if index in finished:
+                    break
+                encoded = self._encode([block])
+                for window in self._split_windows(encoded):
+                    if index in finished:
+                        break
+                    yield index, window
+    
+    def _encode(self, texts: List[str]):
+        """Tokenize texts into overlapping windows of at most max_length tokens."""
+        start = time.perf_counter()
+        encoded = self.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.max_length,
+            stride=self.window_stride,
+            return_overflowing_tokens=True
+        )
+        metrics.TOKENIZATION_SECONDS.observe(time.perf_counter() - start)
+        return encoded
+    
+    def _split_windows(self, encoded) -> List[Dict[str, List[int]]]:
+        """Split a tokenizer output into one model input per window."""
+        keys = [key for key in ("input_ids", "attention_mask", "token_type_ids") if key in encoded]
+        return [
+            {key: encoded[key][position] for key in keys}
+            for position in range(len(encoded["input_ids"]))
+        ]
+    
+    def _iter_blocks(self, text: str) -> Iterator[str]:
+        """Split a huge text into overlapping blocks, preferably at whitespace."""
+        start = 0
+        while start < len(text):
+            end = min(start + self.block_chars, len(text))
+            if end < len(text):
+                cut = max(text.rfind(" ", end - self.block_overlap_chars, end), text.rfind("\n", end - self.block_overlap_chars, end))
+                if cut > start:
+                    end = cut
+            yield text[start:end]
+            if end >= len(text):
+                break
+            start = max(end - self.block_overlap_chars, start + 1)
+    
+    def _score_windows(self, batch: List[Tuple[int, Dict[str, List[int]]]], label_scores: List, failed: set, finished: set):
+        """Run one forward pass over a batch of windows and fold it into the per-text maxima."""
+        try:
+            # Bulk requests wait here for interactive ones, between forward passes
+            with self.gate.slot(current_lane()) if self.gate else nullcontext():
+                probabilities = self._predict([window for _, window in batch])
         except (RuntimeError, ValueError, OSError) as e:
             # Return zero scores if model fails
             print(f"BERT checker error: {e}")
-            return {category: 0.0 for category in self.category_mapping.keys()}
+            metrics.FORWARD_ERRORS.inc()
+            for index, _ in batch:
+                failed.add(index)
+                finished.add(index)
+            return
+        
+        for (index, _), row in zip(batch, probabilities):
+            current = label_scores[index]
+            label_scores[index] = row if current is None else [max(a, b) for a, b in zip(current, row)]
+            
+            if self.early_exit_threshold is not None and any(
+                label_scores[index][position] > self.early_exit_threshold
+                for position in self._early_exit_label_indices
+            ):
+                finished.add(index)
+    
+    def _predict(self, windows: List[Dict[str, List[int]]], backend=None) -> List[List[float]]:
+        """Run one forward pass and return the native label scores per window."""
+        start = time.perf_counter()
+        encoded = self.tokenizer.pad(windows, padding=True, return_tensors="pt")
+        padded = time.perf_counter()
+        metrics.TOKENIZATION_SECONDS.observe(padded - start)
+        metrics.BERT_FORWARD_BATCH.observe(len(windows))
+        logits = (backend or self.backend)(encoded)
+        
+        # Same activation the text-classification pipeline applies
+        if self.config.problem_type == "multi_label_classification" or len(self.labels) == 1:
+            probabilities = torch.sigmoid(logits)
+        else:
+            probabilities = torch.softmax(logits, dim=-1)
+        
+        scores = probabilities.cpu().tolist()
+        metrics.FORWARD_SECONDS.observe(time.perf_counter() - padded)
+        return scores
+    
+    def parity_report(self, texts: List[str]) -> Dict:
+        """
+        Compare the active backend against full-precision torch eager inference.
+        
+        Args:
+            texts: Sample texts to score with both backends
+            
+        Returns:
+            Maximum absolute score delta overall and per native label
+        """
+        if isinstance(self.backend, TorchBackend) and self.backend.name == "torch":
+            reference = self.backend
+        else:
+            reference = TorchBackend(self.model_name, device=self.device)
+        
+        deltas = [0.0] * len(self.labels)
+        windows = [window for _, window in self._iter_windows(texts, set())]
+        for start in range(0, len(windows), self.batch_size):
+            batch = windows[start:start + self.batch_size]
+            for actual, expected in zip(self._predict(batch), self._predict(batch, backend=reference)):
+                deltas = [max(delta, abs(a - b)) for delta, a, b in zip(deltas, actual, expected)]
+        
+        return {
+            "backend": self.backend.name,
+            "texts": len(texts),
+            "windows": len(windows),
+            "max_score_delta": max(deltas) if deltas else 0.0,
+            "max_score_delta_per_label": dict(zip(self.labels, deltas)),
+        }
+    
+    def _map_scores(self, bert_scores: Dict[str, float]) -> Dict[str, float]:
+        """Map native BERT label scores for one text to moderation categories."""
+        # Initialize scores dictionary
+        scores = {}
+        
+        # Map BERT scores to moderation categories
+        for category, bert_labels in self.category_mapping.items():
+            # Get the maximum score from relevant BERT labels for this category
+            # TODO: don't do mapping, just use the native BERT labels?
+            category_score = max(
+                bert_scores.get(label, 0.0) for label in bert_labels
+            )
+            
+            scores[category] = category_score
+        
+        return scores
+    
+    def _zero_scores(self) -> Dict[str, float]:
+        """Scores reported when the model fails."""
+        return {category: 0.0 for category in self.category_mapping.keys()}
+    
+    def fingerprint(self) -> str:
+        """Identify the checker by version, model and category mapping."""
+        return (
+            f"{super().fingerprint()}:{self.model_name}:{self.backend.name}:{self.max_length}:{self.window_stride}:"
+            f"{self.early_exit_threshold}:{sorted(self.early_exit_categories)}:{sorted(self.category_mapping.items())}"
+        )
+    
+    def warm_up(self):
+        """Run dummy forward passes so lazy kernel initialization happens before the first request."""
+        self._predict(self._split_windows(self._encode(["warm-up"])))
+        self._predict(self._split_windows(self._encode(["warm-up " * self.max_length]))[:1])
+    
+    def after_fork(self):
+        """Let the backend re-create state that does not survive a fork."""
+        self.backend.after_fork()
+        if self.gate:
+            self.gate.after_fork()
     
     def get_device_info(self) -> str:
         """Get information about the device being used."""
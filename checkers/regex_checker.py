@@ -1,21 +1,194 @@
+import bisect
+import contextvars
+import hashlib
 import re
-from typing import Dict
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Pattern, Tuple
 from abc import ABC, abstractmethod
 
+try:
+    from re import _parser as _regex_parser  # Python 3.11+
+except ImportError:
+    import sre_parse as _regex_parser
+
+# Prefilter helpers for RegexModerationChecker
+_DELETE_ASCII_DIGITS = str.maketrans("", "", "0123456789")
+_UNICODE_DIGIT = re.compile(r"\d")
+_BIC_PREFIX = re.compile(r"BIC", re.IGNORECASE)
+_WORD_BOUNDARY = re.compile(r"\b")
+# Every built-in match contains a digit, an "@" (emails), a ":" (IPv6) or starts with "BIC"
+_ANCHOR = r"[\d@:]|\bbic"
+
+# Upper bound on cached combined patterns per checker
+_MAX_COMBINED_PATTERNS = 256
+
+# Quantifiers of a regex source, outside character classes and escapes
+_REPEAT = re.compile(r"\{(\d*)(,?)(\d*)\}")
+
+
+def bound_repeats(source: str, max_repeat: int, atoms: Optional[List[str]] = None) -> str:
+    """
+    Replace the unbounded quantifiers of a regex source (*, + and {n,}) by ones capped at max_repeat.
+    
+    Lazy and possessive modifiers are kept, and characters inside classes
+    and escapes are left alone.
+    
+    Args:
+        source: Regex source
+        max_repeat: Cap on the unbounded quantifiers
+        atoms: If given, the source of the atom each unbounded quantifier
+            repeats is appended to it (")" for a group)
+    """
+    parts = []
+    position = 0
+    quantified = False  # the previous token was a quantifier, so ? or + modify it
+    while position < len(source):
+        char = source[position]
+        if char == "\\":
+            parts.append(source[position:position + 2])
+            position += 2
+            quantified = False
+            continue
+        if char == "[":
+            # A class ends at the first ] that is not its first member or escaped
+            end = position + 1
+            if end < len(source) and source[end] == "^":
+                end += 1
+            if end < len(source) and source[end] == "]":
+                end += 1
+            while end < len(source) and source[end] != "]":
+                end += 2 if source[end] == "\\" else 1
+            parts.append(source[position:end + 1])
+            position = end + 1
+            quantified = False
+            continue
+        if quantified and char in "?+":
+            parts.append(char)
+            position += 1
+            quantified = False
+            continue
+        if char in "*+":
+            if atoms is not None and parts:
+                atoms.append(parts[-1])
+            parts.append(f"{{{0 if char == '*' else 1},{max_repeat}}}")
+            position += 1
+            quantified = True
+            continue
+        repeat = _REPEAT.match(source, position) if char == "{" else None
+        if repeat is not None:
+            lower, comma, upper = repeat.groups()
+            if comma and not upper:
+                upper = str(max(max_repeat, int(lower or 0)))
+                if atoms is not None and parts:
+                    atoms.append(parts[-1])
+            parts.append(f"{{{lower}{comma}{upper}}}")
+            position = repeat.end()
+            quantified = True
+            continue
+        # A ? right after an unescaped ( starts a group extension such as (?:
+        quantified = char == "?" and not (parts and parts[-1] == "(")
+        parts.append(char)
+        position += 1
+    return "".join(parts)
+
+
+def max_match_length(pattern: Pattern) -> int:
+    """Longest text a compiled pattern can match (huge for unbounded quantifiers)."""
+    return _regex_parser.parse(pattern.pattern, pattern.flags).getwidth()[1]
+
+
+# Checker of the regex scan pool processes, see RegexModerationChecker._check_parallel
+_piece_checker: Optional["RegexModerationChecker"] = None
+
+
+def _init_piece_worker(options: Dict):
+    """Build the checker that scans pieces of huge texts in a pool process."""
+    global _piece_checker
+    _piece_checker = RegexModerationChecker(**options)
+
+
+def _scan_piece(
+    text: str, start: int, stop: int, categories: Tuple[str, ...], deadline: Optional[float]
+) -> Tuple[set, bool]:
+    """Matched pattern names of matches starting in text[start:stop], in a pool process."""
+    return _piece_checker._matched_patterns(text, categories, deadline, start, stop)
+
 
 class BaseModerationChecker(ABC):
     """Abstract base class for moderation checkers."""
     
+    # Stage name reported in results and metrics
+    name = "checker"
+    # Bump when a checker's scoring logic changes so cached results are invalidated
+    version = "1"
+    
     @abstractmethod
     def check(self, text: str) -> Dict[str, float]:
         """Check text and return category scores."""
         raise NotImplementedError
+    
+    def check_batch(self, texts: List[str]) -> List[Dict[str, float]]:
+        """Check several texts and return their category scores in input order."""
+        return [self.check(text) for text in texts]
+    
+    def submit_batch(self, texts: List[str], executor: Executor) -> Future:
+        """Start checking several texts and return a future for their scores in input order."""
+        # Run in the caller's context, so e.g. its priority lane carries over
+        return executor.submit(contextvars.copy_context().run, self.check_batch, texts)
+    
+    def fingerprint(self) -> str:
+        """Identify the checker configuration that produced a set of scores."""
+        return f"{type(self).__name__}:{self.version}"
+    
+    def after_fork(self):
+        """Re-create per-process state (threads, sessions) in a forked worker."""
 
 
 class RegexModerationChecker(BaseModerationChecker):
     """Regex-based personal data leakage detector."""
     
-    def __init__(self):
+    name = "regex"
+    
+    # Categories tried first when matches of several categories start at the
+    # same position in check_spans, e.g. a card number before the phone
+    # pattern that matches its first digit groups
+    span_priority = ("pii/email", "pii/iban", "pii/credit_card", "pii/ip_address", "pii/phone")
+    
+    def __init__(
+        self,
+        patterns: Optional[Dict[str, List[str]]] = None,
+        linear: bool = True,
+        max_repeat: int = 256,
+        segment_chars: int = 1 << 13,
+        scan_budget_ms: float = 0.0,
+        parallel_processes: int = 0,
+        parallel_min_chars: int = 1 << 20,
+    ):
+        """
+        Initialize the checker.
+        
+        Args:
+            patterns: Regex sources per category replacing the built-in table; the
+                cheap per-category prefilters only apply to the built-in table
+            linear: Scan in segments with every quantifier bounded, so that the
+                scan time grows linearly with the text length. The built-in
+                patterns keep their unbounded matches: segments with a run of
+                characters longer than max_repeat are scanned with the original
+                patterns, whose time only scan_budget_ms bounds
+            max_repeat: Cap on unbounded quantifiers (*, +, {n,}) in linear mode; it
+                truncates the matches of custom patterns
+            segment_chars: Characters per segment in linear mode; segments overlap
+                by the longest possible match, so no match is missed at their edges
+            scan_budget_ms: Time budget of the texts of one check_batch call (or one
+                check) in linear mode, after which scanning stops and the text is
+                reported as incomplete (0 scans to the end)
+            parallel_processes: Processes that scan the segments of texts of at least
+                parallel_min_chars characters in parallel in linear mode (0 scans in
+                the calling thread)
+            parallel_min_chars: Shortest text scanned in parallel
+        """
         self.patterns = {
             "pii/phone": [
                 r"\b(?:\+49[-.\s]?)?\(?0?[1-9][0-9]{1,4}\)?[-.\s]?[0-9]{3,12}\b",  #  phone numbers
@@ -44,30 +217,525 @@ class RegexModerationChecker(BaseModerationChecker):
                 r"\bBIC[\s:]?[A-Z]{4}[A-Z]{2}[A-Z0-9]{2}(?:[A-Z0-9]{3})?\b",  # BIC/SWIFT codes
             ]
         }
+        self.custom_patterns = patterns is not None
+        if patterns is not None:
+            self.patterns = {category: list(sources) for category, sources in patterns.items()}
+        
+        self.linear = linear
+        self.max_repeat = max_repeat
+        self.segment_chars = segment_chars
+        self.scan_budget_ms = scan_budget_ms
+        self.parallel_processes = parallel_processes if linear else 0
+        self.parallel_min_chars = parallel_min_chars
+        # Arguments that rebuild this checker in a scan pool process
+        self.options = {
+            "patterns": self.patterns if self.custom_patterns else None,
+            "linear": linear,
+            "max_repeat": max_repeat,
+            "segment_chars": segment_chars,
+        }
         
         # Compile patterns for efficiency
         self.compiled_patterns = {}
+        atoms: List[str] = []
         for category, patterns in self.patterns.items():
             self.compiled_patterns[category] = [
-                re.compile(pattern, re.IGNORECASE) for pattern in patterns
+                re.compile(bound_repeats(pattern, max_repeat, atoms) if linear else pattern, re.IGNORECASE)
+                for pattern in patterns
             ]
-    
-    def check(self, text: str) -> Dict[str, float]:
-        """Check text against PII detection patterns and return scores."""
-        scores = {}
         
+        # Segments overlap by this much, and a match starting in a segment
+        # never reaches the end of its search window
+        self.max_match_chars = max(
+            (max_match_length(pattern) for patterns in self.compiled_patterns.values() for pattern in patterns),
+            default=0,
+        )
+        if linear and self.max_match_chars > segment_chars:
+            raise ValueError(
+                f"Regex patterns can match up to {self.max_match_chars} characters, "
+                f"more than a scan segment of {segment_chars}"
+            )
+        
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        
+        # Name every pattern so it can be part of a combined alternation
+        self.pattern_names = {}
+        self.named_patterns = {}
         for category, patterns in self.compiled_patterns.items():
-            score = 0.0
-            matches = 0
-            
+            self.pattern_names[category] = []
             for pattern in patterns:
-                if pattern.search(text):
-                    matches += 1
+                name = f"p{len(self.named_patterns)}"
+                self.pattern_names[category].append(name)
+                self.named_patterns[name] = pattern
+        
+        # All patterns start with \b, so matches can only start at word boundaries
+        self._word_bounded = all(pattern.pattern.startswith(r"\b") for pattern in self.named_patterns.values())
+        
+        # Anchors of the built-in patterns less than max_match_chars apart, see _segments
+        self._anchor_clusters: Optional[Pattern] = None
+        if linear and not self.custom_patterns:
+            self._anchor_clusters = re.compile(
+                f"(?:{_ANCHOR})(?:[^\\d@:]{{0,{self.max_match_chars}}}(?:{_ANCHOR}))*", re.IGNORECASE
+            )
+        
+        # The bounded built-in patterns match like the original ones unless a
+        # repeated character class meets a run longer than max_repeat, so linear
+        # mode finds such runs and scans the segments they reach with the
+        # original patterns. Custom patterns stay bounded.
+        self._exact_patterns: Dict[str, Pattern] = {}
+        self._long_run: Optional[Pattern] = None
+        if linear and not self.custom_patterns and atoms and ")" not in atoms and self._word_bounded:
+            self._exact_patterns = {
+                name: re.compile(source, re.IGNORECASE)
+                for category, names in self.pattern_names.items()
+                for name, source in zip(names, self.patterns[category])
+            }
+            # Runs are matched from their first character only, so finding them stays linear
+            self._long_run = re.compile(
+                "|".join(f"(?<!{atom})(?:{atom}){{{max_repeat + 1},}}" for atom in dict.fromkeys(atoms)),
+                re.IGNORECASE,
+            )
+            # A long run covers a whole aligned block of half its length, and if
+            # no repeated class matches a space, only blocks without one can be in it
+            self._run_block = max(1, (max_repeat + 1) // 2)
+            self._runs_have_spaces = self._long_run.search(" " * (max_repeat + 1)) is not None
+        self._pattern_categories = {
+            name: category for category, names in self.pattern_names.items() for name in names
+        }
+        
+        # Combined patterns, compiled lazily per set of pattern names and exactness
+        self._combined_patterns: Dict[Tuple[Tuple[str, ...], bool], Pattern] = {}
+        # Pattern names in span priority order per set of active categories
+        self._span_order: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+    
+    def _active_categories(self, text: str) -> Tuple[str, ...]:
+        """
+        Cheap prefilters: drop categories that cannot match this text.
+        
+        Every phone, card and IBAN pattern needs a digit (BIC codes need the
+        "BIC" prefix instead), emails need an "@" and IP addresses need dots
+        or colons. Categories without a prefilter are always scanned.
+        """
+        if self.custom_patterns:
+            return tuple(self.compiled_patterns)
+        if text.isascii():
+            has_digit = len(text.translate(_DELETE_ASCII_DIGITS)) != len(text)
+            has_bic = "bic" in text.lower()
+        else:
+            # \d and IGNORECASE also match non-ASCII digits and letters
+            has_digit = _UNICODE_DIGIT.search(text) is not None
+            has_bic = _BIC_PREFIX.search(text) is not None
+        
+        hints = {
+            "pii/phone": has_digit,
+            "pii/email": "@" in text,
+            "pii/credit_card": has_digit,
+            "pii/ip_address": "." in text or ":" in text,
+            "pii/iban": has_digit or has_bic,
+        }
+        return tuple(category for category in self.compiled_patterns if hints.get(category, True))
+    
+    def _combined_pattern(self, names: Tuple[str, ...], exact: bool = False) -> Pattern:
+        """Get one alternation with a named group per pattern (the original built-in patterns if exact)."""
+        combined = self._combined_patterns.get((names, exact))
+        if combined is None:
+            patterns = self._exact_patterns if exact else self.named_patterns
+            sources = [patterns[name].pattern for name in names]
             
-            # Higher scoring for PII detection: 0.8 for first match, +0.1 for each additional
-            if matches > 0:
-                score = min(0.8 + (matches - 1) * 0.1, 1.0)
+            # Factor out a shared leading word boundary so that positions inside
+            # words are rejected once instead of once per alternative
+            prefix = ""
+            if all(source.startswith(r"\b") for source in sources):
+                prefix = r"\b"
+                sources = [source[2:] for source in sources]
+            
+            alternatives = "|".join(f"(?P<{name}>{source})" for name, source in zip(names, sources))
+            combined = re.compile(f"{prefix}(?:{alternatives})", re.IGNORECASE)
             
-            scores[category] = score
+            if len(self._combined_patterns) >= _MAX_COMBINED_PATTERNS:
+                self._combined_patterns.clear()
+            self._combined_patterns[(names, exact)] = combined
+        return combined
+    
+    def _segments(self, text: str, start: int = 0, stop: Optional[int] = None, skip: bool = True):
+        """
+        Yield (start, stop, endpos) of the linear-mode segments covering text[start:stop].
+        
+        Only matches starting before a segment's stop belong to it. They are
+        found searching up to endpos, one character past the longest possible
+        match, so that \\b at their end sees the real next character.
+        
+        With the built-in table (and skip), segments only cover where a match
+        can start: at most max_match_chars before one of its anchors, so
+        stretches of prose without digits, "@", ":" or "BIC" are not scanned.
+        """
+        stop = len(text) if stop is None else stop
+        if self._anchor_clusters is None or not skip:
+            regions = [(start, stop)]
+        else:
+            regions = []
+            for cluster in self._anchor_clusters.finditer(text, start, min(len(text), stop + self.max_match_chars)):
+                region_start = max(start, cluster.start() - self.max_match_chars + 1)
+                region_stop = min(stop, cluster.end())
+                if region_start < region_stop:
+                    regions.append((region_start, region_stop))
+        for region_start, region_stop in regions:
+            for segment_start in range(region_start, region_stop, self.segment_chars):
+                segment_stop = min(segment_start + self.segment_chars, region_stop)
+                yield segment_start, segment_stop, min(len(text), segment_stop + self.max_match_chars + 1)
+    
+    def _long_runs(self, text: str) -> List[Tuple[int, int]]:
+        """(start, end) of the runs of text that a quantifier capped at max_repeat cannot cover, in text order."""
+        if self._long_run is None or len(text) <= self.max_repeat:
+            return []
+        if self._runs_have_spaces:
+            return [match.span() for match in self._long_run.finditer(text)]
+        
+        # Search the runs only around blocks without a space. A run starts at
+        # most one block before the first such block of a stretch and ends in
+        # the block after the last one, which has a space.
+        block = self._run_block
+        runs = []
+        position = 0
+        stretch_start = None
+        for block_start in range(0, len(text) + block, block):
+            if block_start < len(text) and text.find(" ", block_start, block_start + block) < 0:
+                if stretch_start is None:
+                    stretch_start = block_start
+                continue
+            if stretch_start is not None:
+                search_start = max(position, stretch_start - block)
+                for match in self._long_run.finditer(text, search_start, min(len(text), block_start + block)):
+                    runs.append(match.span())
+                    position = match.end()
+                stretch_start = None
+        return runs
+    
+    @staticmethod
+    def _reaches_run(run_ends: List[int], runs: List[Tuple[int, int]], start: int, endpos: int) -> bool:
+        """Whether a long run overlaps text[start:endpos], given the runs and their ends."""
+        index = bisect.bisect_right(run_ends, start)
+        return index < len(runs) and runs[index][0] < endpos
+    
+    def _matched_patterns(
+        self,
+        text: str,
+        categories: Tuple[str, ...],
+        deadline: Optional[float] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> Tuple[set, bool]:
+        """
+        Find the names of all patterns of the given categories that match text.
+        
+        Returns:
+            The matched pattern names, and False if the deadline (a
+            time.monotonic() value, linear mode only) stopped the scan early
+        """
+        remaining = tuple(name for category in categories for name in self.pattern_names[category])
+        matched = set()
+        runs = self._long_runs(text)
+        run_ends = [end for _, end in runs]
+        if not self.linear:
+            segments = [(start, len(text), len(text))]
+        else:
+            # Matches of the original patterns can be longer than max_match_chars
+            segments = self._segments(text, start, stop, skip=not runs)
+        
+        for segment_start, segment_stop, endpos in segments:
+            if deadline is not None and time.monotonic() > deadline:
+                return matched, False
+            position = segment_start
+            
+            if runs and self._reaches_run(run_ends, runs, segment_start, endpos):
+                # Try the original patterns at every word boundary of the segment,
+                # checking the deadline in between since each try can be long
+                for boundary in _WORD_BOUNDARY.finditer(text, segment_start, segment_stop):
+                    if deadline is not None and time.monotonic() > deadline:
+                        return matched, False
+                    offset = boundary.start()
+                    found = self._combined_pattern(remaining, exact=True).match(text, offset)
+                    while found is not None:
+                        matched.add(found.lastgroup)
+                        remaining = tuple(name for name in remaining if name != found.lastgroup)
+                        if not remaining:
+                            return matched, True
+                        found = self._combined_pattern(remaining, exact=True).match(text, offset)
+                continue
+            
+            # Each search reports the leftmost match of any remaining pattern. None of
+            # the remaining patterns match before it, so after dropping the reported
+            # pattern the next search can resume at the same position.
+            while remaining:
+                match = self._combined_pattern(remaining).search(text, position, endpos)
+                if match is None or match.start() >= segment_stop:
+                    break
+                matched.add(match.lastgroup)
+                remaining = tuple(name for name in remaining if name != match.lastgroup)
+                position = match.start()
+            if not remaining:
+                break
         
+        return matched, True
+    
+    def _scores(self, active: Tuple[str, ...], matched: set) -> Dict[str, float]:
+        """Category scores from the set of matching pattern names."""
+        scores = {category: 0.0 for category in self.compiled_patterns}
+        for category in active:
+            matches = sum(1 for name in self.pattern_names[category] if name in matched)
+            
+            # Higher scoring for PII detection: 0.8 for first match, +0.1 for each additional
+            if matches > 0:
+                scores[category] = min(0.8 + (matches - 1) * 0.1, 1.0)
         return scores
+    
+    def _deadline(self) -> Optional[float]:
+        """time.monotonic() value at which a scan starting now runs out of its budget."""
+        if not self.linear or self.scan_budget_ms <= 0:
+            return None
+        return time.monotonic() + self.scan_budget_ms / 1000
+    
+    def check(self, text: str) -> Dict[str, float]:
+        """Check text against PII detection patterns and return scores."""
+        return self.scan(text)[0]
+    
+    def check_batch(self, texts: List[str]) -> List[Dict[str, float]]:
+        """Check several texts and return their category scores in input order."""
+        return [scores for scores, _ in self.scan_batch(texts)]
+    
+    def scan(self, text: str, deadline: Optional[float] = None) -> Tuple[Dict[str, float], bool]:
+        """
+        Check text and tell whether it was scanned to the end.
+        
+        Args:
+            text: Text to check
+            deadline: time.monotonic() value at which to stop scanning (default: scan_budget_ms from now)
+        
+        Returns:
+            The scores of the matches found, and False if the scan budget ran
+            out before the end of the text
+        """
+        if deadline is None:
+            deadline = self._deadline()
+        active = self._active_categories(text)
+        if not active:
+            return self._scores(active, set()), True
+        # Pieces only carry max_match_chars of context, too little for the original patterns
+        if self.parallel_processes > 0 and len(text) >= self.parallel_min_chars and not self._long_runs(text):
+            matched, complete = self._check_parallel(text, active, deadline)
+        else:
+            matched, complete = self._matched_patterns(text, active, deadline)
+        return self._scores(active, matched), complete
+    
+    def scan_batch(self, texts: List[str]) -> List[Tuple[Dict[str, float], bool]]:
+        """Scan several texts within one scan budget, see scan."""
+        deadline = self._deadline()
+        return [self.scan(text, deadline) for text in texts]
+    
+    def _scan_pool(self) -> ProcessPoolExecutor:
+        """Process pool for the pieces of huge texts, started on first use."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.parallel_processes,
+                    initializer=_init_piece_worker,
+                    initargs=(self.options,),
+                )
+            return self._pool
+    
+    def _check_parallel(self, text: str, active: Tuple[str, ...], deadline: Optional[float]) -> Tuple[set, bool]:
+        """
+        Find the matching patterns of a huge text by scanning pieces of it in parallel.
+        
+        Each process gets its piece plus max_match_chars characters of context
+        on either side, so matches that cross a piece boundary are found by the
+        piece they start in, and \\b sees the real characters around them.
+        """
+        piece_chars = -(-len(text) // (self.parallel_processes * 2))
+        pool = self._scan_pool()
+        futures = []
+        for start in range(0, len(text), piece_chars):
+            stop = min(start + piece_chars, len(text))
+            left = max(0, start - self.max_match_chars)
+            right = min(len(text), stop + self.max_match_chars + 1)
+            futures.append(pool.submit(_scan_piece, text[left:right], start - left, stop - left, active, deadline))
+        
+        matched = set()
+        complete = True
+        for future in futures:
+            piece_matched, piece_complete = future.result()
+            matched |= piece_matched
+            complete = complete and piece_complete
+        return matched, complete
+    
+    def locate_batch(self, texts: List[str]) -> List[Tuple[Dict[str, float], List[Tuple[int, int, str]], bool]]:
+        """Locate the matches of several texts within one scan budget, see locate."""
+        deadline = self._deadline()
+        return [self.locate(text, deadline) for text in texts]
+    
+    def check_spans(self, text: str) -> Tuple[Dict[str, float], List[Tuple[int, int, str]]]:
+        """
+        Check text and also locate every PII match, in one scan.
+        
+        Spans are the successive leftmost matches of all patterns, so
+        overlapping matches of different patterns are reported once; at the
+        same position the more specific categories (see span_priority) win.
+        
+        Returns:
+            The same scores as check, and (start, end, category) character
+            offsets of the matches in text order
+        """
+        scores, spans, _ = self.locate(text)
+        return scores, spans
+    
+    def locate(self, text: str, deadline: Optional[float] = None) -> Tuple[Dict[str, float], List[Tuple[int, int, str]], bool]:
+        """
+        check_spans, also telling whether the text was scanned to the end.
+        
+        Locating spans is sequential: where a span ends decides where the next
+        one can start, so huge texts are not split across processes here.
+        
+        Args:
+            text: Text to check
+            deadline: time.monotonic() value at which to stop scanning (default: scan_budget_ms from now)
+        
+        Returns:
+            Scores, spans as in check_spans, and False if the scan budget ran
+            out before the end of the text
+        """
+        if deadline is None:
+            deadline = self._deadline()
+        active = self._active_categories(text)
+        if not active:
+            return self._scores(active, set()), [], True
+        
+        ordered = self._span_order.get(active)
+        if ordered is None:
+            priority = {category: index for index, category in enumerate(self.span_priority)}
+            ordered = tuple(
+                name
+                for category in sorted(active, key=lambda category: priority.get(category, len(priority)))
+                for name in self.pattern_names[category]
+            )
+            self._span_order[active] = ordered
+        category_of = self._pattern_categories
+        matched = set()
+        spans = []
+        complete = True
+        runs = self._long_runs(text)
+        run_ends = [end for _, end in runs]
+        
+        if not self.linear:
+            segments = [(0, len(text), len(text))]
+        else:
+            segments = self._segments(text, skip=not runs)
+        combined = self._combined_pattern(ordered)
+        position = 0
+        for segment_start, segment_stop, endpos in segments:
+            if deadline is not None and time.monotonic() > deadline:
+                complete = False
+                break
+            if runs and self._reaches_run(run_ends, runs, segment_start, endpos):
+                # The original patterns at each word boundary, see _matched_patterns
+                exact = self._combined_pattern(ordered, exact=True)
+                for boundary in _WORD_BOUNDARY.finditer(text, max(position, segment_start), segment_stop):
+                    offset = boundary.start()
+                    if offset < position:
+                        continue
+                    if deadline is not None and time.monotonic() > deadline:
+                        complete = False
+                        break
+                    match = exact.match(text, offset)
+                    if match is not None:
+                        spans.append((offset, match.end(), category_of[match.lastgroup]))
+                        matched.add(match.lastgroup)
+                        position = match.end()
+                if not complete:
+                    break
+                continue
+            # A span of the previous segment may reach into this one
+            for match in combined.finditer(text, max(position, segment_start), endpos):
+                start, end = match.span()
+                if start >= segment_stop:
+                    break
+                spans.append((start, end, category_of[match.lastgroup]))
+                matched.add(match.lastgroup)
+                position = end
+        
+        # No pattern matches starting in the gaps between spans (each span is
+        # the leftmost match of any pattern), so patterns that never won can
+        # only match starting inside a span. Probe those positions for them,
+        # skipping categories whose score is already at its maximum.
+        unmatched = tuple(name for name in ordered if name not in matched)
+        for start, end, _ in spans:
+            if not complete or (deadline is not None and time.monotonic() > deadline):
+                complete = False
+                break
+            # A category's score is at its maximum once three of its patterns matched
+            full = {category for category in active if self._pattern_counts(category, matched) >= 3}
+            unmatched = tuple(
+                name for name in unmatched
+                if name not in matched and category_of[name] not in full
+            )
+            if not unmatched:
+                break
+            if self._word_bounded:
+                offsets = [boundary.start() for boundary in _WORD_BOUNDARY.finditer(text, start, end)]
+            else:
+                offsets = range(start, end)
+            # Spans reaching a long run can hide matches only the original patterns find
+            exact = bool(runs) and self._reaches_run(run_ends, runs, start, end + self.max_match_chars + 1)
+            probe = self._combined_pattern(unmatched, exact)
+            for offset in offsets:
+                if exact and deadline is not None and time.monotonic() > deadline:
+                    complete = False
+                    break
+                # Several patterns can match at the same offset, so retry it until none does
+                found = probe.match(text, offset)
+                while found is not None:
+                    matched.add(found.lastgroup)
+                    unmatched = tuple(name for name in unmatched if name != found.lastgroup)
+                    if not unmatched:
+                        break
+                    probe = self._combined_pattern(unmatched, exact)
+                    found = probe.match(text, offset)
+                if not unmatched:
+                    break
+        
+        return self._scores(active, matched), spans, complete
+    
+    def _pattern_counts(self, category: str, matched: set) -> int:
+        """Number of matched patterns of a category."""
+        return sum(1 for name in self.pattern_names[category] if name in matched)
+    
+    def redact(self, text: str, spans: List[Tuple[int, int, str]], template: str = "[{category}]") -> str:
+        """Replace each span by the template, formatted with its category."""
+        parts = []
+        position = 0
+        for start, end, category in spans:
+            parts.append(text[position:start])
+            parts.append(template.format(category=category))
+            position = end
+        parts.append(text[position:])
+        return "".join(parts)
+    
+    def fingerprint(self) -> str:
+        """Identify the checker by version and compiled pattern table."""
+        table = sorted(
+            (category, [pattern.pattern for pattern in patterns]) for category, patterns in self.compiled_patterns.items()
+        )
+        digest = hashlib.sha256(repr(table).encode("utf-8")).hexdigest()
+        return f"{super().fingerprint()}:{digest[:16]}"
+    
+    def close(self):
+        """Shut the scan pool down, letting its processes finish the pieces they started."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+    
+    def after_fork(self):
+        """Start a new scan pool on first use; the parent's pool processes belong to the parent."""
+        self._pool = None
+        self._pool_lock = threading.Lock()
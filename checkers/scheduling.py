@@ -0,0 +1,61 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+import metrics
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+# Priority lane of the request being processed; carried into worker threads with contextvars.copy_context()
+LANE: contextvars.ContextVar = contextvars.ContextVar("lane", default=INTERACTIVE)
+
+
+def current_lane() -> str:
+    """Priority lane of the work running in this context."""
+    return LANE.get()
+
+
+class PriorityGate:
+    """
+    Orders forward passes of a shared model by priority lane.
+
+    Interactive passes start right away. A bulk pass only starts while no
+    interactive pass is running or about to run, so a long bulk request
+    yields to interactive traffic at every batch boundary.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._interactive = 0
+        self.preemptions = 0
+
+    @contextmanager
+    def slot(self, lane: str) -> Iterator[None]:
+        """Hold a forward pass slot for the given lane."""
+        if lane != BULK:
+            with self._cond:
+                self._interactive += 1
+            try:
+                yield
+            finally:
+                with self._cond:
+                    self._interactive -= 1
+                    if not self._interactive:
+                        self._cond.notify_all()
+            return
+
+        with self._cond:
+            if self._interactive:
+                self.preemptions += 1
+                metrics.BULK_PREEMPTIONS.inc()
+                while self._interactive:
+                    self._cond.wait()
+        yield
+
+    def after_fork(self):
+        """Drop the parent's lock state in a forked worker."""
+        self._cond = threading.Condition()
+        self._interactive = 0
@@ -0,0 +1,122 @@
+"""Server configuration, read from environment variables."""
+
+import os
+
+
+def _get_bool(name: str, default: bool) -> bool:
+    """Read a boolean flag from the environment."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Server
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+
+# Checkers
+USE_BERT = _get_bool("USE_BERT", True)
+FLAGGING_THRESHOLD = float(os.getenv("FLAGGING_THRESHOLD", "0.5"))
+BERT_MODEL_NAME = os.getenv("BERT_MODEL_NAME", "unitary/toxic-bert")
+BERT_BATCH_SIZE = int(os.getenv("BERT_BATCH_SIZE", "32"))
+BERT_WINDOW_STRIDE = int(os.getenv("BERT_WINDOW_STRIDE", "128"))
+BERT_EARLY_EXIT = _get_bool("BERT_EARLY_EXIT", False)
+BERT_BACKEND = os.getenv("BERT_BACKEND", "torch")  # torch, torch-int8, onnx or onnx-int8
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "~/.cache/llm-guardrails-server")
+BERT_BACKGROUND_LOAD = _get_bool("BERT_BACKGROUND_LOAD", True)
+SERVE_REGEX_WHILE_LOADING = _get_bool("SERVE_REGEX_WHILE_LOADING", False)
+BERT_WARM_UP = _get_bool("BERT_WARM_UP", True)
+# Benchmark torch thread counts and BERT batch sizes at startup; the choice is
+# cached in MODEL_CACHE_DIR per CPU model, core count, workers and model
+BERT_AUTOTUNE = _get_bool("BERT_AUTOTUNE", False)
+AUTOTUNE_MAX_BATCH_MS = float(os.getenv("AUTOTUNE_MAX_BATCH_MS", "100"))
+
+# Replacement for PII matches in redacted texts ({category} is e.g. "pii/email")
+REDACTION_TEMPLATE = os.getenv("REDACTION_TEMPLATE", "[{category}]")
+
+# Micro-batching of concurrent BERT calls (a max size of 1 disables batching).
+# Texts arriving while a batch runs form the next one; a nonzero max wait
+# also holds a batch back until it fills up or its first text waited that long.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "0"))
+
+# Off-loop execution with a bounded admission queue
+EXECUTOR_KIND = os.getenv("EXECUTOR_KIND", "thread")  # "thread" or "process" (regex-only)
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", "32"))
+EXECUTOR_QUEUE_SIZE = int(os.getenv("EXECUTOR_QUEUE_SIZE", "256"))
+OVERLOAD_STATUS_CODE = int(os.getenv("OVERLOAD_STATUS_CODE", "503"))  # 429 or 503
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "1"))
+
+# Priority lanes: bulk requests get their own workers and queue, and their BERT
+# forward passes yield to interactive ones
+BULK_EXECUTOR_WORKERS = int(os.getenv("BULK_EXECUTOR_WORKERS", "4"))
+BULK_EXECUTOR_QUEUE_SIZE = int(os.getenv("BULK_EXECUTOR_QUEUE_SIZE", "64"))
+BULK_MIN_TEXTS = int(os.getenv("BULK_MIN_TEXTS", "0"))  # lists this long always run as bulk (0 disables)
+# API keys (Authorization: Bearer KEY) pinned to a lane, e.g. "key1:bulk,key2:interactive"
+PRIORITY_API_KEYS = {
+    key.strip(): lane.strip()
+    for key, _, lane in (item.rpartition(":") for item in os.getenv("PRIORITY_API_KEYS", "").split(",") if item.strip())
+}
+for _lane in PRIORITY_API_KEYS.values():
+    if _lane not in ("interactive", "bulk"):
+        raise ValueError(f"PRIORITY_API_KEYS: unknown lane {_lane!r}, expected interactive or bulk")
+
+# Latency budget per /v1/moderations request, overridable with the X-Request-Deadline-Ms
+# header; BERT scores that miss it are left out (0 waits for every checker)
+REQUEST_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS", "0"))
+
+# Per-request tracing: a Server-Timing header with the time per stage on moderation
+# responses, and a structured log record of requests slower than SLOW_REQUEST_MS (0: none)
+SERVER_TIMING = _get_bool("SERVER_TIMING", False)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+# Regex stage: linear mode bounds every quantifier and scans in overlapping segments,
+# so scan time grows linearly with the input; the built-in patterns keep their unbounded
+# matches by scanning segments with runs longer than the cap with the original patterns.
+# The budget (0: none) caps the regex time per request, and texts not scanned to the end
+# are marked as degraded
+REGEX_LINEAR = _get_bool("REGEX_LINEAR", True)
+REGEX_MAX_REPEAT = int(os.getenv("REGEX_MAX_REPEAT", "256"))  # cap on *, + and {n,} in custom patterns
+REGEX_SEGMENT_CHARS = int(os.getenv("REGEX_SEGMENT_CHARS", str(1 << 13)))
+REGEX_SCAN_BUDGET_MS = float(os.getenv("REGEX_SCAN_BUDGET_MS", "250"))
+# Processes scanning the segments of huge texts in parallel (0 scans in the request's worker)
+REGEX_PARALLEL_PROCESSES = int(os.getenv("REGEX_PARALLEL_PROCESSES", "0"))
+REGEX_PARALLEL_MIN_CHARS = int(os.getenv("REGEX_PARALLEL_MIN_CHARS", str(1 << 20)))
+
+# Streaming NDJSON endpoint
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "256"))
+STREAM_MAX_INFLIGHT = int(os.getenv("STREAM_MAX_INFLIGHT", "2"))
+STREAM_MAX_LINE_BYTES = int(os.getenv("STREAM_MAX_LINE_BYTES", str(1 << 20)))
+
+# Wire formats: responses of at least COMPRESSION_MIN_BYTES are gzip/zstd compressed
+# when the client sends Accept-Encoding (0 disables response compression)
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+MAX_DECOMPRESSED_BYTES = int(os.getenv("MAX_DECOMPRESSED_BYTES", str(64 << 20)))  # per compressed request body
+
+# Per-conversation memo of message scores for /v1/moderations/conversation (0 disables it)
+CONVERSATION_MAX = int(os.getenv("CONVERSATION_MAX", "10000"))
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "1000"))
+CONVERSATION_IDLE_SECONDS = float(os.getenv("CONVERSATION_IDLE_SECONDS", "1800"))
+
+# Content-addressed result cache (0 entries disables it)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "100000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+
+# Cascade policy: skip BERT where it cannot change the flagged outcome
+CASCADE_SKIP_IF_REGEX_FLAGGED = _get_bool("CASCADE_SKIP_IF_REGEX_FLAGGED", False)
+CASCADE_MIN_BERT_LENGTH = int(os.getenv("CASCADE_MIN_BERT_LENGTH", "0"))
+CASCADE_SKIP_WITHOUT_LETTERS = _get_bool("CASCADE_SKIP_WITHOUT_LETTERS", False)
+
+# Bearer token of the /admin endpoints (hot reload of checkers, profiling); unset disables them
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+RELOAD_DRAIN_TIMEOUT = float(os.getenv("RELOAD_DRAIN_TIMEOUT", "60"))  # seconds to wait for requests on the old checkers
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))  # longest /admin/profile run
+
+# Pre-fork serving (serve.py)
+PRE_FORK = False  # set by serve.py before it imports the app: the master then runs no BERT inference
+WORKERS = int(os.getenv("WORKERS", "1"))
+TORCH_THREADS_PER_WORKER = int(os.getenv("TORCH_THREADS_PER_WORKER", "0"))  # 0 splits the cores evenly (or uses BERT_AUTOTUNE)
+WORKER_REPORT_INTERVAL = float(os.getenv("WORKER_REPORT_INTERVAL", "60"))
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ConversationStore:
+    """Per-conversation memo of message scores, evicting idle and least recently used conversations."""
+
+    def __init__(self, max_conversations: int = 10000, max_messages: int = 1000, idle_seconds: float = 1800.0):
+        """
+        Initialize the store.
+
+        Args:
+            max_conversations: Maximum number of stored conversations; the least recently used are evicted first
+            max_messages: Maximum number of messages stored per conversation; the oldest are evicted first
+            idle_seconds: Time without a request after which a conversation is dropped (0 disables expiry)
+        """
+        self.max_conversations = max_conversations
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self.fingerprint = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # conversation id -> (last access, message key -> (text length, value)), oldest access first
+        self._conversations: "OrderedDict[str, Tuple[float, OrderedDict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_fingerprint(self, fingerprint: str):
+        """Bind the store to a checker configuration, dropping scores from any other one."""
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self._conversations.clear()
+                self.fingerprint = fingerprint
+
+    def _expire(self, now: float):
+        """Drop conversations idle for longer than idle_seconds; they are ordered by last access."""
+        if self.idle_seconds <= 0:
+            return
+        while self._conversations:
+            last_access, _ = next(iter(self._conversations.values()))
+            if now - last_access <= self.idle_seconds:
+                break
+            self._conversations.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, conversation_id: str, keys: List[str], lengths: List[int]) -> List[Optional[Any]]:
+        """
+        Look up stored message values of a conversation.
+
+        A message is only reused if its text still has the stored length, a
+        cheap guard against a client editing a message but keeping its id.
+
+        Returns:
+            The stored value per key, None for messages not seen before
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                self.misses += len(keys)
+                return [None] * len(keys)
+            messages = entry[1]
+            self._conversations[conversation_id] = (now, messages)
+            self._conversations.move_to_end(conversation_id)
+
+            values = []
+            for key, length in zip(keys, lengths):
+                stored = messages.get(key)
+                if stored is not None and stored[0] == length:
+                    self.hits += 1
+                    values.append(stored[1])
+                else:
+                    self.misses += 1
+                    values.append(None)
+            return values
+
+    def put_many(self, conversation_id: str, items: List[Tuple[str, int, Any]]):
+        """Store (message key, text length, value) items of a conversation."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            messages = OrderedDict() if entry is None else entry[1]
+            for key, length, value in items:
+                messages[key] = (length, value)
+                messages.move_to_end(key)
+            while len(messages) > self.max_messages:
+                messages.popitem(last=False)
+            self._conversations[conversation_id] = (now, messages)
+            self._conversations.move_to_end(conversation_id)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all conversations."""
+        with self._lock:
+            self._conversations.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters (per message) and current size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "conversations": len(self._conversations),
+            "max_conversations": self.max_conversations,
+        }
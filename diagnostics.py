@@ -0,0 +1,60 @@
+"""Process diagnostics shared by the server and the pre-fork supervisor."""
+
+import os
+import sys
+from typing import Dict, Optional
+
+# Index of this process in a pre-fork worker pool (None when not pre-forked)
+WORKER_INDEX: Optional[int] = None
+
+
+def memory_usage(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    Memory usage of a process in bytes, read from /proc (Linux only).
+
+    "pss" splits copy-on-write pages shared between workers proportionally,
+    so summing it over workers gives their real combined footprint.
+    """
+    proc = f"/proc/{pid or 'self'}"
+    usage = {}
+
+    try:
+        with open(f"{proc}/smaps_rollup", encoding="ascii") as smaps:
+            for line in smaps:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"):
+                    usage[key.lower()] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+
+    try:
+        with open(f"{proc}/status", encoding="ascii") as status:
+            for line in status:
+                key, _, value = line.partition(":")
+                if key == "VmHWM":
+                    usage["peak_rss"] = int(value.split()[0]) * 1024
+                elif key == "VmRSS" and "rss" not in usage:
+                    usage["rss"] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+
+    return usage
+
+
+def torch_threads() -> Dict[str, int]:
+    """Torch intra-/inter-op thread counts, if torch has been imported."""
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return {}
+    return {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()}
+
+
+def runtime_info() -> Dict:
+    """Diagnostics for the current process."""
+    return {
+        "pid": os.getpid(),
+        "worker_index": WORKER_INDEX,
+        "cpu_count": os.cpu_count(),
+        "memory": memory_usage(),
+        "torch_threads": torch_threads(),
+    }
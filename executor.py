@@ -0,0 +1,259 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import metrics
+import tracing
+from checkers.scheduling import BULK, INTERACTIVE, LANE
+from service import ModerationService
+
+
+class QueueFullError(Exception):
+    """Raised when the admission queue has no room for another request."""
+
+
+# Per-process service used by the process pool (regex-only workloads)
+_worker_service: Optional[ModerationService] = None
+
+
+def _init_regex_worker(checker_options: Dict, redaction_template: str = "[{category}]"):
+    """Build a regex-only ModerationService in each pool process."""
+    global _worker_service
+    _worker_service = ModerationService(use_bert=False, redaction_template=redaction_template, **checker_options)
+
+
+def _moderate_in_worker(
+    input_data: Union[str, List[str]], model: str, return_spans: bool, redact: bool, deadline: Optional[float], shape: str
+) -> Dict:
+    """Run moderation inside a pool process."""
+    return _worker_service.moderate_payload(
+        input_data=input_data, model=model, return_spans=return_spans, redact=redact, deadline=deadline, shape=shape
+    )
+
+
+def _scan_in_worker(texts: List[str]) -> List[Tuple[Dict[str, float], bool]]:
+    """Regex-scan texts inside a pool process (see RegexModerationChecker.scan_batch)."""
+    start = time.perf_counter()
+    scans = _worker_service.regex_checker.scan_batch(texts)
+    metrics.REGEX_SECONDS.observe(time.perf_counter() - start)
+    return scans
+
+
+def _moderate_texts_in_worker(texts: List[str], shape: str) -> List[Dict]:
+    """Run batched moderation inside a pool process."""
+    return _worker_service.moderate_results(texts, shape=shape)
+
+
+def _run_timed(submitted: float, fn: Callable, *args):
+    """Run fn(*args), adding the time it waited for a worker to the request trace."""
+    tracing.record("queue", time.monotonic() - submitted)
+    return fn(*args)
+
+
+def _run_traced_in_worker(submitted: float, fn: Callable, *args) -> Tuple[object, Dict[str, float]]:
+    """Run fn(*args) in a pool process under a trace of its own and return its result and stage durations."""
+    trace = tracing.Trace()
+    # time.monotonic() is system-wide, so the wait is measured across processes
+    trace.add("queue", time.monotonic() - submitted)
+    with tracing.activate(trace):
+        result = fn(*args)
+    return result, trace.stages
+
+
+class _Lane:
+    """Workers and admission count of one priority lane."""
+
+    def __init__(self, executor: Executor, workers: int, max_pending: int):
+        self.executor = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+
+
+class ModerationExecutor:
+    """Runs moderation work off the event loop behind bounded admission queues, one per priority lane."""
+
+    def __init__(
+        self,
+        service: ModerationService,
+        kind: str = "thread",
+        max_workers: int = 32,
+        queue_size: int = 256,
+        bulk_workers: int = 4,
+        bulk_queue_size: int = 64,
+    ):
+        """
+        Initialize the executor.
+
+        Interactive and bulk requests have separate workers and queues, so a
+        burst of bulk work never occupies the workers interactive requests need.
+
+        Args:
+            service: Moderation service the work is run against
+            kind: "thread" (required for BERT) or "process" (regex-only services)
+            max_workers: Number of worker threads or processes of the interactive lane
+            queue_size: Number of interactive requests allowed to wait for a free worker
+            bulk_workers: Number of worker threads or processes of the bulk lane
+            bulk_queue_size: Number of bulk requests allowed to wait for a free worker
+        """
+        self.service = service
+        self.max_workers = max_workers
+
+        if kind == "process" and service.use_bert:
+            print("Process pool is only supported for regex-only moderation, using threads")
+            kind = "thread"
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+
+        self._lanes: Dict[str, _Lane] = {}
+        for lane, workers, lane_queue_size in ((INTERACTIVE, max_workers, queue_size), (BULK, bulk_workers, bulk_queue_size)):
+            workers = max(1, workers)
+            if kind == "process":
+                executor: Executor = self._process_pool(workers)
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"moderation-{lane}")
+            self._lanes[lane] = _Lane(executor, workers, workers + lane_queue_size)
+        self._local: Optional[ThreadPoolExecutor] = None
+        if kind == "process":
+            # Pool processes hold their own copy of the checkers, so a reload replaces them
+            service.add_swap_listener(self._restart_pools)
+            # Threads of this process that run work needing state of this process (the conversation
+            # store) and hand its CPU-bound part to the pool processes, see run(local=True)
+            self._local = ThreadPoolExecutor(
+                max_workers=sum(lane.workers for lane in self._lanes.values()), thread_name_prefix="moderation-local"
+            )
+
+    def _process_pool(self, workers: int) -> ProcessPoolExecutor:
+        """Pool of processes that each build the service's current regex-only configuration."""
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_regex_worker,
+            initargs=(self.service.checker_options(), self.service.redaction_template),
+        )
+
+    def _restart_pools(self, _checkers):
+        """Send new work to fresh pool processes; the old ones finish what they started and exit."""
+        for lane in self._lanes.values():
+            previous, lane.executor = lane.executor, self._process_pool(lane.workers)
+            previous.shutdown(wait=False)
+
+    @property
+    def pending(self) -> int:
+        """Number of admitted requests that are running or waiting for a worker, over all lanes."""
+        return sum(lane.pending for lane in self._lanes.values())
+
+    def lane_stats(self) -> Dict[str, Dict[str, int]]:
+        """Workers, admitted requests and admission limit per lane."""
+        return {
+            name: {"workers": lane.workers, "pending": lane.pending, "max_pending": lane.max_pending}
+            for name, lane in self._lanes.items()
+        }
+
+    async def run(self, fn: Callable, *args, lane: str = INTERACTIVE, local: bool = False):
+        """
+        Run fn(*args) on the workers of a priority lane.
+
+        Args:
+            fn: Function to run
+            *args: Arguments of fn
+            lane: Priority lane whose workers and admission queue are used
+            local: Run fn in a thread of this process even with a process pool,
+                for work that needs this process's state and sends its CPU-bound
+                part to the pool itself (see _scan_in_pool)
+
+        Raises:
+            QueueFullError: If the admission queue of the lane is full
+        """
+        state = self._lanes[lane]
+        # Only touched from the event loop thread, so no lock is needed
+        if state.pending >= state.max_pending:
+            raise QueueFullError(f"Moderation queue ({lane}) is full, retry later")
+
+        state.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            trace = tracing.current()
+            if self.kind == "process" and not local:
+                if trace is None:
+                    return await loop.run_in_executor(state.executor, functools.partial(fn, *args))
+                # The trace cannot follow the work into the pool process, so its stages are sent back
+                call = functools.partial(_run_traced_in_worker, time.monotonic(), fn, *args)
+                result, stages = await loop.run_in_executor(state.executor, call)
+                trace.merge(stages)
+                return result
+            # The lane and trace travel with the work into checker threads (see checkers.scheduling)
+            context = contextvars.copy_context()
+            context.run(LANE.set, lane)
+            call = functools.partial(context.run, _run_timed, time.monotonic(), fn, *args)
+            return await loop.run_in_executor(self._local if local and self._local else state.executor, call)
+        finally:
+            state.pending -= 1
+
+    def _scan_in_pool(self, lane: str, texts: List[str]) -> List[Tuple[Dict[str, float], bool]]:
+        """Regex-scan texts in a process of a lane's pool, blocking the calling thread until they are scanned."""
+        executor = self._lanes[lane].executor
+        trace = tracing.current()
+        if trace is None:
+            return executor.submit(_scan_in_worker, texts).result()
+        scans, stages = executor.submit(_run_traced_in_worker, time.monotonic(), _scan_in_worker, texts).result()
+        trace.merge(stages)
+        return scans
+
+    async def moderate(
+        self,
+        input_data: Union[str, List[str]],
+        model: str,
+        return_spans: bool = False,
+        redact: bool = False,
+        deadline: Optional[float] = None,
+        lane: str = INTERACTIVE,
+        shape: str = "full",
+    ) -> Dict:
+        """Moderate input data on the executor and return the response dict (see ModerationService.moderate_payload)."""
+        # time.monotonic() is system-wide, so the deadline also holds in pool processes
+        if self.kind == "process":
+            return await self.run(_moderate_in_worker, input_data, model, return_spans, redact, deadline, shape, lane=lane)
+        return await self.run(
+            self.service.moderate_payload, input_data, model, return_spans, redact, deadline, shape, lane=lane
+        )
+
+    async def moderate_conversation(
+        self,
+        conversation_id: str,
+        messages: List[Tuple[Optional[str], str]],
+        model: str,
+        deadline: Optional[float] = None,
+        new_only: bool = False,
+        lane: str = INTERACTIVE,
+        shape: str = "full",
+    ) -> Dict:
+        """Moderate a conversation on the executor (see ModerationService.moderate_conversation)."""
+        if self.kind == "process":
+            # Pool processes would each keep a store of their own that most turns miss,
+            # so the store stays in this process and only new messages are scanned in the pool
+            scan = functools.partial(self._scan_in_pool, lane)
+            return await self.run(
+                self.service.moderate_conversation,
+                conversation_id, messages, model, deadline, new_only, shape, scan,
+                lane=lane, local=True,
+            )
+        return await self.run(
+            self.service.moderate_conversation, conversation_id, messages, model, deadline, new_only, shape, lane=lane
+        )
+
+    async def moderate_texts(self, texts: List[str], lane: str = INTERACTIVE, shape: str = "full") -> List[Dict]:
+        """Moderate a batch of texts on the executor and return result dicts (see ModerationService.moderate_results)."""
+        if self.kind == "process":
+            return await self.run(_moderate_texts_in_worker, texts, shape, lane=lane)
+        return await self.run(functools.partial(self.service.moderate_results, shape=shape), texts, lane=lane)
+
+    def shutdown(self):
+        """Stop the worker threads or processes."""
+        for lane in self._lanes.values():
+            lane.executor.shutdown(wait=False, cancel_futures=True)
+        if self._local is not None:
+            self._local.shutdown(wait=False, cancel_futures=True)
@@ -1,14 +1,47 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hmac
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Literal, Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-from models import ModerationRequest, ModerationResponse
-from service import ModerationService
+import config
+import diagnostics
+import metrics
+import profiler
+import tracing
+from cascade import CascadePolicy
+from checkers.scheduling import BULK, INTERACTIVE
+from executor import ModerationExecutor, QueueFullError
+from models import (
+    ConversationModerationRequest,
+    ConversationModerationResponse,
+    ModerationRequest,
+    ModerationResponse,
+    ReloadRequest,
+    ResponseShape,
+    encode_json,
+)
+from service import ModerationService, ReloadInProgressError, ServiceNotReadyError
+from streaming import NDJSONStreamingResponse, moderate_ndjson
+from wire import MSGPACK_TYPE, WireFormatMiddleware, encode_msgpack, response_media_type
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Shut the moderation executor down with the server."""
+    yield
+    moderation_executor.shutdown()
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="LLM Guardrails Server",
     description="A moderation server compatible with OpenAI's moderation API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -20,8 +53,82 @@ app.add_middleware(
     allow_headers=["*"], # TODO: Update to specific headers in production
 )
 
+# Compressed and msgpack request and response bodies
+app.add_middleware(
+    WireFormatMiddleware,
+    min_size=config.COMPRESSION_MIN_BYTES,
+    gzip_level=config.GZIP_LEVEL,
+    zstd_level=config.ZSTD_LEVEL,
+    max_decompressed_bytes=config.MAX_DECOMPRESSED_BYTES,
+)
+
 # Initialize moderation service
-moderation_service = ModerationService(use_bert=True, flagging_threshold=0.5)
+moderation_service = ModerationService(
+    use_bert=config.USE_BERT,
+    flagging_threshold=config.FLAGGING_THRESHOLD,
+    model_name=config.BERT_MODEL_NAME,
+    bert_batch_size=config.BERT_BATCH_SIZE,
+    bert_window_stride=config.BERT_WINDOW_STRIDE,
+    bert_early_exit=config.BERT_EARLY_EXIT,
+    bert_backend=config.BERT_BACKEND,
+    model_cache_dir=config.MODEL_CACHE_DIR,
+    batch_max_size=config.BATCH_MAX_SIZE,
+    batch_max_wait_ms=config.BATCH_MAX_WAIT_MS,
+    cache_max_entries=config.CACHE_MAX_ENTRIES,
+    cache_ttl_seconds=config.CACHE_TTL_SECONDS,
+    cascade_policy=CascadePolicy(
+        skip_if_regex_flagged=config.CASCADE_SKIP_IF_REGEX_FLAGGED,
+        min_bert_length=config.CASCADE_MIN_BERT_LENGTH,
+        skip_without_letters=config.CASCADE_SKIP_WITHOUT_LETTERS,
+    ),
+    # Open the port right away and load BERT behind the readiness probe
+    load_in_background=config.BERT_BACKGROUND_LOAD,
+    bert_warm_up=config.BERT_WARM_UP,
+    pre_fork=config.PRE_FORK,
+    serve_regex_while_loading=config.SERVE_REGEX_WHILE_LOADING,
+    redaction_template=config.REDACTION_TEMPLATE,
+    # One unbatched BERT call per moderation worker can be in flight
+    checker_workers=config.EXECUTOR_WORKERS + config.BULK_EXECUTOR_WORKERS,
+    conversation_max=config.CONVERSATION_MAX,
+    conversation_max_messages=config.CONVERSATION_MAX_MESSAGES,
+    conversation_idle_seconds=config.CONVERSATION_IDLE_SECONDS,
+    bert_autotune=config.BERT_AUTOTUNE,
+    # Processes sharing the cores: serve.py workers, or just this one
+    autotune_workers=config.WORKERS,
+    autotune_max_batch_ms=config.AUTOTUNE_MAX_BATCH_MS,
+    regex_options=dict(
+        linear=config.REGEX_LINEAR,
+        max_repeat=config.REGEX_MAX_REPEAT,
+        segment_chars=config.REGEX_SEGMENT_CHARS,
+        scan_budget_ms=config.REGEX_SCAN_BUDGET_MS,
+        parallel_processes=config.REGEX_PARALLEL_PROCESSES,
+        parallel_min_chars=config.REGEX_PARALLEL_MIN_CHARS,
+    ),
+)
+
+# Run moderation off the event loop so /health stays responsive under load
+moderation_executor = ModerationExecutor(
+    moderation_service,
+    kind=config.EXECUTOR_KIND,
+    max_workers=config.EXECUTOR_WORKERS,
+    queue_size=config.EXECUTOR_QUEUE_SIZE,
+    bulk_workers=config.BULK_EXECUTOR_WORKERS,
+    bulk_queue_size=config.BULK_EXECUTOR_QUEUE_SIZE,
+)
+
+# Set by serve.py: its workers share the checkers loaded by the master, so
+# reloads are forwarded to the master, which forks workers with the new ones
+reload_forwarder = None
+
+# Queue depths are read when /metrics is scraped
+metrics.gauge(
+    "moderation_executor_pending", "Admitted requests running or waiting for a moderation worker.",
+    lambda: moderation_executor.pending
+)
+metrics.gauge(
+    "moderation_batcher_queue_depth", "Texts waiting for a BERT micro-batch slot.",
+    lambda: moderation_service.bert_batcher.queue_depth() if moderation_service.bert_batcher else 0
+)
 
 
 @app.get("/")
@@ -32,7 +139,14 @@ async def root():
         "version": "0.1.0",
         "endpoints": {
             "moderation": "/v1/moderations",
-            "health": "/health"
+            "moderation_conversation": "/v1/moderations/conversation",
+            "moderation_stream": "/v1/moderations/stream",
+            "health": "/health",
+            "metrics": "/metrics",
+            "liveness": "/livez",
+            "readiness": "/readyz",
+            "reload": "/admin/reload",
+            "profile": "/admin/profile"
         }
     }
 
@@ -42,33 +156,362 @@ async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "bert_available": moderation_service.use_bert,
-        "regex_available": True
+        "config_version": moderation_service.config_version,
+        "bert_available": moderation_service.bert_status == "ready",
+        "regex_available": True,
+        "checkers": moderation_service.checker_status(),
+        "cache": moderation_service.result_cache.stats() if moderation_service.result_cache else None,
+        "conversations": moderation_service.conversation_store.stats() if moderation_service.conversation_store else None,
+        "stages": moderation_service.cascade_policy.stats(),
+        "lanes": moderation_executor.lane_stats()
     }
 
 
-@app.post("/v1/moderations", response_model=ModerationResponse)
-async def create_moderation(request: ModerationRequest):
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process is up and the event loop responds."""
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: 200 once moderation requests can be served, 503 while the checkers load."""
+    return JSONResponse(
+        status_code=200 if moderation_service.ready else 503,
+        content={"ready": moderation_service.ready, "checkers": moderation_service.checker_status()}
+    )
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Request, stage latency, input length, batch and queue metrics in the Prometheus text format."""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/debug/runtime")
+async def runtime_info():
+    """Process, worker, memory, torch thread and autotuning diagnostics for the worker serving this request."""
+    return {**diagnostics.runtime_info(), "autotune": moderation_service.tuning}
+
+
+def _request_deadline(deadline_ms: Optional[float]) -> Optional[float]:
+    """time.monotonic() deadline of a request arriving now, from its header or REQUEST_DEADLINE_MS."""
+    if deadline_ms is None:
+        deadline_ms = config.REQUEST_DEADLINE_MS
+    return time.monotonic() + deadline_ms / 1000 if deadline_ms > 0 else None
+
+
+def _request_lane(priority: Optional[str], authorization: Optional[str], text_count: int) -> str:
+    """
+    Priority lane of a request.
+    
+    An API key listed in PRIORITY_API_KEYS sets the highest lane the client
+    may use; the X-Priority header can only lower it. Lists of at least
+    BULK_MIN_TEXTS texts always go to the bulk lane.
+    """
+    lane = INTERACTIVE
+    if authorization and authorization.lower().startswith("bearer "):
+        lane = config.PRIORITY_API_KEYS.get(authorization[7:].strip(), INTERACTIVE)
+    if priority == BULK or (config.BULK_MIN_TEXTS > 0 and text_count >= config.BULK_MIN_TEXTS):
+        lane = BULK
+    return lane
+
+
+def _json_response(
+    payload: Dict, results: List[Dict], accept: Optional[str] = None, include_config_version: bool = False
+) -> Response:
+    """
+    Encode a payload built in the wire format.
+    
+    The body is JSON unless the Accept header asks for msgpack. The checker
+    configuration version goes into the X-Config-Version header, and only
+    with include_config_version also into the body, which otherwise keeps
+    the OpenAI response format. Checkers that missed the deadline go into
+    X-Moderation-Degraded.
+    """
+    # The payload is built in the wire format, so skip response_model validation
+    config_version = payload["config_version"] if include_config_version else payload.pop("config_version")
+    start = time.perf_counter()
+    media_type = response_media_type(accept)
+    content = encode_msgpack(payload) if media_type == MSGPACK_TYPE else encode_json(payload)
+    response = Response(content=content, media_type=media_type)
+    metrics.SERIALIZATION_SECONDS.observe(time.perf_counter() - start)
+    response.headers["X-Config-Version"] = config_version
+    degraded = sorted({name for result in results for name in result.get("degraded", ())})
+    if degraded:
+        response.headers["X-Moderation-Degraded"] = ",".join(degraded)
+    return response
+
+
+def _start_trace() -> Optional[tracing.Trace]:
+    """Trace the request in this context if Server-Timing headers or slow-request records are enabled."""
+    if config.SERVER_TIMING or config.SLOW_REQUEST_MS > 0:
+        return tracing.start()
+    return None
+
+
+def _finish_trace(
+    trace: Optional[tracing.Trace],
+    response: Optional[Response],
+    endpoint: str,
+    seconds: float,
+    texts: Iterable[str],
+    lane: str,
+    outcome: str,
+):
+    """Add the Server-Timing header to a response and log the request if it took longer than SLOW_REQUEST_MS."""
+    if trace is None:
+        return
+    if response is not None and config.SERVER_TIMING:
+        response.headers["Server-Timing"] = trace.server_timing()
+    if config.SLOW_REQUEST_MS > 0 and seconds * 1000 >= config.SLOW_REQUEST_MS:
+        record = tracing.slow_request_record(
+            endpoint,
+            trace,
+            seconds,
+            texts,
+            lane=lane,
+            outcome=outcome,
+            worker=diagnostics.WORKER_INDEX,
+            config_version=moderation_service.config_version,
+        )
+        print(encode_json(record).decode("utf-8"), flush=True)
+
+
+@app.post("/v1/moderations", response_model=ModerationResponse, response_model_exclude_none=True)
+async def create_moderation(
+    request: ModerationRequest,
+    x_request_deadline_ms: Optional[float] = Header(default=None, gt=0),
+    x_priority: Optional[Literal["interactive", "bulk"]] = Header(default=None),
+    authorization: Optional[str] = Header(default=None),
+    accept: Optional[str] = Header(default=None),
+    include_config_version: bool = False,
+):
     """
     Create a moderation analysis for the provided input.
     
-    Compatible with OpenAI's moderation API format.
+    Compatible with OpenAI's moderation API format. The latency budget
+    (X-Request-Deadline-Ms header, or REQUEST_DEADLINE_MS) starts when the
+    request arrives; checkers that miss it are listed in the "degraded" field
+    of the affected results and in the X-Moderation-Degraded header.
+    
+    Requests run in the interactive or bulk priority lane (X-Priority header
+    or API key, see _request_lane); each lane has its own workers and queue.
     """
+    start = time.perf_counter()
+    trace = _start_trace()
+    deadline = _request_deadline(x_request_deadline_ms)
+    text_count = 1 if isinstance(request.input, str) else len(request.input)
+    lane = _request_lane(x_priority, authorization, text_count)
+    outcome = "error"
+    response = None
     try:
-        result = moderation_service.moderate(
+        payload = await moderation_executor.moderate(
             input_data=request.input,
-            model=request.model
+            model=request.model,
+            return_spans=request.return_spans,
+            redact=request.redact,
+            deadline=deadline,
+            lane=lane,
+            shape=request.response_shape
         )
-        return result
+        response = _json_response(payload, payload["results"], accept, include_config_version)
+        outcome = "degraded" if "X-Moderation-Degraded" in response.headers else "ok"
+        return response
+    except ServiceNotReadyError as e:
+        outcome = "not_ready"
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)}
+        ) from e
+    except QueueFullError as e:
+        outcome = "overloaded"
+        raise HTTPException(
+            status_code=config.OVERLOAD_STATUS_CODE,
+            detail=str(e),
+            headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)}
+        ) from e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Moderation failed: {str(e)}") from e
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.REQUESTS.labels(outcome).inc()
+        metrics.TEXTS.labels(outcome).inc(text_count)
+        metrics.REQUEST_SECONDS.labels(lane).observe(elapsed)
+        texts = [request.input] if isinstance(request.input, str) else request.input
+        _finish_trace(trace, response, "/v1/moderations", elapsed, texts, lane, outcome)
+
+
+@app.post(
+    "/v1/moderations/conversation", response_model=ConversationModerationResponse, response_model_exclude_none=True
+)
+async def create_conversation_moderation(
+    request: ConversationModerationRequest,
+    x_request_deadline_ms: Optional[float] = Header(default=None, gt=0),
+    x_priority: Optional[Literal["interactive", "bulk"]] = Header(default=None),
+    authorization: Optional[str] = Header(default=None),
+    accept: Optional[str] = Header(default=None),
+    include_config_version: bool = False,
+):
+    """
+    Moderate the full message history of a conversation.
+    
+    Scores of messages seen in earlier requests for the same conversation_id
+    are reused, so each turn only scores its new messages. Returns the
+    maximum scores over all messages and a result per message (or, with
+    "message_results": "new", per message scored in this request).
+    """
+    start = time.perf_counter()
+    trace = _start_trace()
+    deadline = _request_deadline(x_request_deadline_ms)
+    text_count = len(request.messages)
+    # Only new messages are scored, so the history length does not make a conversation bulk work
+    lane = _request_lane(x_priority, authorization, 1)
+    outcome = "error"
+    response = None
+    try:
+        payload = await moderation_executor.moderate_conversation(
+            conversation_id=request.conversation_id,
+            messages=[(message.id, message.content) for message in request.messages],
+            model=request.model,
+            deadline=deadline,
+            new_only=request.message_results == "new",
+            lane=lane,
+            shape=request.response_shape
+        )
+        response = _json_response(payload, [payload["result"]], accept, include_config_version)
+        outcome = "degraded" if "X-Moderation-Degraded" in response.headers else "ok"
+        return response
+    except ServiceNotReadyError as e:
+        outcome = "not_ready"
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)}
+        ) from e
+    except QueueFullError as e:
+        outcome = "overloaded"
+        raise HTTPException(
+            status_code=config.OVERLOAD_STATUS_CODE,
+            detail=str(e),
+            headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)}
+        ) from e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Moderation failed: {str(e)}") from e
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.REQUESTS.labels(outcome).inc()
+        metrics.TEXTS.labels(outcome).inc(text_count)
+        metrics.REQUEST_SECONDS.labels(lane).observe(elapsed)
+        texts = (message.content for message in request.messages)
+        _finish_trace(trace, response, "/v1/moderations/conversation", elapsed, texts, lane, outcome)
+
+
+@app.post("/v1/moderations/stream")
+async def create_moderation_stream(request: Request, response_shape: ResponseShape = "full"):
+    """
+    Moderate an NDJSON body with one moderation request per line.
+    
+    Results are streamed back as NDJSON, one line per input line, as batches
+    finish. Each result line carries the "index" of its input line and echoes
+    the "id" (or "request_id") the client supplied. The response_shape query
+    parameter applies to every result line.
+    """
+    if not moderation_service.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="The BERT checker is still loading",
+            headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)}
+        )
+    metrics.REQUESTS.labels("ok").inc()
+    return NDJSONStreamingResponse(
+        moderate_ndjson(
+            request.stream(),
+            moderation_executor,
+            lane=BULK,
+            batch_size=config.STREAM_BATCH_SIZE,
+            max_inflight=config.STREAM_MAX_INFLIGHT,
+            max_line_bytes=config.STREAM_MAX_LINE_BYTES,
+            retry_after=config.RETRY_AFTER_SECONDS,
+            shape=response_shape,
+        ),
+        # Batches that start after a reload use the new checkers
+        headers={"X-Config-Version": moderation_service.config_version},
+    )
+
+
+def _check_admin(authorization: Optional[str]):
+    """Reject admin requests without the ADMIN_API_KEY bearer token (404 while the admin API is disabled)."""
+    if not config.ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="The admin API is disabled, set ADMIN_API_KEY to enable it")
+    if authorization is None or not hmac.compare_digest(authorization.encode(), f"Bearer {config.ADMIN_API_KEY}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin API key")
+
+
+@app.post("/admin/reload", status_code=202)
+async def reload_checkers(request: ReloadRequest, authorization: Optional[str] = Header(default=None)):
+    """
+    Swap in a new BERT model, flagging threshold and/or regex pattern table without a restart.
+    
+    The new checkers are built and warmed up in the background while the
+    current ones keep serving; poll GET /admin/reload for the progress. The
+    X-Config-Version header of moderation responses changes once they are live.
+    """
+    _check_admin(authorization)
+    options = request.model_dump(exclude_none=True)
+    try:
+        moderation_service.check_reload_options(**options)
+        if reload_forwarder is not None:
+            return reload_forwarder.request(options)
+        return moderation_service.start_reload(drain_timeout=config.RELOAD_DRAIN_TIMEOUT, **options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    except ReloadInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+
+
+@app.get("/admin/reload")
+async def reload_status(authorization: Optional[str] = Header(default=None)):
+    """State of the last or running reload, and the configuration version of the worker serving this request."""
+    _check_admin(authorization)
+    status = reload_forwarder.status() if reload_forwarder is not None else moderation_service.reload_status()
+    return {**status, "worker_config_version": moderation_service.config_version}
+
+
+@app.get("/admin/profile", response_class=PlainTextResponse)
+async def profile_process(
+    seconds: float = Query(default=10, gt=0),
+    interval_ms: float = Query(default=10, ge=1, le=1000),
+    idle: bool = False,
+    authorization: Optional[str] = Header(default=None),
+):
+    """
+    Sample the stacks of all threads of the worker serving this request for a while.
+    
+    Returns the profile in the collapsed stack format (one "frame;frame;... count"
+    line per stack) read by flamegraph.pl and speedscope. Threads waiting for
+    work are left out unless idle is set.
+    """
+    _check_admin(authorization)
+    if seconds > config.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {config.PROFILE_MAX_SECONDS}")
+    try:
+        # Sampled from a thread of its own, so the event loop keeps serving (and shows up in the profile)
+        stacks, summary = await asyncio.to_thread(profiler.profile_collapsed, seconds, interval_ms / 1000, idle)
+    except profiler.ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    return PlainTextResponse(stacks, headers={
+        "X-Profile-Samples": str(summary["samples"]),
+        "X-Profile-Seconds": str(summary["seconds"]),
+    })
 
 
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
-        host="0.0.0.0",
-        port=8000,
+        host=config.HOST,
+        port=config.PORT,
         reload=True,
         log_level="info"
     )
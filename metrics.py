@@ -0,0 +1,288 @@
+"""
+Prometheus metrics of the moderation pipeline.
+
+A minimal, dependency-free registry: counters, histograms and callback gauges
+rendered in the Prometheus text exposition format by GET /metrics. Metric
+children for fixed label values are bound once at import time, so recording
+on the hot path is a bisect and a locked increment. Each process keeps its own
+registry, so with serve.py every scrape reports the worker that answered it
+(identified by the "worker" label).
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import diagnostics
+import tracing
+
+# Stage latencies from microseconds (regex on short texts) to seconds (BERT on long documents)
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+LENGTH_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    """Render label pairs as {name="value",...}, escaping values."""
+    if not labels:
+        return ""
+    rendered = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        rendered.append(f'{name}="{value}"')
+    return "{" + ",".join(rendered) + "}"
+
+
+def _format_value(value: float) -> str:
+    """Render a sample value, keeping integers free of a trailing .0."""
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _CounterChild:
+    """Counter for one combination of label values."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    """Histogram for one combination of label values."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        # Non-cumulative counts per bucket; cumulated when rendering
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class _TracedStageChild:
+    """Stage latency histogram child that also adds each value to the current request's trace (see tracing)."""
+
+    def __init__(self, child: _HistogramChild, stage: str):
+        self.child = child
+        self.stage = stage
+
+    def observe(self, value: float):
+        self.child.observe(value)
+        tracing.record(self.stage, value)
+
+
+class _Metric:
+    """Base class of labelled metrics."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Child metric for these label values, created on first use."""
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _label_pairs(self, key: Tuple[str, ...]) -> List[Tuple[str, str]]:
+        return list(zip(self.labelnames, key))
+
+    def render(self, extra_labels: Sequence[Tuple[str, str]]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(self._label_pairs(key) + list(extra_labels), child))
+        return lines
+
+    def _render_child(self, labels, child) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        """Increment an unlabelled counter."""
+        self._children[()].inc(amount)
+
+    def _render_child(self, labels, child) -> List[str]:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(child.value)}"]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        """Record a value in an unlabelled histogram."""
+        self._children[()].observe(value)
+
+    def _render_child(self, labels, child) -> List[str]:
+        counts, total = child.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], counts):
+            cumulative += count
+            le = bound if bound == "+Inf" else _format_value(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Current value read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        self.callback = callback
+        super().__init__(name, documentation)
+
+    def _new_child(self):
+        return None
+
+    def _render_child(self, labels, child) -> List[str]:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(self.callback())}"]
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric, replacing any earlier metric of the same name."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        worker = diagnostics.WORKER_INDEX
+        extra_labels = [] if worker is None else [("worker", str(worker))]
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(extra_labels))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Create and register a counter."""
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    """Create and register a histogram."""
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge(name: str, documentation: str, callback: Callable[[], float]) -> Gauge:
+    """Create and register a callback gauge."""
+    return REGISTRY.register(Gauge(name, documentation, callback))
+
+
+REQUESTS = counter("moderation_requests_total", "Moderation requests by outcome.", ["outcome"])
+TEXTS = counter("moderation_texts_total", "Texts in moderation requests by outcome.", ["outcome"])
+STAGE_SECONDS = histogram("moderation_stage_seconds", "Time spent per pipeline stage and call.", ["stage"])
+INPUT_LENGTH = histogram("moderation_input_length_chars", "Length of moderated texts in characters.", buckets=LENGTH_BUCKETS)
+BERT_FORWARD_BATCH = histogram(
+    "moderation_bert_forward_batch_windows", "Token windows per BERT forward pass.", buckets=BATCH_BUCKETS
+)
+BATCHER_BATCH = histogram(
+    "moderation_batcher_batch_texts", "Concurrent texts merged into one micro-batch.", buckets=BATCH_BUCKETS
+)
+REQUEST_SECONDS = histogram(
+    "moderation_request_seconds", "Time from arrival to response of moderation requests, by priority lane.", ["lane"]
+)
+BULK_PREEMPTIONS = counter(
+    "moderation_bulk_preemptions_total", "BERT forward passes of bulk requests held back for interactive ones."
+)
+CONVERSATION_MESSAGES = counter(
+    "moderation_conversation_messages_total",
+    "Conversation messages scored anew or reused from earlier turns.",
+    ["source"],
+)
+CHECKER_TIMEOUTS = counter(
+    "moderation_checker_timeouts_total",
+    "Texts answered without a checker that missed the request deadline (bert) or scan budget (regex).",
+    ["checker"],
+)
+CHECKER_ABANDONED = counter(
+    "moderation_checker_abandoned_total",
+    "Checker calls still running when their request stopped waiting at its deadline, by checker.",
+    ["checker"],
+)
+CHECKER_SHED = counter(
+    "moderation_checker_shed_total",
+    "Texts of requests with a deadline answered without a checker because its workers were all busy.",
+    ["checker"],
+)
+BERT_ERRORS = counter(
+    "moderation_bert_errors_total", "BERT failures that fell back to zero scores, by stage.", ["stage"]
+)
+
+# Children bound once so the hot path skips the label lookup; stage latencies also go to request traces
+REGEX_SECONDS = _TracedStageChild(STAGE_SECONDS.labels("regex"), "regex")
+TOKENIZATION_SECONDS = _TracedStageChild(STAGE_SECONDS.labels("tokenization"), "tokenization")
+FORWARD_SECONDS = _TracedStageChild(STAGE_SECONDS.labels("forward"), "forward")
+COMBINE_SECONDS = _TracedStageChild(STAGE_SECONDS.labels("combine"), "combine")
+RESPONSE_SECONDS = _TracedStageChild(STAGE_SECONDS.labels("response"), "response")
+SERIALIZATION_SECONDS = _TracedStageChild(STAGE_SECONDS.labels("serialization"), "serialization")
+CONVERSATION_SCORED = CONVERSATION_MESSAGES.labels("scored")
+CONVERSATION_REUSED = CONVERSATION_MESSAGES.labels("reused")
+REGEX_TIMEOUTS = CHECKER_TIMEOUTS.labels("regex")
+TOKENIZATION_ERRORS = BERT_ERRORS.labels("tokenization")
+FORWARD_ERRORS = BERT_ERRORS.labels("forward")
@@ -1,11 +1,34 @@
-from typing import List, Optional, Union
+import json
+from typing import Any, Dict, List, Literal, Optional, Union
 from pydantic import BaseModel, Field
 
+# Categories reported in every result, in the order of the response schema
+CATEGORY_NAMES = (
+    "pii/phone", "pii/email", "pii/credit_card", "pii/ip_address", "pii/iban",
+    "hate", "harassment", "violence", "hate/threatening", "harassment/threatening",
+)
+
+# Same output as FastAPI's JSONResponse, using the C encoder of the json module
+_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def encode_json(payload: Any) -> bytes:
+    """Encode a response dict exactly like FastAPI's JSONResponse would."""
+    return _encoder.encode(payload).encode("utf-8")
+
+
+# Result shapes: "full" is OpenAI-compatible, "sparse" leaves out false categories,
+# zero scores and empty applied input types, "flagged_only" keeps only flagged categories
+ResponseShape = Literal["full", "sparse", "flagged_only"]
+
 
 class ModerationRequest(BaseModel):
     """Request model for moderation API."""
     input: Union[str, List[str]] = Field(..., description="Text to analyze for moderation")
     model: Optional[str] = Field(default="moderation-latest", description="Model to use for moderation")
+    return_spans: bool = Field(default=False, description="Return the character offsets and category of every PII match")
+    redact: bool = Field(default=False, description="Return a copy of each text with PII matches replaced")
+    response_shape: ResponseShape = Field(default="full", description="Leave out default entries of each result")
 
 
 class Categories(BaseModel):
@@ -68,16 +91,144 @@ class CategoryAppliedInputTypes(BaseModel):
         validate_by_name = True
 
 
+class PIISpan(BaseModel):
+    """Location of a PII match; offsets are in characters (Unicode code points), end exclusive."""
+    start: int
+    end: int
+    category: str
+
+
 class ModerationResult(BaseModel):
     """Single moderation result."""
     flagged: bool
     categories: Categories
     category_scores: CategoryScores
     category_applied_input_types: CategoryAppliedInputTypes
+    stages: Optional[List[str]] = Field(default=None, description="Checker stages that ran (only with a cascade policy)")
+    degraded: Optional[List[str]] = Field(default=None, description="Checkers that missed the request deadline and are not reflected in the scores")
+    spans: Optional[List[PIISpan]] = Field(default=None, description="PII matches (only with return_spans)")
+    redacted_text: Optional[str] = Field(default=None, description="Text with PII matches replaced (only with redact)")
 
 
 class ModerationResponse(BaseModel):
     """Response model for moderation API."""
     id: str
     model: str
+    config_version: Optional[str] = Field(
+        default=None, description="Version of the checker configuration that scored the request (only with include_config_version)"
+    )
     results: List[ModerationResult]
+
+
+class ConversationMessage(BaseModel):
+    """One message of a conversation."""
+    id: Optional[Union[str, int]] = Field(default=None, description="Stable message id; messages without one are keyed by their text")
+    role: Optional[str] = Field(default=None, description="Message role (not used for scoring)")
+    content: str
+
+
+class ConversationModerationRequest(BaseModel):
+    """Request model for conversation moderation."""
+    conversation_id: str = Field(..., description="Stable id of the conversation")
+    messages: List[ConversationMessage] = Field(..., min_length=1, description="Full message history, oldest first")
+    model: Optional[str] = Field(default="moderation-latest", description="Model to use for moderation")
+    message_results: Literal["all", "new"] = Field(
+        default="all", description="Return a result for every message, or only for messages not seen before"
+    )
+    response_shape: ResponseShape = Field(default="full", description="Leave out default entries of each result")
+
+
+class ConversationMessageResult(BaseModel):
+    """Moderation result of one message of a conversation."""
+    index: int
+    id: Optional[Union[str, int]] = None
+    cached: bool = Field(..., description="Whether the scores were kept from an earlier request")
+    result: ModerationResult
+
+
+class ConversationModerationResponse(BaseModel):
+    """Response model for conversation moderation."""
+    id: str
+    model: str
+    conversation_id: str
+    config_version: Optional[str] = Field(
+        default=None, description="Version of the checker configuration that scored the request (only with include_config_version)"
+    )
+    result: ModerationResult = Field(..., description="Maximum scores over all messages")
+    messages: List[ConversationMessageResult]
+
+
+class ReloadRequest(BaseModel):
+    """Checker settings to swap in without a restart; omitted fields keep their current value."""
+    model_name: Optional[str] = Field(default=None, min_length=1, description="BERT model to load")
+    flagging_threshold: Optional[float] = Field(default=None, ge=0.0, le=1.0, description="New flagging threshold")
+    regex_patterns: Optional[Dict[str, List[str]]] = Field(
+        default=None, description="Regex sources per PII category, replacing the whole pattern table"
+    )
+    warm_up_texts: Optional[List[str]] = Field(
+        default=None, min_length=1, description="Sample inputs the new checkers are warmed up on before the swap"
+    )
+
+
+# Fields tried in order for the input of a bulk request line, and client ids echoed back unchanged
+INPUT_FIELDS = ("input", "text", "body")
+ID_FIELDS = ("id", "request_id")
+
+
+class RequestLine:
+    """One parsed line of a bulk NDJSON/JSONL input: its position, echoed fields and texts (or a parse error)."""
+
+    __slots__ = ("index", "echo", "model", "texts", "error")
+
+    def __init__(self, index: int, raw: bytes, plain_text: bool = False):
+        """
+        Parse a line.
+        
+        Args:
+            index: Position of the line in the input
+            raw: The line, a JSON object (see INPUT_FIELDS and ID_FIELDS)
+            plain_text: Take the whole line as the text instead of parsing JSON
+        """
+        self.index = index
+        self.echo: Dict = {}
+        self.model = "moderation-latest"
+        self.texts: List[str] = []
+        self.error: Optional[str] = None
+        if plain_text:
+            self.texts = [raw.decode("utf-8", "replace").rstrip("\r\n")]
+            return
+        try:
+            record = json.loads(raw)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+            self.echo = {field: record[field] for field in ID_FIELDS if field in record}
+            self.model = record.get("model") or self.model
+            value = next((record[field] for field in INPUT_FIELDS if field in record), None)
+            if isinstance(value, str):
+                self.texts = [value]
+            elif isinstance(value, list) and all(isinstance(text, str) for text in value):
+                self.texts = value
+            else:
+                raise ValueError(f"expected one of the fields {INPUT_FIELDS} with a string or a list of strings")
+        except ValueError as e:
+            self.error = f"Invalid line: {e}"
+
+    def output(self, results: Optional[List[Dict]]) -> bytes:
+        """The NDJSON result line for this input line, given the result dicts of its texts."""
+        payload = {"index": self.index, **self.echo}
+        if self.error is None:
+            payload["model"] = self.model
+            payload["results"] = results
+        else:
+            payload["error"] = {"message": self.error}
+        return encode_json(payload) + b"\n"
+
+
+def encode_result_lines(lines: List[RequestLine], results: List[Dict]) -> bytes:
+    """Encode the result lines of several request lines, given the results of all their texts in order."""
+    output = []
+    position = 0
+    for line in lines:
+        output.append(line.output(results[position:position + len(line.texts)]))
+        position += len(line.texts)
+    return b"".join(output)
@@ -0,0 +1,131 @@
+"""
+Sampling profiler over the threads of the running process.
+
+A background thread reads the Python stack of every thread with
+sys._current_frames() at a fixed interval and counts identical stacks. The
+result is rendered in the collapsed ("folded") stack format that
+flamegraph.pl, speedscope and most flamegraph viewers read. The profiled
+code is not instrumented, so its overhead is one stack walk per thread and
+interval, in the sampling thread.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Tuple
+
+# Leaf frames of threads blocked waiting for work, left out unless idle stacks are asked for
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("runners.py", "run"),  # uvloop's event loop, which waits for I/O in C
+    ("batching.py", "_next_batch"),
+}
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+
+def _frame_label(frame) -> str:
+    """Function name and location of a frame; semicolons separate frames in the collapsed format."""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _is_idle(frame) -> bool:
+    """Whether the innermost frame of a thread waits for work."""
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """Collects stack samples of all threads; one profile runs at a time."""
+
+    def __init__(self, max_depth: int = 128):
+        """
+        Initialize the profiler.
+
+        Args:
+            max_depth: Innermost frames kept per stack
+        """
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = 0.01, idle: bool = False) -> Tuple[Counter, Dict]:
+        """
+        Sample the stacks of all other threads for a while.
+
+        Time spent in a single C call that holds the GIL (e.g. one regex
+        search) delays the next sample, so such calls are undercounted.
+
+        Args:
+            seconds: How long to sample
+            interval: Seconds between samples
+            idle: Also count threads that are waiting for work
+
+        Returns:
+            Sample count per collapsed stack (thread name first, innermost
+            frame last), and the number of samples, duration and interval
+
+        Raises:
+            ProfilerBusyError: If another profile is running
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running")
+        try:
+            return self._sample(seconds, interval, idle)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float, idle: bool) -> Tuple[Counter, Dict]:
+        stacks: Counter = Counter()
+        own = threading.get_ident()
+        samples = 0
+        start = time.monotonic()
+        stop = start + seconds
+        next_sample = start
+        while True:
+            now = time.monotonic()
+            if now >= stop:
+                break
+            if now < next_sample:
+                time.sleep(next_sample - now)
+                continue
+            # A late sample (e.g. behind a long C call) does not cause a burst of catch-up samples
+            next_sample = max(next_sample, now) + interval
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (not idle and _is_idle(frame)):
+                    continue
+                labels = []
+                while frame is not None and len(labels) < self.max_depth:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}").replace(";", ","))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+        return stacks, {
+            "samples": samples,
+            "seconds": round(time.monotonic() - start, 3),
+            "interval_ms": interval * 1000,
+        }
+
+
+def collapsed(stacks: Counter) -> str:
+    """Render stack counts in the collapsed format, one "frame;frame;... count" line per stack."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+# Profiler of this process, used by GET /admin/profile
+PROFILER = SamplingProfiler()
+
+
+def profile_collapsed(seconds: float, interval: float = 0.01, idle: bool = False) -> Tuple[str, Dict]:
+    """Profile this process and return the collapsed stacks and the sampling summary."""
+    stacks, summary = PROFILER.profile(seconds, interval, idle)
+    return collapsed(stacks), {**summary, "stacks": len(stacks)}
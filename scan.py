@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Offline batch scan of JSONL or plain-text files, without the HTTP server.
+
+Reads the input in chunks of lines (streamed, or memory-mapped with --mmap),
+runs the regex stage in a pool of worker processes and, with BERT enabled,
+routes the texts of each chunk through batched BERT inference in this
+process while the workers already scan the next chunks. Results are written
+incrementally as NDJSON in input order, in the format of
+/v1/moderations/stream. A checkpoint next to the output records how far the
+input has been scanned, so rerunning an interrupted scan resumes from there.
+
+Input formats:
+    jsonl  One moderation request per line: {"id": ..., "input": "..." or [...]}
+    text   One text per line
+
+Usage:
+    python scan.py INPUT --output results.jsonl [--format jsonl|text] [--processes N]
+                         [--bert | --no-bert] [--mmap] [--chunk-lines 1000] [--restart]
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import config
+from cascade import CascadePolicy
+from models import RequestLine, encode_result_lines
+from service import ModerationService
+
+# Per-process service used by the worker pool (regex stage, or everything without BERT)
+_worker_service: Optional[ModerationService] = None
+
+
+def _cascade_policy() -> CascadePolicy:
+    """Cascade policy configured through the environment, as in the server."""
+    return CascadePolicy(
+        skip_if_regex_flagged=config.CASCADE_SKIP_IF_REGEX_FLAGGED,
+        min_bert_length=config.CASCADE_MIN_BERT_LENGTH,
+        skip_without_letters=config.CASCADE_SKIP_WITHOUT_LETTERS,
+    )
+
+
+def _init_scan_worker():
+    """Build a regex-only ModerationService in each pool process."""
+    global _worker_service
+    _worker_service = ModerationService(
+        use_bert=False, flagging_threshold=config.FLAGGING_THRESHOLD, cascade_policy=_cascade_policy()
+    )
+
+
+def _scan_chunk(start_index: int, raw_lines: List[bytes], plain_text: bool, regex_only: bool):
+    """
+    Parse and scan one chunk of input lines in a worker.
+
+    Returns:
+        The encoded result lines and the number of texts if regex_only,
+        otherwise the parsed lines and their regex scans for the BERT stage
+        in the main process
+    """
+    lines = [RequestLine(start_index + offset, raw, plain_text) for offset, raw in enumerate(raw_lines)]
+    texts = [text for line in lines for text in line.texts]
+    if regex_only:
+        return encode_result_lines(lines, _worker_service.moderate_results(texts)), len(texts)
+    return lines, _worker_service.regex_checker.scan_batch(texts)
+
+
+def _iter_chunks(path: str, offset: int, chunk_lines: int, use_mmap: bool) -> Iterator[Tuple[List[bytes], int]]:
+    """Yield chunks of non-empty lines starting at a byte offset, each with the offset after it."""
+    with open(path, "rb") as source:
+        data = source
+        if use_mmap and os.fstat(source.fileno()).st_size > 0:
+            data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            data.seek(offset)
+            lines = []
+            while True:
+                raw = data.readline()
+                if not raw:
+                    break
+                if raw.strip():
+                    lines.append(raw)
+                    if len(lines) == chunk_lines:
+                        yield lines, data.tell()
+                        lines = []
+            if lines:
+                yield lines, data.tell()
+        finally:
+            if data is not source:
+                data.close()
+
+
+class Checkpoint:
+    """Progress of a scan: input bytes consumed, output bytes written and lines scanned."""
+
+    def __init__(self, path: str, input_path: str):
+        self.path = path
+        stat = os.stat(input_path)
+        self.input = {"path": os.path.abspath(input_path), "size": stat.st_size, "mtime": stat.st_mtime}
+        self.input_offset = 0
+        self.output_bytes = 0
+        self.lines = 0
+        self.texts = 0
+
+    def load(self) -> bool:
+        """Restore the progress of an earlier run on the same input; False if there is none."""
+        try:
+            with open(self.path, encoding="utf-8") as source:
+                state = json.load(source)
+        except FileNotFoundError:
+            return False
+        if state["input"] != self.input:
+            raise SystemExit(f"Checkpoint {self.path} belongs to a different or modified input; use --restart")
+        self.input_offset = state["input_offset"]
+        self.output_bytes = state["output_bytes"]
+        self.lines = state["lines"]
+        self.texts = state["texts"]
+        return True
+
+    def save(self):
+        """Write the checkpoint atomically."""
+        state = {
+            "input": self.input,
+            "input_offset": self.input_offset,
+            "output_bytes": self.output_bytes,
+            "lines": self.lines,
+            "texts": self.texts,
+        }
+        with open(self.path + ".tmp", "w", encoding="utf-8") as output:
+            json.dump(state, output)
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self):
+        """Drop the checkpoint once the scan is complete."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def scan(args) -> Dict:
+    """Run the scan and return throughput statistics."""
+    plain_text = args.format == "text"
+    service = ModerationService(
+        use_bert=args.bert,
+        flagging_threshold=config.FLAGGING_THRESHOLD,
+        model_name=config.BERT_MODEL_NAME,
+        bert_batch_size=config.BERT_BATCH_SIZE,
+        bert_window_stride=config.BERT_WINDOW_STRIDE,
+        bert_early_exit=config.BERT_EARLY_EXIT,
+        bert_backend=config.BERT_BACKEND,
+        model_cache_dir=config.MODEL_CACHE_DIR,
+        # Chunks are batched already, so no micro-batching across callers is needed
+        batch_max_size=1,
+        cascade_policy=_cascade_policy(),
+    )
+    regex_only = service.bert_status != "ready"
+
+    checkpoint = Checkpoint(args.checkpoint or args.output + ".checkpoint", args.input)
+    if not args.restart and checkpoint.load():
+        print(f"Resuming after {checkpoint.lines} lines ({checkpoint.input_offset} input bytes)", file=sys.stderr)
+    output = open(args.output, "r+b" if checkpoint.output_bytes else "wb")
+    # Drop results written after the last checkpoint; they are produced again
+    output.truncate(checkpoint.output_bytes)
+    output.seek(checkpoint.output_bytes)
+
+    if args.processes > 0:
+        pool = ProcessPoolExecutor(max_workers=args.processes, initializer=_init_scan_worker)
+        window = 2 * args.processes
+    else:
+        global _worker_service
+        _worker_service = service
+        pool = None
+        window = 1
+
+    start = time.monotonic()
+    last_checkpoint = start
+    scanned_lines = scanned_texts = scanned_bytes = 0
+    first_offset = checkpoint.input_offset
+    pending: "deque[Tuple[Future, int, int]]" = deque()
+
+    def write(result, end_offset: int, line_count: int):
+        nonlocal scanned_lines, scanned_texts, last_checkpoint
+        if regex_only:
+            data, text_count = result
+        else:
+            lines, regex_scans = result
+            data = encode_result_lines(lines, service.moderate_results(
+                [text for line in lines for text in line.texts], regex_scans
+            ))
+            text_count = len(regex_scans)
+        output.write(data)
+
+        checkpoint.input_offset = end_offset
+        checkpoint.output_bytes = output.tell()
+        checkpoint.lines += line_count
+        checkpoint.texts += text_count
+        scanned_lines += line_count
+        scanned_texts += text_count
+
+        now = time.monotonic()
+        if now - last_checkpoint >= args.checkpoint_interval:
+            output.flush()
+            os.fsync(output.fileno())
+            checkpoint.save()
+            last_checkpoint = now
+            elapsed = now - start
+            print(
+                f"{checkpoint.lines} lines, {(end_offset - first_offset) / 2**20:.0f} MiB, "
+                f"{scanned_texts / elapsed:.0f} texts/s",
+                file=sys.stderr
+            )
+
+    try:
+        index = checkpoint.lines
+        for raw_lines, end_offset in _iter_chunks(args.input, checkpoint.input_offset, args.chunk_lines, args.mmap):
+            scanned_bytes = end_offset - first_offset
+            if pool is None:
+                future = Future()
+                future.set_result(_scan_chunk(index, raw_lines, plain_text, regex_only))
+            else:
+                future = pool.submit(_scan_chunk, index, raw_lines, plain_text, regex_only)
+            pending.append((future, end_offset, len(raw_lines)))
+            index += len(raw_lines)
+
+            # Keep a bounded number of chunks in flight and write them in input order
+            while len(pending) >= window:
+                future, chunk_end, line_count = pending.popleft()
+                write(future.result(), chunk_end, line_count)
+        while pending:
+            future, chunk_end, line_count = pending.popleft()
+            write(future.result(), chunk_end, line_count)
+    except BaseException:
+        # Keep the progress made so far for the next run
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint.save()
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    output.close()
+    checkpoint.remove()
+
+    elapsed = time.monotonic() - start
+    return {
+        "lines": scanned_lines,
+        "texts": scanned_texts,
+        "input_bytes": scanned_bytes,
+        "seconds": elapsed,
+        "lines_per_s": scanned_lines / elapsed if elapsed else 0.0,
+        "texts_per_s": scanned_texts / elapsed if elapsed else 0.0,
+        "mib_per_s": scanned_bytes / 2**20 / elapsed if elapsed else 0.0,
+        "processes": args.processes,
+        "bert": not regex_only,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Input file")
+    parser.add_argument("--output", required=True, help="NDJSON results file")
+    parser.add_argument("--format", choices=["jsonl", "text"], default="jsonl", help="Input format")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes for the regex stage (0 scans in this process)")
+    parser.add_argument("--bert", action=argparse.BooleanOptionalAction, default=config.USE_BERT,
+                        help="Run the BERT stage (default: USE_BERT)")
+    parser.add_argument("--mmap", action="store_true", help="Memory-map the input instead of streaming it")
+    parser.add_argument("--chunk-lines", type=int, default=1000, help="Lines per worker task")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument("--checkpoint-interval", type=float, default=5.0, help="Seconds between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over")
+    parser.add_argument("--json", action="store_true", help="Print the final statistics as JSON")
+    args = parser.parse_args()
+
+    try:
+        stats = scan(args)
+    except KeyboardInterrupt:
+        raise SystemExit("Interrupted; rerun the same command to resume from the last checkpoint")
+    if args.json:
+        print(json.dumps(stats))
+    else:
+        print(
+            f"Scanned {stats['lines']} lines, {stats['texts']} texts ({stats['input_bytes'] / 2**20:.1f} MiB) "
+            f"in {stats['seconds']:.1f}s: {stats['texts_per_s']:.0f} texts/s, {stats['mib_per_s']:.1f} MiB/s "
+            f"({stats['processes']} processes, BERT {'on' if stats['bert'] else 'off'})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Production pre-fork server.
+
+The master process imports the app once, which loads the checkers and the
+BERT weights, and then forks worker processes that serve the same listening
+socket. The master never runs the model: a worker forked after torch started
+its thread pools hangs on its first forward pass, so each worker warms BERT
+up after forking, before it accepts requests. The workers share the loaded
+weights copy-on-write, so adding workers costs far less memory than starting
+independent uvicorn workers. With BERT_AUTOTUNE, each worker's torch thread
+count and batch size are picked by benchmarking the host in a throwaway child
+of the master before forking, so the master itself still runs no inference.
+
+POST /admin/reload in any worker is forwarded to the master, which builds
+the new checkers while the workers keep serving, then forks new workers
+with them. Once the new workers have warmed up, the old ones are stopped
+gracefully and finish their in-flight requests first.
+
+Usage:
+    python serve.py [--workers N] [--host HOST] [--port PORT]
+"""
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Set
+
+import uvicorn
+
+import config
+import diagnostics
+from service import RELOAD_BUSY_STATES, ReloadInProgressError
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    """Create the listening socket shared by all workers."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class _ReloadChannel:
+    """
+    Hands reload requests from the workers to the master.
+
+    A worker writes the options to a file and its name to a pipe the master
+    polls; the master publishes the reload status in a file all workers read.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="guardrails-reload-")
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        self._buffer = b""
+
+    def request(self, options: Dict) -> Dict:
+        """Worker side: queue a reload in the master (see ModerationService.start_reload)."""
+        if self.status().get("state") in RELOAD_BUSY_STATES + ("requested",):
+            raise ReloadInProgressError("A reload is already in progress")
+        name = f"request-{uuid.uuid4().hex}.json"
+        with open(os.path.join(self.directory, name), "w", encoding="utf-8") as output:
+            json.dump(options, output)
+        status = {**self.status(), "state": "requested"}
+        self.write_status(status)
+        # Writes of less than PIPE_BUF bytes are atomic, so names from several workers do not interleave
+        os.write(self._write_fd, name.encode("ascii") + b"\n")
+        return status
+
+    def poll(self) -> List[Dict]:
+        """Master side: options of the reloads requested since the last poll."""
+        try:
+            self._buffer += os.read(self._read_fd, 65536)
+        except BlockingIOError:
+            pass
+        *names, self._buffer = self._buffer.split(b"\n")
+        requests = []
+        for name in names:
+            path = os.path.join(self.directory, name.decode("ascii"))
+            try:
+                with open(path, encoding="utf-8") as source:
+                    requests.append(json.load(source))
+                os.remove(path)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable reload request {path}: {e}")
+        return requests
+
+    def status(self) -> Dict:
+        """Reload status last published by the master."""
+        try:
+            with open(os.path.join(self.directory, "status.json"), encoding="utf-8") as source:
+                return json.load(source)
+        except (OSError, ValueError):
+            return {"state": "idle"}
+
+    def write_status(self, status: Dict):
+        """Publish a reload status atomically."""
+        path = os.path.join(self.directory, "status.json")
+        with open(f"{path}.{os.getpid()}", "w", encoding="utf-8") as output:
+            json.dump(status, output)
+        os.replace(f"{path}.{os.getpid()}", path)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _set_torch_threads(intra_op: int):
+    """Give each worker its share of the cores instead of the library default (all cores)."""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only possible before any inter-op parallel work has started
+        pass
+
+
+def _worker_threads(service, workers: int) -> int:
+    """Torch threads per worker: configured, autotuned, or an even share of the cores."""
+    tuning = service.tuning
+    return (
+        config.TORCH_THREADS_PER_WORKER
+        or (tuning and tuning["intra_op_threads"])
+        or max(1, (os.cpu_count() or 1) // workers)
+    )
+
+
+def _run_worker(app_module, sock: socket.socket, index: int, threads: int, ready_fd: int):
+    """Body of a forked worker process; never returns."""
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_DFL)
+
+    diagnostics.WORKER_INDEX = index
+    _set_torch_threads(threads)
+
+    app_module.moderation_service.after_fork()
+    # The master runs no inference, so torch's thread pools start here, with this worker's thread count
+    app_module.moderation_service.warm_up_after_fork()
+    # Lets the master retire the workers this one replaces
+    os.write(ready_fd, f"{os.getpid()}\n".encode("ascii"))
+
+    server = uvicorn.Server(uvicorn.Config(app_module.app, log_level="info"))
+    exit_code = 0
+    try:
+        server.run(sockets=[sock])
+    except Exception as e:
+        print(f"Worker {index} crashed: {e}")
+        exit_code = 1
+    os._exit(exit_code)
+
+
+def _spawn(app_module, sock: socket.socket, index: int, threads: int, ready_fd: int) -> int:
+    """Fork one worker and return its pid; the worker writes its pid to ready_fd once it is warmed up."""
+    pid = os.fork()
+    if pid == 0:
+        _run_worker(app_module, sock, index, threads, ready_fd)
+    print(f"Started worker {index} (pid {pid}, {threads} torch threads)")
+    return pid
+
+
+def _report_memory(workers: Dict[int, int]):
+    """Print RSS and PSS per worker; PSS counts shared weights once across workers."""
+    total_pss = 0
+    for index, pid in sorted(workers.items()):
+        usage = diagnostics.memory_usage(pid)
+        total_pss += usage.get("pss", 0)
+        print(
+            f"Worker {index} (pid {pid}): rss={usage.get('rss', 0) / 2**20:.0f} MiB "
+            f"pss={usage.get('pss', 0) / 2**20:.0f} MiB "
+            f"shared={(usage.get('shared_clean', 0) + usage.get('shared_dirty', 0)) / 2**20:.0f} MiB"
+        )
+    master = diagnostics.memory_usage()
+    print(f"Master rss={master.get('rss', 0) / 2**20:.0f} MiB, workers total pss={total_pss / 2**20:.0f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=config.WORKERS, help="Number of worker processes")
+    parser.add_argument("--host", default=config.HOST)
+    parser.add_argument("--port", type=int, default=config.PORT)
+    parser.add_argument(
+        "--report-interval", type=float, default=config.WORKER_REPORT_INTERVAL,
+        help="Seconds between per-worker memory reports (0 disables)"
+    )
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    # Autotuning tries thread counts for this many processes sharing the cores
+    config.WORKERS = workers
+    # Load the model without running it: inference before forking hangs the workers
+    config.PRE_FORK = True
+
+    # Load the app, checkers and model weights once, before forking
+    import main as app_module
+    service = app_module.moderation_service
+    service.wait_for_bert()
+    threads = _worker_threads(service, workers)
+    sock = _bind_socket(args.host, args.port)
+    channel = _ReloadChannel()
+    channel.write_status(service.reload_status())
+    app_module.reload_forwarder = channel
+
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers do not touch (and copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+    ready_read, ready_write = os.pipe()
+    os.set_blocking(ready_read, False)
+    ready_buffer = b""
+    ready_pids = set()
+
+    children = {index: _spawn(app_module, sock, index, threads, ready_write) for index in range(workers)}
+    # Workers of the previous checker set, stopped once their replacements are warmed up
+    retiring: Set[int] = set()
+    retire_deadline = 0.0
+
+    stopping = False
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children.values()) + list(retiring):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    reload_thread = None
+    reload_outcome: Dict = {}
+
+    def run_reload(options: Dict):
+        try:
+            # Nothing runs on the master's checkers, so there is nothing to drain
+            reload_outcome["status"] = service.reload(drain_timeout=0, **options)
+        except (ValueError, ReloadInProgressError) as e:
+            reload_outcome["status"] = {**service.reload_status(), "state": "failed", "error": str(e)}
+
+    last_report = time.monotonic()
+    while children:
+        time.sleep(0.5)
+
+        # Reap exited workers and replace crashed ones
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            index = next((i for i, child in children.items() if child == pid), None)
+            if index is None:
+                continue
+            del children[index]
+            if not stopping:
+                print(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+                children[index] = _spawn(app_module, sock, index, threads, ready_write)
+
+        try:
+            ready_buffer += os.read(ready_read, 65536)
+        except BlockingIOError:
+            pass
+        *lines, ready_buffer = ready_buffer.split(b"\n")
+        ready_pids.update(int(line) for line in lines)
+        ready_pids.intersection_update(children.values())
+        if retiring and (
+            all(pid in ready_pids for pid in children.values()) or time.monotonic() >= retire_deadline
+        ):
+            # uvicorn stops accepting on SIGTERM and finishes in-flight requests before exiting
+            for pid in retiring:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            retiring = set()
+
+        # Build requested checkers in the background, then roll the workers over to them
+        for options in channel.poll():
+            if reload_thread is not None or stopping:
+                print("Ignoring reload request, another reload is running")
+                continue
+            # Let the old checkers be collected once they are swapped out
+            gc.unfreeze()
+            reload_outcome.clear()
+            reload_thread = threading.Thread(target=run_reload, args=(options,), name="checker-reload", daemon=True)
+            reload_thread.start()
+        if reload_thread is not None:
+            if reload_thread.is_alive():
+                channel.write_status(service.reload_status())
+            else:
+                reload_thread = None
+                status = reload_outcome["status"]
+                gc.collect()
+                gc.freeze()
+                if status["state"] == "idle" and not stopping:
+                    threads = _worker_threads(service, workers)
+                    # Workers left over from an earlier rollover go together with these
+                    retiring.update(children.values())
+                    children = {}
+                    for index in range(workers):
+                        children[index] = _spawn(app_module, sock, index, threads, ready_write)
+                    # The old workers keep serving while the new ones warm up, at most RELOAD_DRAIN_TIMEOUT
+                    retire_deadline = time.monotonic() + config.RELOAD_DRAIN_TIMEOUT
+                    print(f"Rolling workers over to checker set {status['version']}")
+                channel.write_status(status)
+
+        if args.report_interval and not stopping and time.monotonic() - last_report >= args.report_interval:
+            _report_memory(children)
+            last_report = time.monotonic()
+
+    sock.close()
+    channel.close()
+    os.close(ready_read)
+    os.close(ready_write)
+
+
+if __name__ == "__main__":
+    main()
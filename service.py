@@ -1,143 +1,1022 @@
+import gc
+import hashlib
+import os
+import re
+import threading
+import time
 import uuid
-from typing import Dict, List, Union
-from checkers import RegexModerationChecker, BERT_AVAILABLE
-from models import ModerationResponse, ModerationResult, Categories, CategoryScores, CategoryAppliedInputTypes
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+import autotune
+import metrics
+from cache import ResultCache
+from checker_set import CheckerSet
+from conversations import ConversationStore
+from cascade import FLAGGING_CATEGORIES, CascadePolicy
+from checkers import RegexModerationChecker, BatchingChecker, BERT_AVAILABLE
+from checkers.scheduling import BULK, INTERACTIVE, LANE, PriorityGate, current_lane
+from models import CATEGORY_NAMES, ModerationResponse, ModerationResult
+
+# Positions of the categories that count towards "flagged" in the category table
+FLAGGING_INDICES = [CATEGORY_NAMES.index(category) for category in FLAGGING_CATEGORIES]
+
+# Sample inputs a new checker set is warmed up on before it is swapped in:
+# every regex category, plain text and a text longer than one BERT window
+WARM_UP_TEXTS = [
+    "Thanks, that answer was really helpful!",
+    "Write to jane.doe@example.com or call +49 151 23456789 after 5pm.",
+    "Card 4111 1111 1111 1111, IBAN DE89 3704 0044 0532 0130 00, host 192.168.0.1",
+    "This is a longer message that keeps going without saying much at all. " * 40,
+]
+
+# Reload states during which another reload is refused
+RELOAD_BUSY_STATES = ("building", "warming", "draining")
+
+
+class ServiceNotReadyError(RuntimeError):
+    """Raised when a request arrives before the checkers have finished loading."""
+
+
+class ReloadInProgressError(RuntimeError):
+    """Raised when a reload is requested while another one (or the initial BERT load) is running."""
 
 
 class ModerationService:
     """Main moderation service that combines multiple checkers."""
     
-    def __init__(self, use_bert: bool = True, flagging_threshold: float = 0.5):
+    def __init__(
+        self,
+        use_bert: bool = True,
+        flagging_threshold: float = 0.5,
+        model_name: str = "unitary/toxic-bert",
+        bert_batch_size: int = 32,
+        bert_window_stride: int = 128,
+        bert_early_exit: bool = False,
+        bert_backend: str = "torch",
+        model_cache_dir: str = "~/.cache/llm-guardrails-server",
+        batch_max_size: int = 32,
+        batch_max_wait_ms: float = 0.0,
+        cache_max_entries: int = 0,
+        cache_ttl_seconds: float = 3600.0,
+        cascade_policy: Optional[CascadePolicy] = None,
+        load_in_background: bool = False,
+        serve_regex_while_loading: bool = False,
+        redaction_template: str = "[{category}]",
+        checker_workers: int = 32,
+        conversation_max: int = 0,
+        conversation_max_messages: int = 1000,
+        conversation_idle_seconds: float = 1800.0,
+        bert_autotune: bool = False,
+        autotune_workers: int = 1,
+        autotune_max_batch_ms: float = 100.0,
+        regex_patterns: Optional[Dict[str, List[str]]] = None,
+        regex_options: Optional[Dict] = None,
+        bert_warm_up: bool = True,
+        pre_fork: bool = False,
+    ):
         """
         Initialize the moderation service.
         
         Args:
             use_bert: Whether to use BERT-based checking
             flagging_threshold: Threshold above which content is flagged
+            model_name: HuggingFace model name for the BERT checker
+            bert_batch_size: Maximum number of texts (token windows) per BERT forward pass
+            bert_window_stride: Tokens shared by consecutive windows of texts longer than the model limit
+            bert_early_exit: Stop scoring a long text once a flagging category exceeds the threshold
+            bert_backend: BERT inference backend: "torch", "torch-int8", "onnx" or "onnx-int8"
+            model_cache_dir: Directory where exported and quantized models are cached
+            batch_max_size: Maximum number of concurrent texts per BERT batch (1 disables batching)
+            batch_max_wait_ms: Maximum time a text waits for its BERT batch to fill up once the batcher is free
+            cache_max_entries: Maximum number of cached results (0 disables the result cache)
+            cache_ttl_seconds: Time after which a cached result expires
+            cascade_policy: Rules for skipping BERT when it cannot change the outcome
+            load_in_background: Load and warm up BERT in a background thread instead of blocking here
+            serve_regex_while_loading: Return regex-only results until BERT is loaded instead of
+                raising ServiceNotReadyError
+            redaction_template: Replacement for PII matches in redacted texts, formatted with {category}
+            checker_workers: Threads that run unbatched BERT calls next to the regex stage
+            conversation_max: Maximum number of conversations whose message scores are kept
+                (0 disables memoization in moderate_conversation)
+            conversation_max_messages: Maximum number of messages kept per conversation
+            conversation_idle_seconds: Time without a request after which a conversation is dropped
+            bert_autotune: Pick torch thread count and BERT batch size by benchmarking this host after
+                loading, or reuse the choice cached in model_cache_dir for this host and model
+            autotune_workers: Number of processes sharing the cores, which bounds the thread counts tried
+            autotune_max_batch_ms: Latency budget of one BERT forward pass when autotuning
+            regex_patterns: Regex sources per category replacing the built-in PII patterns
+            regex_options: Further RegexModerationChecker arguments (linear mode, scan budget, parallel scanning)
+            bert_warm_up: Run dummy BERT forward passes after loading so the first request does not pay
+                for lazy initialization
+            pre_fork: This process forks workers that serve the requests (serve.py); it then runs no
+                BERT inference itself, because a worker forked after inference started torch's thread
+                pools hangs on its first request, and the workers warm up after forking instead
+                (see warm_up_after_fork)
         """
-        self.regex_checker = RegexModerationChecker()
         self.use_bert = use_bert and BERT_AVAILABLE
-        self.flagging_threshold = flagging_threshold
+        self.cascade_policy = cascade_policy or CascadePolicy()
+        self.serve_regex_while_loading = serve_regex_while_loading
+        self.redaction_template = redaction_template
+        self.regex_options = dict(regex_options or {})
+        self.bert_warm_up = bert_warm_up
+        self.pre_fork = pre_fork
+        # Sample texts of the last reload, whose warm-up a pre_fork master leaves to the workers
+        self._fork_warm_up_texts: Optional[List[str]] = None
+        self._bert_loaded = threading.Event()
+        self.checker_workers = checker_workers
+        self._checker_pool = ThreadPoolExecutor(max_workers=checker_workers, thread_name_prefix="checker")
+        # Checker calls submitted to the pool and not finished yet, see _submit_to_pool
+        self._pool_inflight = 0
+        self._pool_lock = threading.Lock()
+        # Shared by all requests, so bulk forward passes yield to interactive ones
+        self.priority_gate = PriorityGate()
+        self.tuning = None
+        self.autotune_options = None
+        if bert_autotune:
+            self.autotune_options = dict(
+                cache_path=os.path.join(os.path.expanduser(model_cache_dir), "autotune.json"),
+                workers=autotune_workers,
+                max_batch_ms=autotune_max_batch_ms,
+            )
         
+        # Checkers and threshold in use; replaced as a whole by reload()
+        self.checkers = CheckerSet(
+            flagging_threshold,
+            self._regex_checker(regex_patterns),
+            self.cascade_policy,
+            bert_status="loading" if self.use_bert else "disabled",
+        )
+        self.generation = 1
+        self._swap_lock = threading.Lock()
+        self._swap_listeners: List[Callable[[CheckerSet], None]] = []
+        self._reload = {"state": "idle", "generation": self.generation, "version": self.checkers.version}
+        self._reload_lock = threading.Lock()
+        
+        self._bert_options = None
+        self._batch_max_size = batch_max_size
+        self._batch_max_wait_ms = batch_max_wait_ms
         if self.use_bert:
-            try:
-                from checkers import BertModerationChecker
-                self.bert_checker = BertModerationChecker()
-                print("BERT checker initialized successfully")
-            except (ImportError, RuntimeError, OSError) as e:
-                print(f"Could not initialize BERT checker: {e}")
-                self.use_bert = False
+            self._bert_options = dict(
+                model_name=model_name,
+                batch_size=bert_batch_size,
+                window_stride=bert_window_stride,
+                early_exit_threshold=flagging_threshold if bert_early_exit else None,
+                early_exit_categories=FLAGGING_CATEGORIES,
+                backend=bert_backend,
+                cache_dir=model_cache_dir,
+                gate=self.priority_gate,
+            )
+            if load_in_background:
+                threading.Thread(target=self._load_bert, name="bert-loader", daemon=True).start()
+            else:
+                self._load_bert()
         else:
-            self.bert_checker = None
+            self._bert_loaded.set()
             if use_bert:
                 print("BERT checker not available, using regex only")
+        
+        self.result_cache = None
+        if cache_max_entries > 0:
+            self.result_cache = ResultCache(max_entries=cache_max_entries, ttl_seconds=cache_ttl_seconds)
+            self.result_cache.set_fingerprint(self.config_fingerprint())
+        
+        self.conversation_store = None
+        if conversation_max > 0:
+            self.conversation_store = ConversationStore(
+                max_conversations=conversation_max,
+                max_messages=conversation_max_messages,
+                idle_seconds=conversation_idle_seconds,
+            )
+    
+    def _regex_checker(self, patterns: Optional[Dict[str, List[str]]] = None) -> RegexModerationChecker:
+        """Build a regex checker, rejecting categories outside the response's category table and invalid patterns."""
+        if patterns is not None:
+            unknown = sorted(set(patterns) - set(CATEGORY_NAMES))
+            if unknown:
+                raise ValueError(f"Unknown regex categories: {', '.join(unknown)}")
+        try:
+            return RegexModerationChecker(patterns, **self.regex_options)
+        except re.error as e:
+            raise ValueError(f"Invalid regex pattern {e.pattern!r}: {e}") from e
+    
+    def _build_bert(self, bert_options: Dict, warm_up: bool = True):
+        """Import, load and (with warm_up) warm up a BERT checker and its micro-batcher (None if batching is disabled)."""
+        from checkers import BertModerationChecker
+        bert_checker = BertModerationChecker(**bert_options)
+        if warm_up:
+            bert_checker.warm_up()
+        
+        batch_max_size = self._batch_max_size
+        if self.autotune_options is not None:
+            try:
+                # A pre-forking master tunes in a throwaway child; its workers set the thread counts
+                self.tuning = autotune.autotune(bert_checker, in_subprocess=self.pre_fork, **self.autotune_options)
+            except (RuntimeError, OSError, ValueError) as e:
+                print(f"Autotuning failed, keeping the configured settings: {e}")
+            else:
+                if batch_max_size > 1:
+                    batch_max_size = self.tuning["batch_size"]
+        
+        bert_batcher = None
+        if batch_max_size > 1:
+            bert_batcher = BatchingChecker(
+                bert_checker,
+                max_batch_size=batch_max_size,
+                max_wait_ms=self._batch_max_wait_ms,
+            )
+        return bert_checker, bert_batcher
+    
+    def _load_bert(self):
+        """Load the BERT checker configured at startup, then start routing texts to it."""
+        start = time.monotonic()
+        current = self.checkers
+        try:
+            # A pre-forking master leaves the warm-up to its workers
+            bert_checker, bert_batcher = self._build_bert(
+                self._bert_options, warm_up=self.bert_warm_up and not self.pre_fork
+            )
+        except (ImportError, RuntimeError, OSError, ValueError) as e:
+            print(f"Could not initialize BERT checker: {e}")
+            self.use_bert = False
+            self._swap(CheckerSet(
+                current.flagging_threshold, current.regex_checker, self.cascade_policy, bert_status="failed"
+            ))
+            self._update_reload(version=self.config_version)
+            self._bert_loaded.set()
+            return
+        
+        self._swap(CheckerSet(
+            current.flagging_threshold, current.regex_checker, self.cascade_policy,
+            bert_checker=bert_checker, bert_batcher=bert_batcher, bert_status="ready",
+        ))
+        self._update_reload(version=self.config_version)
+        self._bert_loaded.set()
+        print(f"BERT checker initialized successfully in {time.monotonic() - start:.1f}s")
+    
+    def _swap(self, checkers: CheckerSet) -> CheckerSet:
+        """Make checkers the active set for new requests and return the previous one."""
+        with self._swap_lock:
+            previous, self.checkers = self.checkers, checkers
+        for listener in list(self._swap_listeners):
+            listener(checkers)
+        return previous
     
-    def _combine_scores(self, regex_scores: Dict[str, float], bert_scores: Dict[str, float] = None) -> Dict[str, float]:
+    def add_swap_listener(self, listener: Callable[[CheckerSet], None]):
+        """Call listener(new set) whenever a new checker set becomes active, e.g. to rebuild pool processes."""
+        self._swap_listeners.append(listener)
+    
+    @contextmanager
+    def _use_checkers(self) -> Iterator[CheckerSet]:
+        """Pin the active checker set for the duration of a request."""
+        checkers = self.checkers
+        checkers.acquire()
+        try:
+            yield checkers
+        finally:
+            checkers.release()
+    
+    # The active set's checkers and settings
+    
+    @property
+    def regex_checker(self) -> RegexModerationChecker:
+        return self.checkers.regex_checker
+    
+    @property
+    def bert_checker(self):
+        return self.checkers.bert_checker
+    
+    @property
+    def bert_batcher(self) -> Optional[BatchingChecker]:
+        return self.checkers.bert_batcher
+    
+    @property
+    def bert_status(self) -> str:
+        return self.checkers.bert_status
+    
+    @property
+    def flagging_threshold(self) -> float:
+        return self.checkers.flagging_threshold
+    
+    @property
+    def config_version(self) -> str:
+        """Short hash of the active configuration, reported with every response."""
+        return self.checkers.version
+    
+    def check_reload_options(
+        self,
+        model_name: Optional[str] = None,
+        flagging_threshold: Optional[float] = None,
+        regex_patterns: Optional[Dict[str, List[str]]] = None,
+        warm_up_texts: Optional[List[str]] = None,
+    ):
+        """
+        Validate reload() arguments without building anything heavy.
+        
+        Raises:
+            ValueError: If the patterns, threshold or model cannot be used
+        """
+        if flagging_threshold is not None and not 0.0 <= flagging_threshold <= 1.0:
+            raise ValueError("flagging_threshold must be between 0 and 1")
+        if regex_patterns is not None:
+            self._regex_checker(regex_patterns)
+        if model_name is not None and self._bert_options is None:
+            raise ValueError("BERT is disabled or not installed, so its model cannot be changed")
+    
+    def _begin_reload(self):
+        """Mark a reload as started, or raise ReloadInProgressError if one is running."""
+        with self._reload_lock:
+            if self._reload["state"] in RELOAD_BUSY_STATES:
+                raise ReloadInProgressError("A reload is already in progress")
+            if self.bert_status == "loading":
+                raise ReloadInProgressError("The BERT checker is still loading")
+            self._reload = {
+                "state": "building",
+                "generation": self.generation,
+                "version": self.checkers.version,
+                "started": time.time(),
+            }
+    
+    def _update_reload(self, **fields):
+        """Merge fields into the reload status."""
+        with self._reload_lock:
+            self._reload.update(fields)
+    
+    def reload_status(self) -> Dict:
+        """State of the last (or running) reload and the active configuration version."""
+        with self._reload_lock:
+            return dict(self._reload)
+    
+    def start_reload(self, **options) -> Dict:
+        """
+        Validate the options and run reload(**options) in a background thread.
+        
+        Returns:
+            The reload status right after starting
+        
+        Raises:
+            ValueError: If the options are invalid
+            ReloadInProgressError: If another reload is running
+        """
+        self.check_reload_options(**{key: value for key, value in options.items() if key != "drain_timeout"})
+        self._begin_reload()
+        threading.Thread(target=self._run_reload, kwargs=options, name="checker-reload", daemon=True).start()
+        return self.reload_status()
+    
+    def reload(
+        self,
+        model_name: Optional[str] = None,
+        flagging_threshold: Optional[float] = None,
+        regex_patterns: Optional[Dict[str, List[str]]] = None,
+        warm_up_texts: Optional[List[str]] = None,
+        drain_timeout: float = 60.0,
+    ) -> Dict:
+        """
+        Replace the checkers without interrupting traffic.
+        
+        Builds a new checker set next to the active one, reusing whatever did
+        not change, warms it up on sample texts until its latency is stable,
+        and swaps it in atomically. Requests that started on the old set
+        finish on it; once they are done (or after drain_timeout) the old set
+        is closed and its memory released.
+        
+        Args:
+            model_name: New BERT model (None keeps the current one)
+            flagging_threshold: New flagging threshold (None keeps the current one)
+            regex_patterns: Regex sources per category replacing the current table (None keeps it)
+            warm_up_texts: Sample inputs for the warm-up (default: WARM_UP_TEXTS)
+            drain_timeout: Maximum time to wait for requests still using the old set
+        
+        Returns:
+            The final reload status, with state "idle" or "failed"
+        
+        Raises:
+            ValueError: If the options are invalid
+            ReloadInProgressError: If another reload is running
+        """
+        self.check_reload_options(model_name, flagging_threshold, regex_patterns, warm_up_texts)
+        self._begin_reload()
+        return self._run_reload(model_name, flagging_threshold, regex_patterns, warm_up_texts, drain_timeout)
+    
+    def _run_reload(
+        self,
+        model_name: Optional[str] = None,
+        flagging_threshold: Optional[float] = None,
+        regex_patterns: Optional[Dict[str, List[str]]] = None,
+        warm_up_texts: Optional[List[str]] = None,
+        drain_timeout: float = 60.0,
+    ) -> Dict:
+        """Body of reload(), after the options were checked and the reload was marked as started."""
+        start = time.monotonic()
+        try:
+            current = self.checkers
+            threshold = current.flagging_threshold if flagging_threshold is None else flagging_threshold
+            regex_checker = current.regex_checker if regex_patterns is None else self._regex_checker(regex_patterns)
+            
+            bert_checker, bert_batcher, bert_status = current.bert_checker, current.bert_batcher, current.bert_status
+            bert_options = self._bert_options
+            if bert_options is not None:
+                new_options = dict(bert_options)
+                if model_name is not None:
+                    new_options["model_name"] = model_name
+                if new_options["early_exit_threshold"] is not None:
+                    new_options["early_exit_threshold"] = threshold
+                # Only load a model if its settings changed or the previous attempt failed
+                if new_options != bert_options or bert_status != "ready":
+                    bert_checker, bert_batcher = self._build_bert(new_options, warm_up=not self.pre_fork)
+                    bert_status = "ready"
+                    bert_options = new_options
+            
+            candidate = CheckerSet(
+                threshold, regex_checker, self.cascade_policy,
+                bert_checker=bert_checker, bert_batcher=bert_batcher, bert_status=bert_status,
+            )
+            self._update_reload(state="warming")
+            # A pre_fork master only warms up the regex checker; the new workers run the BERT rounds
+            rounds, latency_ms = self._warm_up(candidate, warm_up_texts or WARM_UP_TEXTS, bert=not self.pre_fork)
+            if self.pre_fork:
+                self._fork_warm_up_texts = warm_up_texts or WARM_UP_TEXTS
+            
+            previous = self._swap(candidate)
+            self._bert_options = bert_options
+            self.use_bert = bert_status == "ready"
+            self.generation += 1
+            self._update_reload(
+                state="draining",
+                generation=self.generation,
+                version=candidate.version,
+                previous_version=previous.version,
+                warm_up_rounds=rounds,
+                warm_up_ms=latency_ms,
+            )
+            print(
+                f"Swapped in checker set {candidate.version} (generation {self.generation}) after "
+                f"{rounds} warm-up rounds, draining {previous.active} requests on {previous.version}"
+            )
+            
+            drained = previous.wait_idle(drain_timeout)
+            previous.close(successor=candidate)
+            del previous
+            gc.collect()
+            self._update_reload(state="idle", drained=drained, seconds=time.monotonic() - start)
+        except Exception as e:
+            # Any failure leaves the active set untouched and must not block later reloads
+            print(f"Reload failed, keeping checker set {self.checkers.version}: {e}")
+            self._update_reload(state="failed", error=str(e), seconds=time.monotonic() - start)
+        return self.reload_status()
+    
+    def _warm_up(
+        self, checkers: CheckerSet, texts: List[str], max_rounds: int = 20, tolerance: float = 0.1, bert: bool = True
+    ) -> Tuple[int, float]:
+        """
+        Score sample texts with a new set until consecutive rounds take about as long.
+        
+        The rounds run in the bulk lane, so their BERT passes yield to live
+        interactive traffic on the shared priority gate. With bert=False only
+        the regex checker is warmed up.
+        
+        Returns:
+            The number of rounds and the latency of the last round in milliseconds
+        """
+        token = LANE.set(BULK)
+        try:
+            durations: List[float] = []
+            for _ in range(max_rounds):
+                begin = time.perf_counter()
+                checkers.regex_checker.check_batch(texts)
+                for text in texts:
+                    checkers.regex_checker.check_spans(text)
+                if bert and checkers.bert_checker is not None:
+                    checkers.bert_checker.check_batch(texts)
+                durations.append(time.perf_counter() - begin)
+                if len(durations) >= 3 and abs(durations[-1] - durations[-2]) <= tolerance * durations[-2]:
+                    break
+        finally:
+            LANE.reset(token)
+        return len(durations), durations[-1] * 1000
+    
+    def checker_options(self) -> Dict:
+        """Constructor arguments that recreate the active regex-only configuration, e.g. in a pool process."""
+        checkers = self.checkers
+        return {
+            "flagging_threshold": checkers.flagging_threshold,
+            "regex_patterns": checkers.regex_checker.patterns if checkers.regex_checker.custom_patterns else None,
+            # Pool processes are the parallelism already
+            "regex_options": {**self.regex_options, "parallel_processes": 0},
+        }
+    
+    def wait_for_bert(self, timeout: Optional[float] = None) -> bool:
+        """Block until BERT has finished loading (or failed to); returns False on timeout."""
+        return self._bert_loaded.wait(timeout)
+    
+    @property
+    def ready(self) -> bool:
+        """Whether requests can be served, fully or (if allowed) regex-only while BERT loads."""
+        return self.bert_status != "loading" or self.serve_regex_while_loading
+    
+    def checker_status(self) -> Dict[str, str]:
+        """State of each checker: "ready", "loading", "failed" or "disabled"."""
+        return {"regex": "ready", "bert": self.bert_status}
+    
+    def config_fingerprint(self) -> str:
+        """Hash of everything that influences scores, used to key cached results."""
+        return self.checkers.fingerprint
+    
+    def after_fork(self):
+        """Re-create per-process checker state in a forked worker."""
+        self._checker_pool = ThreadPoolExecutor(max_workers=self.checker_workers, thread_name_prefix="checker")
+        self._pool_inflight = 0
+        self._pool_lock = threading.Lock()
+        self.checkers.after_fork()
+    
+    def warm_up_after_fork(self):
+        """Warm up BERT in a forked worker of a pre_fork service, whose master skipped the warm-up."""
+        if self.bert_checker is None:
+            return
+        if self.bert_warm_up:
+            self.bert_checker.warm_up()
+        if self._fork_warm_up_texts is not None:
+            # The warm-up rounds of the reload that built the active set
+            rounds, latency_ms = self._warm_up(self.checkers, self._fork_warm_up_texts)
+            print(f"Warmed up checker set {self.checkers.version} in {rounds} rounds ({latency_ms:.0f} ms per round)")
+    
+    def _combine_scores(self, regex_scores: Dict[str, float], *other_scores: Dict[str, float]) -> Dict[str, float]:
         """
         Combine scores from different checkers.
         
         Args:
             regex_scores: Scores from regex checker
-            bert_scores: Scores from BERT checker (optional)
+            *other_scores: Scores from the concurrent checkers that answered (e.g. BERT)
             
         Returns:
-            Combined scores
+            Combined scores, the maximum per category over all checkers
         """
-        if bert_scores is None:
+        if not other_scores:
             return regex_scores
         
-        # Get all unique categories from both checkers
-        all_categories = set(regex_scores.keys()) | set(bert_scores.keys())
+        combined = dict(regex_scores)
+        for scores in other_scores:
+            for category, score in scores.items():
+                combined[category] = max(combined.get(category, 0.0), score)
+        
+        return combined
+    
+    def _build_results(
+        self,
+        checkers: CheckerSet,
+        scored: List[Tuple[Dict[str, float], List[str], List[str]]],
+        shape: str = "full",
+    ) -> List[Dict]:
+        """
+        Convert combined scores of a whole batch to result dicts in the wire format.
+        
+        Scores are laid out as one row per text over the fixed category table and
+        thresholded row by row, so no pydantic models are built or validated.
+        
+        The "sparse" shape leaves out false categories, zero scores and empty
+        applied input types, so absent entries read as the defaults;
+        "flagged_only" also leaves out the scores of categories that are not
+        above the threshold.
+        """
+        threshold = checkers.flagging_threshold
+        rows = [[float(scores.get(category, 0.0)) for category in CATEGORY_NAMES] for scores, _, _ in scored]
+        flag_rows = [[score > threshold for score in row] for row in rows]
+        
+        results = []
+        for row, flags, (_, stages, degraded) in zip(rows, flag_rows, scored):
+            if shape == "full":
+                result = {
+                    "flagged": any(flags[index] for index in FLAGGING_INDICES),
+                    "categories": dict(zip(CATEGORY_NAMES, flags)),
+                    "category_scores": dict(zip(CATEGORY_NAMES, row)),
+                    # Only text input is supported, so flagged categories apply to "text"
+                    "category_applied_input_types": {
+                        category: ["text"] if flag else [] for category, flag in zip(CATEGORY_NAMES, flags)
+                    },
+                }
+            else:
+                shown = flags if shape == "flagged_only" else row
+                result = {
+                    "flagged": any(flags[index] for index in FLAGGING_INDICES),
+                    "categories": {category: True for category, flag in zip(CATEGORY_NAMES, flags) if flag},
+                    "category_scores": {
+                        category: score for category, score, show in zip(CATEGORY_NAMES, row, shown) if show
+                    },
+                    "category_applied_input_types": {
+                        category: ["text"] for category, flag in zip(CATEGORY_NAMES, flags) if flag
+                    },
+                }
+            if self.cascade_policy.enabled:
+                result["stages"] = stages
+            if degraded:
+                result["degraded"] = degraded
+            results.append(result)
+        return results
+    
+    def _submit_to_pool(self, checker, texts: List[str], deadline: Optional[float]) -> Optional[Future]:
+        """
+        Run checker.check_batch(texts) on the checker pool; None to shed the work instead.
+        
+        Work a request abandoned at its deadline keeps its pool thread until
+        it finishes, so requests with a deadline do not queue more work
+        behind a saturated pool: they answer without the checker at once.
+        """
+        with self._pool_lock:
+            if deadline is not None and self._pool_inflight >= self.checker_workers:
+                return None
+            self._pool_inflight += 1
+        future = checker.submit_batch(texts, self._checker_pool)
+        future.add_done_callback(self._pool_call_done)
+        return future
+    
+    def _pool_call_done(self, _future: Future):
+        with self._pool_lock:
+            self._pool_inflight -= 1
+    
+    def _start_checker(
+        self, checker, batcher: Optional[BatchingChecker], texts: List[str], deadline: Optional[float]
+    ) -> Optional[Future]:
+        """Start a concurrent checker on texts in the background; None if the deadline has passed or the work is shed."""
+        if deadline is not None and time.monotonic() >= deadline:
+            return None
+        # Single interactive texts share batches with concurrent requests;
+        # lists are large enough to be batched on their own, and bulk texts
+        # stay out of the shared batches so they run at bulk priority
+        if batcher and len(texts) == 1 and current_lane() == INTERACTIVE:
+            return batcher.submit_batch(texts)
+        future = self._submit_to_pool(checker, texts, deadline)
+        if future is None:
+            metrics.CHECKER_SHED.labels(checker.name).inc(len(texts))
+        return future
+    
+    def _finish_checker(
+        self, checker, future: Optional[Future], deadline: Optional[float]
+    ) -> Optional[List[Dict[str, float]]]:
+        """Wait for a concurrent checker's scores until the deadline; None if they did not arrive in time."""
+        if future is None:
+            return None
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # Takes the texts out of their batch or the pool queue if they have not started yet
+            if not future.cancel():
+                metrics.CHECKER_ABANDONED.labels(checker.name).inc()
+            return None
+    
+    def _compute_scores(
+        self,
+        checkers: CheckerSet,
+        texts: List[str],
+        regex_scans: Optional[List[Tuple[Dict[str, float], bool]]] = None,
+        deadline: Optional[float] = None,
+    ) -> List[Tuple[Dict[str, float], List[str], List[str]]]:
+        """
+        Run the checkers and combine their scores, without the result cache.
+        
+        The concurrent checkers of the set (BERT) run in the background while
+        the regex stage scans the texts. If a checker has not answered by the
+        deadline, the affected texts are scored without it and marked as
+        degraded, and so are texts the regex stage could not scan to the end
+        within its scan budget.
+        
+        Args:
+            checkers: Checker set the request started with
+            texts: Texts to score
+            regex_scans: Regex (scores, complete) per text computed elsewhere (e.g. in a process pool,
+                see RegexModerationChecker.scan_batch), skipping the regex stage
+            deadline: time.monotonic() value by which scores are needed (None waits for every checker)
+        
+        Returns:
+            Combined scores, the names of the stages that ran and the names of
+            the checkers that missed the deadline, per text
+        """
+        for text in texts:
+            metrics.INPUT_LENGTH.observe(len(text))
+        
+        if checkers.bert_status == "loading" and not self.serve_regex_while_loading:
+            raise ServiceNotReadyError("The BERT checker is still loading")
+        concurrent = checkers.concurrent_checkers
+        
+        # Without a cascade policy the concurrent checkers do not depend on
+        # the regex scores, so they start first and run while the regex stage scans
+        indices: List[int] = []
+        futures: List[Optional[Future]] = []
+        if concurrent and not self.cascade_policy.enabled:
+            indices = list(range(len(texts)))
+            for checker, batcher in concurrent:
+                self.cascade_policy.record(checker.name, ran=len(texts))
+                futures.append(self._start_checker(checker, batcher, texts, deadline))
+        
+        if regex_scans is None:
+            start = time.perf_counter()
+            regex_scans = checkers.regex_checker.scan_batch(texts)
+            metrics.REGEX_SECONDS.observe(time.perf_counter() - start)
+        regex_batch = [scores for scores, _ in regex_scans]
+        self.cascade_policy.record("regex", ran=len(texts))
         
-        combined = {}
-        for category in all_categories:
-            # Take maximum of both scores
-            regex_score = regex_scores.get(category, 0.0)
-            bert_score = bert_scores.get(category, 0.0)
-            combined[category] = max(regex_score, bert_score)
+        if concurrent and self.cascade_policy.enabled:
+            # Only run the concurrent checkers where the cascade policy says they can change the outcome
+            skip_reasons = []
+            for index, (text, text_regex_scores) in enumerate(zip(texts, regex_batch)):
+                reason = self.cascade_policy.bert_skip_reason(text, text_regex_scores, checkers.flagging_threshold)
+                if reason is None:
+                    indices.append(index)
+                else:
+                    skip_reasons.append(reason)
+            for checker, batcher in concurrent:
+                self.cascade_policy.record(checker.name, ran=len(indices), skip_reasons=skip_reasons)
+                if indices:
+                    futures.append(self._start_checker(checker, batcher, [texts[index] for index in indices], deadline))
         
+        # Texts whose regex scan ran out of its budget were only partly scanned
+        degraded_batch: List[List[str]] = [[] if complete else [checkers.regex_checker.name] for _, complete in regex_scans]
+        incomplete = sum(1 for _, complete in regex_scans if not complete)
+        if incomplete:
+            metrics.REGEX_TIMEOUTS.inc(incomplete)
+        stages_batch: List[List[str]] = [["regex"] for _ in texts]
+        scores_batch: List[List[Dict[str, float]]] = [[scores] for scores in regex_batch]
+        if indices:
+            for (checker, _), future in zip(concurrent, futures):
+                checker_results = self._finish_checker(checker, future, deadline)
+                if checker_results is None:
+                    metrics.CHECKER_TIMEOUTS.labels(checker.name).inc(len(indices))
+                    for index in indices:
+                        degraded_batch[index].append(checker.name)
+                else:
+                    for index, checker_scores in zip(indices, checker_results):
+                        stages_batch[index].append(checker.name)
+                        scores_batch[index].append(checker_scores)
+        
+        start = time.perf_counter()
+        combined = [
+            (self._combine_scores(*text_scores), stages, degraded)
+            for text_scores, stages, degraded in zip(scores_batch, stages_batch, degraded_batch)
+        ]
+        metrics.COMBINE_SECONDS.observe(time.perf_counter() - start)
         return combined
     
-    def _scores_to_categories(self, scores: Dict[str, float]) -> Categories:
-        """Convert scores to boolean categories."""
-        return Categories(
-            #  PII Categories
-            **{
-                "pii/phone": scores.get("pii/phone", 0.0) > self.flagging_threshold,
-                "pii/email": scores.get("pii/email", 0.0) > self.flagging_threshold,
-                "pii/credit_card": scores.get("pii/credit_card", 0.0) > self.flagging_threshold,
-                "pii/ip_address": scores.get("pii/ip_address", 0.0) > self.flagging_threshold,
-                "pii/iban": scores.get("pii/iban", 0.0) > self.flagging_threshold,
-            },
-            # Content moderation categories
-            hate=scores.get("hate", 0.0) > self.flagging_threshold,
-            harassment=scores.get("harassment", 0.0) > self.flagging_threshold,
-            illicit=scores.get("illicit", 0.0) > self.flagging_threshold,
-            violence=scores.get("violence", 0.0) > self.flagging_threshold,
-            **{
-                "hate/threatening": scores.get("hate/threatening", 0.0) > self.flagging_threshold,
-                "harassment/threatening": scores.get("harassment/threatening", 0.0) > self.flagging_threshold, 
-            }
-        )
+    def _get_scores(
+        self,
+        checkers: CheckerSet,
+        texts: List[str],
+        regex_scans: Optional[List[Tuple[Dict[str, float], bool]]] = None,
+        deadline: Optional[float] = None,
+    ) -> List[Tuple[Dict[str, float], List[str], List[str]]]:
+        """Get combined scores, stages and missed checkers, running the checkers only for cache misses."""
+        # Requests still finishing on a swapped-out set neither read nor
+        # rebind the cache, which already belongs to the new configuration
+        if self.result_cache is None or checkers is not self.checkers:
+            return self._compute_scores(checkers, texts, regex_scans, deadline)
+        
+        # Bind the cache to the current configuration, dropping stale entries
+        self.result_cache.set_fingerprint(checkers.fingerprint)
+        
+        keys = [self.result_cache.make_key(text) for text in texts]
+        scored = self.result_cache.get_many(keys)
+        
+        # Run inference once per distinct missing text
+        missing = {}
+        for index, cached in enumerate(scored):
+            if cached is None:
+                missing.setdefault(keys[index], []).append(index)
+        
+        if missing:
+            missing_keys = list(missing)
+            fresh = self._compute_scores(
+                checkers,
+                [texts[missing[key][0]] for key in missing_keys],
+                None if regex_scans is None else [regex_scans[missing[key][0]] for key in missing_keys],
+                deadline
+            )
+            for key, value in zip(missing_keys, fresh):
+                # Degraded scores are incomplete, so the next request tries again
+                if not value[2]:
+                    self.result_cache.put(key, value)
+                for index in missing[key]:
+                    scored[index] = value
+        
+        return scored
     
-    def _scores_to_category_scores(self, scores: Dict[str, float]) -> CategoryScores:
-        """Convert scores to CategoryScores model."""
-        return CategoryScores(
-            #  PII Categories
-            **{
-                "pii/phone": scores.get("pii/phone", 0.0),
-                "pii/email": scores.get("pii/email", 0.0),
-                "pii/credit_card": scores.get("pii/credit_card", 0.0),
-                "pii/ip_address": scores.get("pii/ip_address", 0.0),
-                "pii/iban": scores.get("pii/iban", 0.0),
-            },
-            # Content moderation categories
-            hate=scores.get("hate", 0.0),
-            harassment=scores.get("harassment", 0.0),
-            illicit=scores.get("illicit", 0.0),
-            violence=scores.get("violence", 0.0),
-            **{
-                "hate/threatening": scores.get("hate/threatening", 0.0),
-                "harassment/threatening": scores.get("harassment/threatening", 0.0),
-                "illicit/violent": scores.get("illicit/violent", 0.0),
-            }
-        )
+    def moderate_results(
+        self,
+        texts: List[str],
+        regex_scans: Optional[List[Tuple[Dict[str, float], bool]]] = None,
+        return_spans: bool = False,
+        redact: bool = False,
+        deadline: Optional[float] = None,
+        shape: str = "full",
+    ) -> List[Dict]:
+        """
+        Moderate a list of texts with batched checker calls.
+        
+        Args:
+            texts: Texts to moderate
+            regex_scans: Regex (scores, complete) per text computed elsewhere (e.g. in a process pool,
+                see RegexModerationChecker.scan_batch)
+            return_spans: Add the PII matches of each text as "spans"
+            redact: Add a copy of each text with PII matches replaced as "redacted_text"
+            deadline: time.monotonic() value after which checkers that have not answered
+                are left out and listed in the result's "degraded"
+            shape: "full" (OpenAI-compatible), "sparse" or "flagged_only" (see _build_results)
+            
+        Returns:
+            Result dicts in the wire format (see ModerationResult), in input order
+        """
+        with self._use_checkers() as checkers:
+            return self._moderate_results(checkers, texts, regex_scans, return_spans, redact, deadline, shape)
+    
+    def _moderate_results(
+        self,
+        checkers: CheckerSet,
+        texts: List[str],
+        regex_scans: Optional[List[Tuple[Dict[str, float], bool]]],
+        return_spans: bool,
+        redact: bool,
+        deadline: Optional[float],
+        shape: str = "full",
+    ) -> List[Dict]:
+        """Body of moderate_results, scoring with the given checker set."""
+        located = None
+        if return_spans or redact:
+            # The scan that locates matches also produces the regex scores
+            start = time.perf_counter()
+            located = checkers.regex_checker.locate_batch(texts)
+            metrics.REGEX_SECONDS.observe(time.perf_counter() - start)
+            regex_scans = [(scores, complete) for scores, _, complete in located]
+        
+        scored = self._get_scores(checkers, texts, regex_scans, deadline)
+        start = time.perf_counter()
+        results = self._build_results(checkers, scored, shape)
+        if located is not None:
+            for result, text, (_, spans, _) in zip(results, texts, located):
+                if return_spans:
+                    result["spans"] = [{"start": begin, "end": end, "category": category} for begin, end, category in spans]
+                if redact:
+                    result["redacted_text"] = checkers.regex_checker.redact(text, spans, self.redaction_template)
+        metrics.RESPONSE_SECONDS.observe(time.perf_counter() - start)
+        return results
     
-    def _get_applied_input_types(self, categories: Categories) -> CategoryAppliedInputTypes:
-        """
-        Get applied input types for each category.
-        Since we only support text input currently, return 'text' for flagged categories.
-        """
-        applied_types = CategoryAppliedInputTypes()
-        
-        # For now, we only support text input
-        input_type = ["text"]
-        
-        # PII Categories - use actual field names, not aliases
-        if categories.pii_phone:
-            applied_types.pii_phone = input_type
-        if categories.pii_email:
-            applied_types.pii_email = input_type
-        if categories.pii_credit_card:
-            applied_types.pii_credit_card = input_type
-        if categories.pii_ip_address:
-            applied_types.pii_ip_address = input_type
-        if categories.pii_iban:
-            applied_types.pii_iban = input_type
-        
-        # Content moderation categories
-        if categories.hate:
-            applied_types.hate = input_type
-        if categories.harassment:
-            applied_types.harassment = input_type
-        if categories.violence:
-            applied_types.violence = input_type
-        if categories.hate_threatening:
-            applied_types.hate_threatening = input_type
-        if categories.harassment_threatening:
-            applied_types.harassment_threatening = input_type
+    def moderate_payload(
+        self,
+        input_data: Union[str, List[str]],
+        model: str = "moderation-latest",
+        return_spans: bool = False,
+        redact: bool = False,
+        deadline: Optional[float] = None,
+        shape: str = "full",
+    ) -> Dict:
+        """
+        Moderate input data and return the response as a dict in the wire format.
+        
+        This is the fast path used by the server; encode it with models.encode_json.
+        
+        Args:
+            input_data: Text or list of texts to moderate
+            model: Model name (for compatibility)
+            return_spans: Add the PII matches of each text to its result
+            redact: Add a copy of each text with PII matches replaced to its result
+            deadline: time.monotonic() value by which the response is needed (see moderate_results)
+            shape: Shape of the results, "full", "sparse" or "flagged_only" (see moderate_results)
             
-        return applied_types
+        Returns:
+            Response dict with the same fields as ModerationResponse; the server
+            moves "config_version" to a header unless the client asks for it
+        """
+        texts = [input_data] if isinstance(input_data, str) else input_data
+        with self._use_checkers() as checkers:
+            results = self._moderate_results(checkers, texts, None, return_spans, redact, deadline, shape)
+        return {
+            "id": f"modr-{uuid.uuid4().hex}",
+            "model": model,
+            "config_version": checkers.version,
+            "results": results,
+        }
+    
+    def moderate_conversation(
+        self,
+        conversation_id: str,
+        messages: List[Tuple[Optional[str], str]],
+        model: str = "moderation-latest",
+        deadline: Optional[float] = None,
+        new_only: bool = False,
+        shape: str = "full",
+        scan: Optional[Callable[[List[str]], List[Tuple[Dict[str, float], bool]]]] = None,
+    ) -> Dict:
+        """
+        Moderate the full history of a conversation, scoring only messages not seen before.
+        
+        The score row and result of each message are kept per conversation
+        under the message id (or a hash of the text for messages without one),
+        so each turn only runs the checkers on its new messages and the overall
+        result is a column-wise maximum over the stored rows.
+        
+        Args:
+            conversation_id: Stable id of the conversation
+            messages: (message id or None, text) per message, oldest first
+            model: Model name (for compatibility)
+            deadline: time.monotonic() value by which the response is needed (see moderate_results)
+            new_only: Only return per-message results for messages scored in this call
+            shape: Shape of the results, "full", "sparse" or "flagged_only" (see moderate_results)
+            scan: Returns the regex (scores, complete) of the new messages computed elsewhere
+                (e.g. in a process pool, see ModerationExecutor), so the store stays in this process
+        
+        Returns:
+            Response dict with the "result" over all messages and per-message
+            results under "messages" (see ConversationModerationResponse)
+        """
+        with self._use_checkers() as checkers:
+            return self._moderate_conversation(
+                checkers, conversation_id, messages, model, deadline, new_only, shape, scan
+            )
+    
+    def _moderate_conversation(
+        self,
+        checkers: CheckerSet,
+        conversation_id: str,
+        messages: List[Tuple[Optional[str], str]],
+        model: str,
+        deadline: Optional[float],
+        new_only: bool,
+        shape: str = "full",
+        scan: Optional[Callable[[List[str]], List[Tuple[Dict[str, float], bool]]]] = None,
+    ) -> Dict:
+        """Body of moderate_conversation, scoring with the given checker set."""
+        texts = [text for _, text in messages]
+        keys = [
+            str(message_id) if message_id is not None
+            else "sha256:" + hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+            for message_id, text in messages
+        ]
+        lengths = [len(text) for text in texts]
+        
+        # Stored entries are (scores, stages, degraded), score row over CATEGORY_NAMES, result dict
+        # Like the result cache, the store only holds scores of the active set
+        store = self.conversation_store if checkers is self.checkers else None
+        if store is not None:
+            store.set_fingerprint(checkers.fingerprint)
+            entries = store.get_many(conversation_id, keys, lengths)
+        else:
+            entries = [None] * len(texts)
+        
+        # Score each new message once, even if it appears twice
+        missing: Dict[str, List[int]] = {}
+        for index, entry in enumerate(entries):
+            if entry is None:
+                missing.setdefault(keys[index], []).append(index)
+        metrics.CONVERSATION_REUSED.inc(len(texts) - sum(len(indices) for indices in missing.values()))
+        metrics.CONVERSATION_SCORED.inc(len(missing))
+        
+        fresh_entries = []
+        if missing:
+            first = [indices[0] for indices in missing.values()]
+            new_texts = [texts[index] for index in first]
+            regex_scans = None if scan is None else scan(new_texts)
+            fresh = self._get_scores(checkers, new_texts, regex_scans, deadline)
+            for index, scored, result in zip(first, fresh, self._build_results(checkers, fresh)):
+                entry = (scored, [float(scored[0].get(category, 0.0)) for category in CATEGORY_NAMES], result)
+                for duplicate in missing[keys[index]]:
+                    entries[duplicate] = entry
+                # Degraded scores are incomplete, so the next turn scores them again
+                if not scored[2]:
+                    fresh_entries.append((keys[index], lengths[index], entry))
+            if store is not None and fresh_entries:
+                store.put_many(conversation_id, fresh_entries)
+        
+        start = time.perf_counter()
+        top = [max(column) for column in zip(*(entry[1] for entry in entries))]
+        stages: List[str] = []
+        degraded: List[str] = []
+        for (_, entry_stages, entry_degraded), _, _ in entries:
+            stages.extend(stage for stage in entry_stages if stage not in stages)
+            degraded.extend(name for name in entry_degraded if name not in degraded)
+        aggregated = self._build_results(checkers, [(dict(zip(CATEGORY_NAMES, top)), stages, degraded)], shape)[0]
+        
+        returned = [index for index in range(len(messages)) if not (new_only and keys[index] not in missing)]
+        if shape == "full":
+            shaped = [entries[index][2] for index in returned]
+        else:
+            # Stored results are in the full shape, so only the returned ones are rebuilt
+            shaped = self._build_results(checkers, [entries[index][0] for index in returned], shape)
+        message_results = []
+        for index, result in zip(returned, shaped):
+            message_id = messages[index][0]
+            message_result = {"index": index}
+            if message_id is not None:
+                message_result["id"] = message_id
+            message_result["cached"] = keys[index] not in missing
+            message_result["result"] = result
+            message_results.append(message_result)
+        metrics.RESPONSE_SECONDS.observe(time.perf_counter() - start)
+        return {
+            "id": f"modr-{uuid.uuid4().hex}",
+            "model": model,
+            "conversation_id": conversation_id,
+            "config_version": checkers.version,
+            "result": aggregated,
+            "messages": message_results,
+        }
     
     def moderate_text(self, text: str) -> ModerationResult:
         """
@@ -149,38 +1028,19 @@ class ModerationService:
         Returns:
             ModerationResult
         """
-        # Get scores from regex checker
-        regex_scores = self.regex_checker.check(text)
-        
-        # Get scores from BERT checker if available
-        bert_scores = None
-        if self.use_bert and self.bert_checker:
-            bert_scores = self.bert_checker.check(text)
-        
-        # Combine scores
-        combined_scores = self._combine_scores(regex_scores, bert_scores)
-        
-        # Convert to response format
-        categories = self._scores_to_categories(combined_scores)
-        category_scores = self._scores_to_category_scores(combined_scores)
-        applied_input_types = self._get_applied_input_types(categories)
-        
-        # Check if any category is flagged
-        flagged = any([
-            #  PII categories
-            categories.pii_phone, categories.pii_email,
-            categories.pii_ip_address, categories.pii_iban,
-            # Legacy categories (for compatibility)
-            categories.violence, 
-            categories.hate_threatening, categories.harassment_threatening,
-        ])
-        
-        return ModerationResult(
-            flagged=flagged,
-            categories=categories,
-            category_scores=category_scores,
-            category_applied_input_types=applied_input_types
-        )
+        return ModerationResult.model_validate(self.moderate_results([text])[0])
+    
+    def moderate_texts(self, texts: List[str]) -> List[ModerationResult]:
+        """
+        Moderate a list of texts with batched checker calls.
+        
+        Args:
+            texts: Texts to moderate
+            
+        Returns:
+            List of ModerationResult in input order
+        """
+        return [ModerationResult.model_validate(result) for result in self.moderate_results(texts)]
     
     def moderate(self, input_data: Union[str, List[str]], model: str = "moderation-latest") -> ModerationResponse:
         """
@@ -193,23 +1053,4 @@ class ModerationService:
         Returns:
             ModerationResponse
         """
-        # Convert single string to list
-        if isinstance(input_data, str):
-            texts = [input_data]
-        else:
-            texts = input_data
-        
-        # Process each text
-        results = []
-        for text in texts:
-            result = self.moderate_text(text)
-            results.append(result)
-        
-        # Generate response
-        response_id = f"modr-{uuid.uuid4().hex}"
-        
-        return ModerationResponse(
-            id=response_id,
-            model=model,
-            results=results
-        )
+        return ModerationResponse.model_validate(self.moderate_payload(input_data, model))
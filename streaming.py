@@ -0,0 +1,173 @@
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+import metrics
+from checkers.scheduling import BULK
+from executor import ModerationExecutor, QueueFullError
+from models import RequestLine, encode_json, encode_result_lines
+from wire import BodyDecodeError
+
+
+class LineTooLongError(ValueError):
+    """Raised when a line of the NDJSON body exceeds the configured maximum."""
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streaming response whose body iterator reads the request body at the same time.
+
+    StreamingResponse listens for a client disconnect with receive() while it
+    streams, which would swallow the request body chunks; here the body
+    iterator is the only reader and sees the disconnect itself.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def _split_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Optional[bytes]]:
+    """
+    Yield complete non-empty lines of a chunked body.
+
+    After the lines of each received chunk a None is yielded, so the caller can
+    flush a partial batch instead of waiting for more input from a slow client.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > max_line_bytes or any(len(line) > max_line_bytes for line in lines):
+            raise LineTooLongError(f"Line exceeds {max_line_bytes} bytes")
+        for line in lines:
+            if line.strip():
+                yield line
+        yield None
+    if buffer.strip():
+        yield buffer
+
+
+async def _moderate_batch(
+    executor: ModerationExecutor, lines: List[RequestLine], retry_after: float, lane: str, shape: str
+) -> bytes:
+    """
+    Moderate the texts of several lines in one call and return their result lines.
+
+    A failing batch answers each of its lines with an error line instead of
+    ending the stream, since the status line is already sent.
+    """
+    texts = [text for line in lines for text in line.texts]
+    results: List[Dict] = []
+    while texts:
+        try:
+            results = await executor.moderate_texts(texts, lane=lane, shape=shape)
+            break
+        except QueueFullError:
+            # A stream throttles instead of failing; the client is held back meanwhile
+            await asyncio.sleep(retry_after)
+        except Exception as e:
+            metrics.TEXTS.labels("error").inc(len(texts))
+            for line in lines:
+                line.error = line.error or f"Moderation failed: {e}"
+            return b"".join(line.output(None) for line in lines)
+    metrics.TEXTS.labels("ok").inc(len(texts))
+    return encode_result_lines(lines, results)
+
+
+async def moderate_ndjson(
+    chunks: AsyncIterator[bytes],
+    executor: ModerationExecutor,
+    lane: str = BULK,
+    batch_size: int = 256,
+    max_inflight: int = 2,
+    max_line_bytes: int = 1 << 20,
+    retry_after: float = 1.0,
+    shape: str = "full",
+) -> AsyncIterator[bytes]:
+    """
+    Moderate an NDJSON body line by line and yield NDJSON result lines as batches finish.
+
+    Lines are grouped into batches of about batch_size texts, and at most
+    max_inflight batches run at a time. Body chunks are only read while there
+    is room for another batch, and results are only produced as fast as the
+    response is sent, so memory stays bounded and a slow reader throttles the
+    uploading client through TCP flow control.
+
+    Args:
+        chunks: Request body chunks
+        executor: Executor the batches run on
+        lane: Priority lane the batches run in
+        batch_size: Texts per moderation call
+        max_inflight: Batches moderated concurrently
+        max_line_bytes: Longest accepted line
+        retry_after: Seconds to wait before retrying a batch rejected by a full queue
+        shape: Shape of the results, "full", "sparse" or "flagged_only" (see ModerationService.moderate_results)
+
+    Yields:
+        One result line per input line, in completion order; "index" is the
+        position of the input line and "id"/"request_id" are echoed back
+    """
+    inflight: Set[asyncio.Task] = set()
+    batch: List[RequestLine] = []
+    batch_texts = 0
+    count = 0
+
+    async def drain(limit: int):
+        """Wait until at most `limit` batches are in flight, yielding finished results."""
+        nonlocal inflight
+        while len(inflight) > limit:
+            done, inflight = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+
+    def harvest() -> List[bytes]:
+        """Take the results of batches that have already finished, without waiting."""
+        done = [task for task in inflight if task.done()]
+        inflight.difference_update(done)
+        return [task.result() for task in done]
+
+    def submit():
+        nonlocal batch, batch_texts
+        inflight.add(asyncio.ensure_future(_moderate_batch(executor, batch, retry_after, lane, shape)))
+        batch, batch_texts = [], 0
+
+    try:
+        async for raw in _split_lines(chunks, max_line_bytes):
+            if raw is None:
+                # End of a received chunk: send what is finished, and do not
+                # hold a partial batch back while the client is slow
+                for output in harvest():
+                    yield output
+                if batch and not inflight:
+                    submit()
+                continue
+
+            line = RequestLine(count, raw)
+            count += 1
+            batch.append(line)
+            batch_texts += len(line.texts)
+            if batch_texts >= batch_size:
+                async for output in drain(max_inflight - 1):
+                    yield output
+                submit()
+
+        if batch:
+            submit()
+        async for output in drain(0):
+            yield output
+    except (LineTooLongError, BodyDecodeError) as e:
+        # The status line is already sent, so report the error in the stream
+        if batch:
+            submit()
+        async for output in drain(0):
+            yield output
+        yield encode_json({"index": count, "error": {"message": str(e)}}) + b"\n"
+    finally:
+        for task in inflight:
+            task.cancel()
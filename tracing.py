@@ -0,0 +1,137 @@
+"""
+Per-request stage timings for the Server-Timing header and slow-request records.
+
+A request that is traced gets a Trace in the TRACE context variable. Stage
+latencies recorded in the metrics (see metrics.STAGE_SECONDS) are also added
+to the trace of the current context, which executor and checker threads
+inherit through contextvars.copy_context(). Work that runs outside the
+request's context (the BERT micro-batcher, process pools) adds its stage
+timings to the trace explicitly.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+# Stages in the order they appear in the Server-Timing header, with their descriptions
+STAGES = {
+    "queue": "Wait for a moderation worker",
+    "regex": "Regex scan",
+    "batch_wait": "Wait for a BERT micro-batch",
+    "tokenization": "BERT tokenization",
+    "forward": "BERT inference",
+    "combine": "Score combination",
+    "response": "Result building",
+    "serialization": "Response encoding",
+}
+
+
+class Trace:
+    """Stage durations of one request, added from whichever thread runs the stage."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        """Add the duration of a stage; a stage that runs several times adds up."""
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    def merge(self, stages: Dict[str, float]):
+        """Add the stage durations collected by another trace."""
+        with self._lock:
+            for stage, seconds in stages.items():
+                self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    @property
+    def stages(self) -> Dict[str, float]:
+        """Seconds per stage so far."""
+        with self._lock:
+            return dict(self._stages)
+
+    def elapsed(self) -> float:
+        """Seconds since the trace started."""
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing header value with the milliseconds per stage and in total.
+
+        BERT runs while the regex stage scans, so the stages can add up to more
+        than the total.
+        """
+        stages = self.stages
+        names = [name for name in STAGES if name in stages] + sorted(set(stages) - set(STAGES))
+        entries = [
+            f'{name};dur={stages[name] * 1000:.3f};desc="{STAGES.get(name, name)}"' for name in names
+        ]
+        entries.append(f'total;dur={self.elapsed() * 1000:.3f};desc="Total"')
+        return ", ".join(entries)
+
+
+# Trace of the request being processed, None while untraced
+TRACE: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+
+
+def current() -> Optional[Trace]:
+    """Trace of the request running in this context, if it is traced."""
+    return TRACE.get()
+
+
+def start() -> Trace:
+    """Start tracing the request running in this context."""
+    trace = Trace()
+    TRACE.set(trace)
+    return trace
+
+
+def record(stage: str, seconds: float):
+    """Add a stage duration to the trace of the current request, if any."""
+    trace = TRACE.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def activate(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    """Record the stages run inside the block into trace (None records nothing)."""
+    token = TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        TRACE.reset(token)
+
+
+def slow_request_record(endpoint: str, trace: Trace, seconds: float, texts: Iterable[str], **fields) -> Dict:
+    """
+    Structured record of a slow request.
+
+    Args:
+        endpoint: Path of the endpoint that served the request
+        trace: Trace of the request
+        seconds: Time from arrival to response
+        texts: Moderated texts, for their count and length
+        **fields: Further fields of the record (e.g. lane, outcome)
+
+    Returns:
+        Dict with the duration and stage durations in milliseconds and the input size
+    """
+    count = chars = longest = 0
+    for text in texts:
+        count += 1
+        chars += len(text)
+        longest = max(longest, len(text))
+    return {
+        "event": "slow_request",
+        "endpoint": endpoint,
+        "duration_ms": round(seconds * 1000, 3),
+        "stages_ms": {stage: round(value * 1000, 3) for stage, value in trace.stages.items()},
+        "texts": count,
+        "input_chars": chars,
+        "max_text_chars": longest,
+        **fields,
+    }
@@ -0,0 +1,358 @@
+import importlib.util
+import zlib
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from models import encode_json
+
+# msgpack bodies and zstd compression are available when their packages are installed
+MSGPACK_AVAILABLE = importlib.util.find_spec("msgpack") is not None
+ZSTD_AVAILABLE = importlib.util.find_spec("zstandard") is not None
+
+if MSGPACK_AVAILABLE:
+    import msgpack
+
+if ZSTD_AVAILABLE:
+    import zstandard
+
+JSON_TYPE = "application/json"
+MSGPACK_TYPE = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+
+# Errors of corrupt compressed bodies
+_DECODE_ERRORS = (zlib.error, ValueError) + ((zstandard.ZstdError,) if ZSTD_AVAILABLE else ())
+
+# Response bodies worth compressing, by content type prefix
+COMPRESSIBLE_TYPES = (JSON_TYPE, MSGPACK_TYPE, "application/x-ndjson", "text/")
+
+
+class BodyDecodeError(HTTPException):
+    """Raised while reading a request body that cannot be decompressed or is too large once decompressed."""
+
+    def __str__(self) -> str:
+        return self.detail
+
+
+def _qualities(header: Optional[str]) -> Dict[str, float]:
+    """Media types or content codings of an Accept or Accept-Encoding header with their q values."""
+    qualities = {}
+    for item in (header or "").split(","):
+        name, *params = item.split(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+
+def response_media_type(accept: Optional[str]) -> str:
+    """
+    Media type of a moderation response for an Accept header.
+
+    msgpack is only chosen when the client lists it at least as high as JSON
+    and msgpack is installed; everything else gets the default JSON.
+    """
+    if not MSGPACK_AVAILABLE or not accept:
+        return JSON_TYPE
+    qualities = _qualities(accept)
+    msgpack_quality = max(qualities.get(media_type, 0.0) for media_type in MSGPACK_TYPES)
+    json_quality = qualities.get(JSON_TYPE, qualities.get("application/*", qualities.get("*/*", 0.0)))
+    return MSGPACK_TYPE if msgpack_quality > 0 and msgpack_quality >= json_quality else JSON_TYPE
+
+
+def encode_msgpack(payload) -> bytes:
+    """Encode a response dict built in the wire format as msgpack."""
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def compress(body: bytes, coding: str, gzip_level: int = 6, zstd_level: int = 3) -> bytes:
+    """Compress a complete body with gzip or zstd."""
+    if coding == "zstd":
+        return zstandard.ZstdCompressor(level=zstd_level).compress(body)
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+class StreamCompressor:
+    """
+    Incremental gzip or zstd compressor for streamed bodies.
+
+    Every compressed chunk is flushed, so the client can decode each result
+    line as soon as it arrives instead of waiting for the compressor's block.
+    """
+
+    def __init__(self, coding: str, gzip_level: int = 6, zstd_level: int = 3):
+        if coding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+
+    def compress(self, chunk: bytes) -> bytes:
+        """Compress a chunk and flush it."""
+        return self._compressor.compress(chunk) + self._compressor.flush(self._flush_mode)
+
+    def finish(self) -> bytes:
+        """End the compressed stream."""
+        return self._compressor.flush()
+
+
+# Largest expansion of zstd input: a 4-byte RLE block decodes to a full 128 KiB block
+_ZSTD_MAX_RATIO = 1 << 15
+
+
+class StreamDecompressor:
+    """
+    Incremental gzip or zstd decompressor with a limit on the decompressed size.
+
+    gzip output is capped at the limit, and zstd input is decompressed in
+    pieces small enough that even the most compressible input cannot expand
+    far beyond it, so a small compressed body cannot take up more memory than
+    the limit. A body that ends inside a gzip member or zstd frame is rejected
+    as truncated.
+    """
+
+    def __init__(self, coding: str, max_bytes: int):
+        self.coding = coding
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._received = 0
+        if coding == "zstd":
+            self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            self._decompressor = zlib.decompressobj(31)
+
+    def decompress(self, chunk: bytes, final: bool = False) -> bytes:
+        """Decompress the next chunk of the body; final marks its last chunk."""
+        self._received += len(chunk)
+        try:
+            if self.coding == "zstd":
+                data = self._decompress_zstd(chunk)
+            else:
+                remaining = self.max_bytes - self._size
+                data = self._decompressor.decompress(chunk, remaining + 1)
+                self._size += len(data)
+        except _DECODE_ERRORS as e:
+            raise BodyDecodeError(400, f"Invalid {self.coding} request body: {e}") from e
+        if self._size > self.max_bytes:
+            raise BodyDecodeError(413, f"Request body exceeds {self.max_bytes} bytes once decompressed")
+        if final and self._received and not self._decompressor.eof:
+            raise BodyDecodeError(400, f"Truncated {self.coding} request body")
+        return data
+
+    def _decompress_zstd(self, chunk: bytes) -> bytes:
+        """Decompress a chunk of zstd frames piece by piece, stopping once the output exceeds the limit."""
+        parts = []
+        position = 0
+        while position < len(chunk) and self._size <= self.max_bytes:
+            step = max(64, (self.max_bytes - self._size) // _ZSTD_MAX_RATIO)
+            piece = chunk[position:position + step]
+            position += len(piece)
+            while piece:
+                if self._decompressor.eof:
+                    # A body may consist of several frames
+                    self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+                data = self._decompressor.decompress(piece)
+                piece = self._decompressor.unused_data if self._decompressor.eof else b""
+                self._size += len(data)
+                parts.append(data)
+        return b"".join(parts)
+
+
+def _replay(body: bytes, receive: Receive) -> Receive:
+    """receive() that returns an already read body, then defers to the original for the disconnect."""
+    sent = False
+
+    async def replay() -> Message:
+        nonlocal sent
+        if sent:
+            return await receive()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return replay
+
+
+async def _error(send: Send, status_code: int, detail: str):
+    """Send a JSON error in the shape of FastAPI's HTTPException responses."""
+    body = encode_json({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", JSON_TYPE.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class WireFormatMiddleware:
+    """
+    ASGI middleware for compressed and msgpack bodies.
+
+    Request bodies with Content-Encoding gzip (or zstd) are decompressed as
+    they are read, and msgpack request bodies are transcoded to JSON before
+    the endpoints parse them. Response bodies of at least min_size bytes are
+    compressed with the best coding in Accept-Encoding (zstd, then gzip);
+    streamed responses are compressed chunk by chunk. Bodies without these
+    headers pass through untouched.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        min_size: int = 1024,
+        gzip_level: int = 6,
+        zstd_level: int = 3,
+        max_decompressed_bytes: int = 64 << 20,
+    ):
+        """
+        Initialize the middleware.
+
+        Args:
+            app: ASGI application to wrap
+            min_size: Smallest response body that is compressed (0 disables response compression)
+            gzip_level: zlib compression level of gzip responses
+            zstd_level: Compression level of zstd responses
+            max_decompressed_bytes: Largest accepted request body after decompression
+        """
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        self.max_decompressed_bytes = max_decompressed_bytes
+        self.request_codings = ("gzip", "zstd") if ZSTD_AVAILABLE else ("gzip",)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        coding = headers.get("content-encoding", "identity").strip().lower()
+        content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        if coding != "identity" and coding not in self.request_codings:
+            await _error(send, 415, f"Unsupported Content-Encoding: {coding}")
+            return
+        if content_type in MSGPACK_TYPES and not MSGPACK_AVAILABLE:
+            await _error(send, 415, "msgpack request bodies need the msgpack package")
+            return
+
+        if coding != "identity" or content_type in MSGPACK_TYPES:
+            if coding != "identity":
+                receive = self._decompressing(receive, coding)
+            if content_type in MSGPACK_TYPES:
+                try:
+                    body = await self._transcode(receive)
+                except BodyDecodeError as e:
+                    await _error(send, e.status_code, e.detail)
+                    return
+                receive = _replay(body, receive)
+            # The endpoints see the decoded body
+            request_headers = MutableHeaders(scope=scope)
+            del request_headers["content-encoding"]
+            del request_headers["content-length"]
+            if content_type in MSGPACK_TYPES:
+                request_headers["content-type"] = JSON_TYPE
+
+        response_coding = self._response_coding(headers.get("accept-encoding")) if self.min_size > 0 else None
+        if response_coding:
+            send = self._compressing(send, response_coding)
+        await self.app(scope, receive, send)
+
+    def _response_coding(self, accept_encoding: Optional[str]) -> Optional[str]:
+        """Best content coding the client accepts, or None to send the body as is."""
+        qualities = _qualities(accept_encoding)
+        for coding in ("zstd", "gzip") if ZSTD_AVAILABLE else ("gzip",):
+            if qualities.get(coding, qualities.get("*", 0.0)) > 0:
+                return coding
+        return None
+
+    def _decompressing(self, receive: Receive, coding: str) -> Receive:
+        """receive() that decompresses the request body chunks."""
+        decompressor = StreamDecompressor(coding, self.max_decompressed_bytes)
+
+        async def decompressing() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                body = decompressor.decompress(message.get("body", b""), not message.get("more_body", False))
+                message = {**message, "body": body}
+            return message
+
+        return decompressing
+
+    async def _transcode(self, receive: Receive) -> bytes:
+        """Read a whole msgpack request body and encode it as JSON."""
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        try:
+            return encode_json(msgpack.unpackb(b"".join(chunks), raw=False))
+        except (ValueError, TypeError) as e:
+            raise BodyDecodeError(400, f"Invalid msgpack request body: {e}") from e
+
+    def _compressing(self, send: Send, coding: str) -> Send:
+        """send() that compresses the response body when its type and size make it worthwhile."""
+        start: Optional[Message] = None
+        compressor: Optional[StreamCompressor] = None
+        passthrough = False
+
+        async def compressing(message: Message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether to compress
+                start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                body = compressor.compress(body)
+                if not more_body:
+                    body += compressor.finish()
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            content_type = headers.get("content-type", "")
+            if (
+                "content-encoding" in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+                or (not more_body and len(body) < self.min_size)
+            ):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            headers["Content-Encoding"] = coding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["content-length"]
+                compressor = StreamCompressor(coding, self.gzip_level, self.zstd_level)
+                body = compressor.compress(body)
+            else:
+                body = compress(body, coding, self.gzip_level, self.zstd_level)
+                headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        return compressing